@@ -0,0 +1,103 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import config_utils
+import db_utils
+
+_BACKUP_CHECK_INTERVAL = 60
+
+# every step copies this amount of pages while the database lock is held
+_BACKUP_STEP_PAGES = 100
+_DELAY_BETWEEN_STEPS = 0.05
+
+_BACKUP_LOCK = threading.Lock()
+
+
+def get_backup_prefix(db_filename: str):
+	return os.path.splitext(os.path.basename(db_filename))[0] + "_"
+
+
+def get_backup_files(prefix: str):
+	if not os.path.isdir(config_utils.BACKUP_DIRECTORY):
+		return []
+
+	file_names = [file_name for file_name in os.listdir(config_utils.BACKUP_DIRECTORY)
+				  if file_name.startswith(prefix) and file_name.endswith(".db")]
+	return [os.path.join(config_utils.BACKUP_DIRECTORY, file_name) for file_name in sorted(file_names)]
+
+
+def rotate_backups(prefix: str):
+	backup_files = get_backup_files(prefix)
+	for backup_file in backup_files[:-config_utils.BACKUP_COUNT]:
+		os.remove(backup_file)
+		logging.info(f"Removed old backup {backup_file}")
+
+
+def backup_database_file(db_filename: str, database: str, backup_time: str):
+	prefix = get_backup_prefix(db_filename)
+	backup_filename = os.path.join(config_utils.BACKUP_DIRECTORY, f"{prefix}{backup_time}.db")
+	temporary_filename = backup_filename + ".tmp"
+
+	start_time = time.perf_counter()
+	try:
+		db_utils.backup_database(temporary_filename, database, _BACKUP_STEP_PAGES, _DELAY_BETWEEN_STEPS)
+		integrity_check_result = db_utils.check_database_integrity(temporary_filename)
+	except Exception:
+		if os.path.exists(temporary_filename):
+			os.remove(temporary_filename)
+		raise
+	if integrity_check_result != ["ok"]:
+		os.remove(temporary_filename)
+		logging.error(f"Backup of {db_filename} is corrupted, integrity check result: {integrity_check_result[:10]}")
+		return
+
+	os.replace(temporary_filename, backup_filename)
+	logging.info(f"Created backup {backup_filename} in {time.perf_counter() - start_time:.2f}s, "
+				 f"size: {os.path.getsize(backup_filename)} bytes")
+	rotate_backups(prefix)
+	return backup_filename
+
+
+def create_backup():
+	"""
+	Creates verified backups of the database and the archive database, returns list of created files
+	or None if another backup is in progress.
+	"""
+	if not _BACKUP_LOCK.acquire(blocking=False):
+		return
+
+	try:
+		os.makedirs(config_utils.BACKUP_DIRECTORY, exist_ok=True)
+		backup_time = time.strftime("%Y%m%d_%H%M%S")
+		databases = [(config_utils.DB_FILENAME, "main")]
+		if db_utils.is_archive_attached():
+			databases.append((config_utils.ARCHIVE_DB_FILENAME, db_utils.ARCHIVE_DATABASE))
+
+		backup_files = []
+		for db_filename, database in databases:
+			try:
+				backup_filename = backup_database_file(db_filename, database, backup_time)
+			except (OSError, sqlite3.Error) as E:
+				logging.error(f"Backup of {db_filename} failed, error: {E}")
+				continue
+			if backup_filename:
+				backup_files.append(backup_filename)
+		return backup_files
+	finally:
+		_BACKUP_LOCK.release()
+
+
+def start_backup_thread():
+	threading.Thread(target=backup_thread).start()
+
+
+def backup_thread():
+	while 1:
+		if config_utils.BACKUP_INTERVAL and time.time() - config_utils.LAST_BACKUP_TIME > config_utils.BACKUP_INTERVAL * 60:
+			create_backup()
+			config_utils.LAST_BACKUP_TIME = int(time.time())
+			config_utils.update_config({"LAST_BACKUP_TIME": config_utils.LAST_BACKUP_TIME})
+		time.sleep(_BACKUP_CHECK_INTERVAL)
@@ -0,0 +1,197 @@
+"""
+Measures throughput of the Bot API requests that the bot sends for tickets against the local fake Bot API server.
+
+New tickets are posted to the main channel and handled by forwarding_utils.forward_and_add_inline_keyboard like new posts
+are handled by the bot: the main message gets hashtags and control buttons and is copied with the keyboard to subchannels
+of the assigned users. Then the interval scan(interval_updating_utils.check_main_messages) reads every ticket
+through the dump chat and updates its messages, the scan runs without DELAY_AFTER_ONE_SCAN and core api reading,
+because the fake server supports only the Bot API.
+Requests are sent by --threads threads through RATE_LIMITER and the shared pooled session like in the bot,
+--requests-per-second and --chat-requests-per-second replace limits of the real Bot API.
+Data is stored in a temporary database, config.json is still required because modules of the bot read it on import,
+but the token from it isn't sent anywhere.
+Usage:
+	python3 benchmark_bot_api.py [--tickets 200] [--subchannels 5] [--threads 8] [--latency 0.02]
+		[--too-many-requests-rate 0.01] [--requests-per-second 1000] [--chat-requests-per-second 1000]
+"""
+import argparse
+import json
+import logging
+import os
+import queue
+import re
+import tempfile
+import threading
+import time
+
+import telebot
+from telebot import apihelper
+
+import channel_manager
+import config_utils
+import db_utils
+import fake_bot_api
+import forwarding_utils
+import interval_updating_utils
+import threading_utils
+import transport_utils
+import utils
+
+MAIN_CHANNEL_ID = -100111111111
+DUMP_CHAT_ID = -100222222222
+FIRST_SUBCHANNEL_ID = -100300000000
+TICKET_PRIORITY = "1"
+
+
+class RequestTimer:
+	"""
+	Request sender that measures latency of every request including waiting for the rate limiter.
+	"""
+	def __init__(self, send_request):
+		self.send_request = send_request
+		self.latencies = []
+
+	def __call__(self, *args, **kwargs):
+		start_time = time.perf_counter()
+		try:
+			return self.send_request(*args, **kwargs)
+		finally:
+			self.latencies.append(time.perf_counter() - start_time)
+
+
+def create_subchannels(fake_server: fake_bot_api.FakeBotApiServer, subchannels: int):
+	db_utils.insert_main_channel(MAIN_CHANNEL_ID)
+	user_tags = []
+	for i in range(subchannels):
+		subchannel_id = FIRST_SUBCHANNEL_ID - i
+		user_tag = f"user{i}"
+		fake_server.add_chat(subchannel_id)
+		db_utils.insert_or_update_user(MAIN_CHANNEL_ID, user_tag, i + 1)
+
+		settings = {
+			channel_manager.SETTING_TYPES.ASSIGNED: [user_tag],
+			channel_manager.SETTING_TYPES.DUE: True,
+			channel_manager.SETTING_TYPES.DEFERRED: True,
+		}
+		db_utils.insert_individual_channel(MAIN_CHANNEL_ID, subchannel_id, json.dumps(settings), i + 1)
+		db_utils.update_individual_channel(subchannel_id, json.dumps(settings), TICKET_PRIORITY)
+		db_utils.update_channel_priorities(subchannel_id, [TICKET_PRIORITY])
+		user_tags.append(user_tag)
+	return user_tags
+
+
+def post_tickets(fake_server: fake_bot_api.FakeBotApiServer, tickets: int, user_tags: list):
+	hashtags = config_utils.HASHTAGS
+	posts = []
+	for i in range(tickets):
+		text = f"ticket {i}\n#{hashtags['OPENED']} #{user_tags[i % len(user_tags)]} #{hashtags['PRIORITY']}{TICKET_PRIORITY}"
+		entities = [{"type": "hashtag", "offset": match.start(), "length": len(match.group())} for match in re.finditer(r"#\w+", text)]
+		channel_post = fake_server.post_channel_message(MAIN_CHANNEL_ID, text, entities)["channel_post"]
+		post_data = telebot.types.Message.de_json(channel_post)
+		utils.store_message_content(post_data)
+		db_utils.insert_main_channel_message(MAIN_CHANNEL_ID, post_data.message_id, 1)
+		posts.append(post_data)
+	return posts
+
+
+def worker_thread(bot: telebot.TeleBot, posts: queue.Queue):
+	while True:
+		try:
+			post_data = posts.get_nowait()
+		except queue.Empty:
+			return
+		forwarding_utils.forward_and_add_inline_keyboard(bot, post_data, new_ticket=True)
+
+
+def handle_new_tickets(bot: telebot.TeleBot, posts: list, threads_count: int):
+	posts_queue = queue.Queue()
+	for post_data in posts:
+		posts_queue.put(post_data)
+	threads = [threading.Thread(target=worker_thread, args=(bot, posts_queue)) for _ in range(threads_count)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+
+
+def scan_tickets(bot: telebot.TeleBot, last_message_id: int):
+	interval_updating_utils._UPDATE_STATUS = True
+	interval_updating_utils.DELAY_AFTER_ONE_SCAN = 0
+	# fake server doesn't support core api, so messages are read through the dump chat like when core api is unavailable
+	interval_updating_utils.read_main_messages = lambda main_channel_id, message_ids: {}
+	try:
+		interval_updating_utils.check_main_messages(bot, MAIN_CHANNEL_ID, last_message_id)
+	finally:
+		interval_updating_utils._UPDATE_STATUS = False
+
+
+def percentile(sorted_values: list, percent: float):
+	if not sorted_values:
+		return 0
+	index = min(int(len(sorted_values) * percent / 100), len(sorted_values) - 1)
+	return sorted_values[index]
+
+
+def measure_stage(name: str, fake_server: fake_bot_api.FakeBotApiServer, request_timer: RequestTimer, func, *args):
+	request_timer.latencies = []
+	method_calls_before = dict(fake_server.method_calls)
+	too_many_requests_before = sum(fake_server.too_many_requests_errors.values())
+	start_time = time.perf_counter()
+	func(*args)
+	total_time = time.perf_counter() - start_time
+
+	latencies = sorted(request_timer.latencies)
+	too_many_requests = sum(fake_server.too_many_requests_errors.values()) - too_many_requests_before
+	method_calls = {method: count - method_calls_before.get(method, 0) for method, count in fake_server.method_calls.items()}
+	print(f"{name}: {len(latencies)} requests in {total_time:.2f}s, {len(latencies) / total_time:.0f}/s, 429 errors: {too_many_requests}")
+	print(f"  Request latency, ms: p50 {percentile(latencies, 50) * 1000:.1f}, "
+		  f"p99 {percentile(latencies, 99) * 1000:.1f}, max {percentile(latencies, 100) * 1000:.1f}")
+	print("  Server calls: " + ", ".join(f"{method} {count}" for method, count in sorted(method_calls.items()) if count))
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Bot API requests benchmark against the fake Bot API server")
+	parser.add_argument("--tickets", type=int, default=200)
+	parser.add_argument("--subchannels", type=int, default=5)
+	parser.add_argument("--threads", type=int, default=8)
+	parser.add_argument("--latency", type=float, default=0.02, help="delay of every fake server response in seconds")
+	parser.add_argument("--too-many-requests-rate", type=float, default=0, help="share of requests answered with 429 error")
+	parser.add_argument("--requests-per-second", type=float, default=1000)
+	parser.add_argument("--chat-requests-per-second", type=float, default=1000)
+	args = parser.parse_args()
+	# retries after 429 errors are logged with tracebacks
+	logging.basicConfig(level=logging.CRITICAL)
+
+	with tempfile.TemporaryDirectory() as temp_dir:
+		db_utils.open_database(os.path.join(temp_dir, "benchmark.db"))
+		db_utils.initialize_db()
+
+		fake_server = fake_bot_api.FakeBotApiServer(latency=args.latency, too_many_requests_rate=args.too_many_requests_rate, seed=1).start()
+		fake_server.add_chat(MAIN_CHANNEL_ID)
+		fake_server.add_chat(DUMP_CHAT_ID)
+		config_utils.DUMP_CHAT_ID = DUMP_CHAT_ID
+		user_tags = create_subchannels(fake_server, args.subchannels)
+		posts = post_tickets(fake_server, args.tickets, user_tags)
+
+		apihelper.API_URL = fake_server.api_url
+		rate_limiter = threading_utils.RateLimiter(args.requests_per_second, args.chat_requests_per_second,
+												   chat_requests_burst=max(int(args.chat_requests_per_second), 1))
+		request_timer = RequestTimer(rate_limiter.send_request)
+		apihelper.CUSTOM_REQUEST_SENDER = request_timer
+		transport_utils.install_session(args.threads)
+		bot = telebot.TeleBot("123:abc", threaded=False)
+
+		print(f"{args.tickets} tickets, {args.subchannels} subchannels, {args.threads} threads, latency {args.latency}s")
+		measure_stage("New tickets", fake_server, request_timer, handle_new_tickets, bot, posts, args.threads)
+		measure_stage("Interval scan", fake_server, request_timer, scan_tickets, bot, posts[-1].message_id)
+		fake_server.stop()
+		db_utils.open_database(db_utils.DB_FILENAME)
+
+	connection_stats = transport_utils.get_connection_stats()
+	edit_counters = utils.get_edit_counters()
+	print(f"Edits: {edit_counters['sent']} sent, {edit_counters['suppressed']} suppressed as not modified")
+	print(f"Connections: {connection_stats['connects']} connects for {connection_stats['requests']} requests")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,137 @@
+"""
+Measures latency of comment thread lookups on threads with a large number of replies.
+
+Creates threads where the first half of replies forms a long reply chain and the second half replies
+directly to the discussion message, then compares get_comments_count, get_comment_top_parent and get_last_comment with
+the previous recursive queries over comment_messages.
+Usage:
+	python3 benchmark_db_comments.py [--replies 10000] [--threads 10] [--lookups 100]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import db_utils
+
+DISCUSSION_CHAT_ID = -100222222222
+BOT_ID = 1
+
+
+def recursive_comments_count(discussion_message_id, discussion_chat_id, ignored_sender_id=0):
+	sql = '''
+		WITH RECURSIVE
+		  reply_messages(comment_id) AS (
+			 SELECT (?)
+			 UNION ALL
+			 SELECT message_id FROM comment_messages, reply_messages WHERE reply_to_message_id = reply_messages.comment_id
+			 AND discussion_chat_id = (?) AND sender_id != (?)
+		  )
+		SELECT count(comment_id) - 1 FROM reply_messages;
+	'''
+	cursor = db_utils.get_cursor()
+	cursor.execute(sql, (discussion_message_id, discussion_chat_id, ignored_sender_id,))
+	return cursor.fetchone()[0]
+
+
+def recursive_comment_top_parent(discussion_message_id, discussion_chat_id):
+	sql = '''
+		WITH RECURSIVE
+		  reply_messages(comment_id) AS (
+		   SELECT (?)
+		   UNION ALL
+		   SELECT reply_to_message_id FROM comment_messages, reply_messages WHERE message_id = reply_messages.comment_id
+		   AND discussion_chat_id = (?)
+		  )
+		SELECT MIN(comment_id) FROM reply_messages;
+	'''
+	cursor = db_utils.get_cursor()
+	cursor.execute(sql, (discussion_message_id, discussion_chat_id,))
+	return cursor.fetchone()[0]
+
+
+def recursive_last_comment(discussion_message_id, discussion_chat_id, ignored_sender_id=0):
+	sql = '''
+		WITH RECURSIVE
+		  reply_messages(comment_id) AS (
+			 SELECT (?)
+			 UNION ALL
+			 SELECT message_id FROM comment_messages, reply_messages WHERE reply_to_message_id = reply_messages.comment_id
+			 AND discussion_chat_id = (?) AND sender_id != (?)
+		  )
+		SELECT MAX(comment_id) FROM reply_messages;
+	'''
+	cursor = db_utils.get_cursor()
+	cursor.execute(sql, (discussion_message_id, discussion_chat_id, ignored_sender_id,))
+	return cursor.fetchone()[0]
+
+
+def populate_threads(threads: int, replies: int):
+	thread_root_ids = []
+	chain_reply_ids = []
+	next_message_id = 1
+	for _ in range(threads):
+		thread_root_id = next_message_id
+		thread_root_ids.append(thread_root_id)
+		next_message_id += 1
+		with db_utils.transaction():
+			for reply_index in range(replies):
+				is_chain_reply = reply_index < replies // 2
+				reply_to_message_id = next_message_id - 1 if is_chain_reply else thread_root_id
+				if is_chain_reply:
+					chain_reply_ids.append(next_message_id)
+				sender_id = BOT_ID if reply_index % 10 == 0 else 100 + reply_index % 7
+				db_utils.insert_comment_message(reply_to_message_id, next_message_id, DISCUSSION_CHAT_ID, sender_id)
+				next_message_id += 1
+	db_utils.flush()
+	return thread_root_ids, chain_reply_ids
+
+
+def measure(lookup_function, arguments: list):
+	start_time = time.perf_counter()
+	for args in arguments:
+		lookup_function(*args)
+	return (time.perf_counter() - start_time) / len(arguments)
+
+
+def main():
+	parser = argparse.ArgumentParser(description="comment thread lookup latency benchmark")
+	parser.add_argument("--replies", type=int, default=10000, help="replies in every thread")
+	parser.add_argument("--threads", type=int, default=10)
+	parser.add_argument("--lookups", type=int, default=100)
+	args = parser.parse_args()
+
+	with tempfile.TemporaryDirectory() as temp_dir:
+		db_utils.open_database(os.path.join(temp_dir, "benchmark.db"))
+		db_utils.initialize_db()
+
+		print(f"Populating {args.threads} threads with {args.replies} replies each...")
+		insert_start = time.perf_counter()
+		thread_root_ids, chain_reply_ids = populate_threads(args.threads, args.replies)
+		insert_time = time.perf_counter() - insert_start
+
+		root_arguments = [(thread_root_ids[i % len(thread_root_ids)], DISCUSSION_CHAT_ID) for i in range(args.lookups)]
+		ignored_arguments = [root_args + (BOT_ID,) for root_args in root_arguments]
+		# the deepest replies of the chains
+		reply_arguments = [(chain_reply_ids[-1 - i], DISCUSSION_CHAT_ID) for i in range(min(args.lookups, len(chain_reply_ids)))]
+		comparisons = {
+			"get_comments_count": (recursive_comments_count, db_utils.get_comments_count, ignored_arguments),
+			"get_comment_top_parent": (recursive_comment_top_parent, db_utils.get_comment_top_parent, reply_arguments),
+			"get_last_comment": (recursive_last_comment, db_utils.get_last_comment, ignored_arguments),
+		}
+
+		results = {}
+		for function_name, (recursive_function, function, arguments) in comparisons.items():
+			results[function_name] = (measure(recursive_function, arguments), measure(function, arguments))
+		db_utils.open_database(db_utils.DB_FILENAME)
+
+	print(f"Inserted {args.threads * args.replies} replies in {insert_time:.2f}s")
+	print(f"{'function':<28}{'recursive, ms':>16}{'stats, ms':>14}{'speedup':>12}")
+	for function_name, (recursive_time, stats_time) in results.items():
+		recursive_ms = recursive_time * 1000
+		stats_ms = stats_time * 1000
+		print(f"{function_name:<28}{recursive_ms:>16.3f}{stats_ms:>14.3f}{recursive_ms / stats_ms:>11.1f}x")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,98 @@
+"""
+Measures read latency of db_utils functions while another thread performs long writes.
+
+Readers call is_main_channel_exists and get_copied_message_data in a loop, the writer emulates
+the interval scan by inserting batches of copied messages. Run with --serialized to emulate the previous
+single-connection design where every reader waited for _DB_LOCK.
+Usage:
+	python3 benchmark_db_contention.py [--readers 4] [--seconds 5] [--batch 2000] [--serialized]
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+import db_utils
+
+MAIN_CHANNEL_ID = -100111111111
+SUBCHANNEL_ID = -100300000000
+PREFILLED_ROWS = 100000
+
+
+@db_utils.db_thread_lock
+def insert_copied_messages_batch(first_message_id: int, batch_size: int):
+	for message_id in range(first_message_id, first_message_id + batch_size):
+		db_utils.insert_copied_message(message_id, MAIN_CHANNEL_ID, message_id, SUBCHANNEL_ID)
+
+
+def reader_thread(stop_event: threading.Event, serialized: bool, latencies: list):
+	while not stop_event.is_set():
+		message_id = random.randint(1, PREFILLED_ROWS)
+		start_time = time.perf_counter()
+		if serialized:
+			with db_utils._DB_LOCK:
+				db_utils.is_main_channel_exists(MAIN_CHANNEL_ID)
+				db_utils.get_copied_message_data(message_id, MAIN_CHANNEL_ID)
+		else:
+			db_utils.is_main_channel_exists(MAIN_CHANNEL_ID)
+			db_utils.get_copied_message_data(message_id, MAIN_CHANNEL_ID)
+		latencies.append(time.perf_counter() - start_time)
+
+
+def writer_thread(stop_event: threading.Event, batch_size: int, write_counter: list):
+	next_message_id = PREFILLED_ROWS + 1
+	while not stop_event.is_set():
+		insert_copied_messages_batch(next_message_id, batch_size)
+		next_message_id += batch_size
+		write_counter[0] += batch_size
+
+
+def percentile(sorted_values: list, percent: float):
+	if not sorted_values:
+		return 0
+	index = min(int(len(sorted_values) * percent / 100), len(sorted_values) - 1)
+	return sorted_values[index]
+
+
+def main():
+	parser = argparse.ArgumentParser(description="db_utils reader/writer contention benchmark")
+	parser.add_argument("--readers", type=int, default=4)
+	parser.add_argument("--seconds", type=float, default=5)
+	parser.add_argument("--batch", type=int, default=2000, help="rows inserted by one writer call")
+	parser.add_argument("--serialized", action="store_true", help="readers wait for the writer lock")
+	args = parser.parse_args()
+
+	with tempfile.TemporaryDirectory() as temp_dir:
+		db_utils.open_database(os.path.join(temp_dir, "benchmark.db"))
+		db_utils.initialize_db()
+		db_utils.insert_main_channel(MAIN_CHANNEL_ID)
+		insert_copied_messages_batch(1, PREFILLED_ROWS)
+
+		stop_event = threading.Event()
+		reader_latencies = [[] for _ in range(args.readers)]
+		write_counter = [0]
+		threads = [threading.Thread(target=reader_thread, args=(stop_event, args.serialized, latencies))
+				   for latencies in reader_latencies]
+		threads.append(threading.Thread(target=writer_thread, args=(stop_event, args.batch, write_counter)))
+
+		for thread in threads:
+			thread.start()
+		time.sleep(args.seconds)
+		stop_event.set()
+		for thread in threads:
+			thread.join()
+
+		db_utils.open_database(db_utils.DB_FILENAME)
+
+	latencies = sorted(latency for reader in reader_latencies for latency in reader)
+	mode = "serialized readers" if args.serialized else "connection pool"
+	print(f"Mode: {mode}, {args.readers} readers, 1 writer, {args.seconds}s")
+	print(f"Reads: {len(latencies) / args.seconds:.0f}/s, writes: {write_counter[0] / args.seconds:.0f} rows/s")
+	print(f"Read latency, ms: p50 {percentile(latencies, 50) * 1000:.3f}, "
+		  f"p99 {percentile(latencies, 99) * 1000:.3f}, max {percentile(latencies, 100) * 1000:.3f}")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,95 @@
+"""
+Measures lookup latency of the hot db_utils functions before and after schema migrations are applied.
+
+Creates a synthetic database in a temporary directory, so the real taskhelper_data.db is never touched.
+Usage:
+	python3 benchmark_db_indexes.py [--rows 1000000] [--lookups 200]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import db_utils
+
+MAIN_CHANNEL_ID = -100111111111
+DISCUSSION_CHAT_ID = -100222222222
+SUBCHANNEL_IDS = [-100300000000 - i for i in range(20)]
+
+
+def populate_database(rows: int):
+	copied_messages = []
+	discussion_messages = []
+	comment_messages = []
+	for main_message_id in range(1, rows + 1):
+		copied_channel_id = SUBCHANNEL_IDS[main_message_id % len(SUBCHANNEL_IDS)]
+		copied_messages.append((main_message_id, MAIN_CHANNEL_ID, main_message_id, copied_channel_id))
+		discussion_messages.append((main_message_id, MAIN_CHANNEL_ID, main_message_id))
+		comment_messages.append((DISCUSSION_CHAT_ID, main_message_id, max(main_message_id - 1, 1), 0))
+
+	cursor = db_utils.get_cursor()
+	cursor.executemany('''
+		INSERT INTO copied_messages (main_message_id, main_channel_id, copied_message_id, copied_channel_id)
+		VALUES (?, ?, ?, ?)
+	''', copied_messages)
+	cursor.executemany('''
+		INSERT INTO discussion_messages (main_message_id, main_channel_id, discussion_message_id)
+		VALUES (?, ?, ?)
+	''', discussion_messages)
+	cursor.executemany('''
+		INSERT INTO comment_messages (discussion_chat_id, message_id, reply_to_message_id, sender_id)
+		VALUES (?, ?, ?, ?)
+	''', comment_messages)
+	db_utils.get_connection().commit()
+
+
+def measure_lookups(rows: int, lookups: int):
+	message_ids = [random.randint(1, rows) for _ in range(lookups)]
+	lookup_functions = {
+		"get_copied_message_data": lambda msg_id: db_utils.get_copied_message_data(msg_id, MAIN_CHANNEL_ID),
+		"get_main_message_from_copied": lambda msg_id: db_utils.get_main_message_from_copied(
+			msg_id, SUBCHANNEL_IDS[msg_id % len(SUBCHANNEL_IDS)]),
+		"get_discussion_message_id": lambda msg_id: db_utils.get_discussion_message_id(msg_id, MAIN_CHANNEL_ID),
+		"is_comment_exist": lambda msg_id: db_utils.is_comment_exist(msg_id, DISCUSSION_CHAT_ID),
+	}
+
+	results = {}
+	for function_name, lookup_function in lookup_functions.items():
+		start_time = time.perf_counter()
+		for msg_id in message_ids:
+			lookup_function(msg_id)
+		results[function_name] = (time.perf_counter() - start_time) / lookups
+	return results
+
+
+def main():
+	parser = argparse.ArgumentParser(description="db_utils lookup latency benchmark")
+	parser.add_argument("--rows", type=int, default=1000000)
+	parser.add_argument("--lookups", type=int, default=200)
+	args = parser.parse_args()
+
+	with tempfile.TemporaryDirectory() as temp_dir:
+		db_utils.open_database(os.path.join(temp_dir, "benchmark.db"))
+		db_utils.create_tables()
+
+		print(f"Populating synthetic database with {args.rows} rows per table...")
+		populate_database(args.rows)
+
+		before = measure_lookups(args.rows, args.lookups)
+		migration_start = time.perf_counter()
+		db_utils.apply_migrations()
+		migration_time = time.perf_counter() - migration_start
+		after = measure_lookups(args.rows, args.lookups)
+		db_utils.open_database(db_utils.DB_FILENAME)
+
+	print(f"Migrations applied in {migration_time:.2f}s, schema version {len(db_utils.MIGRATIONS)}")
+	print(f"{'function':<32}{'before, ms':>14}{'after, ms':>14}{'speedup':>12}")
+	for function_name in before:
+		before_ms = before[function_name] * 1000
+		after_ms = after[function_name] * 1000
+		print(f"{function_name:<32}{before_ms:>14.3f}{after_ms:>14.3f}{before_ms / after_ms:>11.1f}x")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,98 @@
+"""
+Measures archiving of old tickets on a synthetic database: rows moved to the archive, size reduction
+of the main database and the longest time one batch held the database lock. Batches are processed
+the same way as in retention_utils, which isn't imported because it requires config.json.
+
+The older half of the tickets is closed and wasn't updated for a year, every ticket has comments and bookkeeping rows.
+Usage:
+	python3 benchmark_db_retention.py [--tickets 20000] [--comments 5]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import db_utils
+
+MAIN_CHANNEL_ID = -100111111111
+DISCUSSION_CHAT_ID = -100222222222
+RETENTION_DAYS = 90
+BATCH_SIZE = 100
+
+
+def populate_database(tickets: int, comments: int):
+	year_ago = int(time.time()) - 365 * 24 * 60 * 60
+	cursor = db_utils.get_cursor()
+	for main_message_id in range(1, tickets + 1):
+		discussion_message_id = main_message_id * (comments + 1)
+		is_opened = 1 if main_message_id > tickets // 2 else 0
+		cursor.execute("INSERT INTO main_messages (main_channel_id, main_message_id, sender_id) VALUES (?, ?, ?)",
+					   (MAIN_CHANNEL_ID, main_message_id, 1))
+		cursor.execute('''
+			INSERT INTO tickets_data (main_channel_id, main_message_id, is_opened, user_tags, priority, update_time)
+			VALUES (?, ?, ?, ?, ?, ?)
+		''', (MAIN_CHANNEL_ID, main_message_id, is_opened, "user1", "1", year_ago))
+		cursor.execute("INSERT INTO discussion_messages (main_channel_id, main_message_id, discussion_message_id) VALUES (?, ?, ?)",
+					   (MAIN_CHANNEL_ID, main_message_id, discussion_message_id))
+		cursor.execute("INSERT INTO next_action_comments (main_channel_id, main_message_id, current_comment_text) VALUES (?, ?, ?)",
+					   (MAIN_CHANNEL_ID, main_message_id, "next action " * 10))
+		cursor.execute("INSERT INTO reminded_tickets (main_channel_id, main_message_id, user_tag, reminded_at) VALUES (?, ?, ?, ?)",
+					   (MAIN_CHANNEL_ID, main_message_id, "user1", year_ago))
+		cursor.execute("INSERT INTO sent_scheduled_messages (main_channel_id, main_message_id, sent_at) VALUES (?, ?, ?)",
+					   (MAIN_CHANNEL_ID, main_message_id, year_ago))
+		for comment_index in range(1, comments + 1):
+			cursor.execute('''
+				INSERT INTO comment_messages (discussion_chat_id, message_id, reply_to_message_id, sender_id, thread_root_id)
+				VALUES (?, ?, ?, ?, ?)
+			''', (DISCUSSION_CHAT_ID, discussion_message_id + comment_index, discussion_message_id, 1, discussion_message_id))
+	cursor.execute("INSERT INTO main_channels (channel_id) VALUES (?)", (MAIN_CHANNEL_ID,))
+	db_utils.get_connection().commit()
+
+
+def main():
+	parser = argparse.ArgumentParser(description="db_utils retention engine benchmark")
+	parser.add_argument("--tickets", type=int, default=20000)
+	parser.add_argument("--comments", type=int, default=5, help="comments of every ticket")
+	args = parser.parse_args()
+
+	batch_times = []
+	moved_rows = {}
+	with tempfile.TemporaryDirectory() as temp_dir:
+		db_utils.open_database(os.path.join(temp_dir, "benchmark.db"), archive_filename=os.path.join(temp_dir, "archive.db"))
+		db_utils.initialize_db()
+		populate_database(args.tickets, args.comments)
+
+		start_time = time.perf_counter()
+		size_before = db_utils.get_database_size()
+		closed_before = int(time.time()) - RETENTION_DAYS * 24 * 60 * 60
+		last_message_id = 0
+		while True:
+			main_message_ids = db_utils.get_archivable_tickets(
+				MAIN_CHANNEL_ID, DISCUSSION_CHAT_ID, closed_before, last_message_id, BATCH_SIZE)
+			if not main_message_ids:
+				break
+			batch_start = time.perf_counter()
+			for table_name, rows_count in db_utils.archive_tickets(MAIN_CHANNEL_ID, main_message_ids, DISCUSSION_CHAT_ID).items():
+				moved_rows[table_name] = moved_rows.get(table_name, 0) + rows_count
+			batch_times.append(time.perf_counter() - batch_start)
+			last_message_id = main_message_ids[-1]
+		size_after = db_utils.get_database_size()
+		elapsed_time = time.perf_counter() - start_time
+
+		sender_lookup_start = time.perf_counter()
+		for main_message_id in range(1, args.tickets + 1):
+			db_utils.get_main_message_sender(MAIN_CHANNEL_ID, main_message_id)
+		sender_lookup_time = (time.perf_counter() - sender_lookup_start) / args.tickets
+		db_utils.open_database(db_utils.DB_FILENAME)
+
+	print(f"Tickets: {args.tickets}, comments per ticket: {args.comments}, archiving: {elapsed_time:.2f}s")
+	print(f"Moved rows: {sum(moved_rows.values())} {moved_rows}")
+	print(f"Main database data size: {size_before / 1024:.0f} KiB -> {size_after / 1024:.0f} KiB "
+		  f"({(size_before - size_after) * 100 / size_before:.0f}% less)")
+	print(f"Batches: {len(batch_times)}, lock held per batch, ms: max {max(batch_times) * 1000:.2f}, "
+		  f"avg {sum(batch_times) * 1000 / len(batch_times):.2f}")
+	print(f"Sender lookup with archive fallback: {sender_lookup_time * 1000:.3f} ms")
+
+
+if __name__ == "__main__":
+	main()
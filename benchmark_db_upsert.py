@@ -0,0 +1,122 @@
+"""
+Measures throughput of handle_post-style write bursts.
+
+Every post performs the same database writes as handle_post and ticket data update: last message id,
+main channel message, discussion message and ticket data. Run with --legacy to emulate the previous
+insert_or_update_* functions that did a SELECT before UPDATE or INSERT.
+Usage:
+	python3 benchmark_db_upsert.py [--posts 20000] [--threads 4] [--legacy] [--backend memory]
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+import db_utils
+
+MAIN_CHANNEL_ID = -100111111111
+DISCUSSION_CHAT_ID = -100222222222
+
+
+@db_utils.db_thread_lock
+def legacy_insert_or_update_last_msg_id(last_message_id, chat_id):
+	if db_utils.get_last_message_id(chat_id):
+		sql = "UPDATE last_message_ids SET last_message_id=(?) WHERE chat_id=(?)"
+	else:
+		sql = "INSERT INTO last_message_ids (last_message_id, chat_id) VALUES (?, ?)"
+	db_utils.get_cursor().execute(sql, (last_message_id, chat_id,))
+
+
+@db_utils.db_thread_lock
+def legacy_insert_main_channel_message(main_channel_id, main_message_id, sender_id):
+	if not db_utils.is_main_message_exists(main_channel_id, main_message_id):
+		sql = "INSERT INTO main_messages (main_channel_id, main_message_id, sender_id) VALUES (?, ?, ?)"
+		db_utils.get_cursor().execute(sql, (main_channel_id, main_message_id, sender_id,))
+
+
+@db_utils.db_thread_lock
+def legacy_insert_or_update_discussion_message(main_message_id, main_channel_id, discussion_message_id):
+	if db_utils.get_discussion_message_id(main_message_id, main_channel_id):
+		sql = "UPDATE discussion_messages SET discussion_message_id=(?) WHERE main_message_id=(?) and main_channel_id=(?)"
+	else:
+		sql = "INSERT INTO discussion_messages (discussion_message_id, main_message_id, main_channel_id) VALUES (?, ?, ?)"
+	db_utils.get_cursor().execute(sql, (discussion_message_id, main_message_id, main_channel_id,))
+
+
+@db_utils.db_thread_lock
+def legacy_insert_or_update_ticket_data(main_message_id, main_channel_id, is_opened, user_tags, priority):
+	if db_utils.get_ticket_data(main_message_id, main_channel_id):
+		sql = "UPDATE tickets_data SET is_opened=(?), user_tags=(?), priority=(?) WHERE main_message_id=(?) and main_channel_id=(?)"
+	else:
+		sql = "INSERT INTO tickets_data(is_opened, user_tags, priority, main_message_id, main_channel_id) VALUES (?, ?, ?, ?, ?)"
+	db_utils.get_cursor().execute(sql, (1 if is_opened else 0, user_tags, priority, main_message_id, main_channel_id,))
+
+
+UPSERT_FUNCTIONS = (
+	db_utils.insert_or_update_last_msg_id,
+	db_utils.insert_main_channel_message,
+	db_utils.insert_or_update_discussion_message,
+	db_utils.insert_or_update_ticket_data,
+)
+
+LEGACY_FUNCTIONS = (
+	legacy_insert_or_update_last_msg_id,
+	legacy_insert_main_channel_message,
+	legacy_insert_or_update_discussion_message,
+	legacy_insert_or_update_ticket_data,
+)
+
+
+def handle_posts(message_ids: range, functions: tuple):
+	update_last_msg_id, insert_main_message, update_discussion_message, update_ticket_data = functions
+	for message_id in message_ids:
+		update_last_msg_id(message_id, MAIN_CHANNEL_ID)
+		insert_main_message(MAIN_CHANNEL_ID, message_id, 1)
+		update_discussion_message(message_id, MAIN_CHANNEL_ID, message_id)
+		update_ticket_data(message_id, MAIN_CHANNEL_ID, True, "user1,user2", "1")
+		# post is edited right after it was created, so every row is written twice
+		update_ticket_data(message_id, MAIN_CHANNEL_ID, True, "user1", "2")
+
+
+def main():
+	parser = argparse.ArgumentParser(description="db_utils insert or update throughput benchmark")
+	parser.add_argument("--posts", type=int, default=20000)
+	parser.add_argument("--threads", type=int, default=4)
+	parser.add_argument("--legacy", action="store_true", help="SELECT before UPDATE or INSERT")
+	parser.add_argument("--backend", choices=list(db_utils.STORAGE_BACKENDS), default=db_utils.SQLITE_BACKEND)
+	args = parser.parse_args()
+
+	functions = LEGACY_FUNCTIONS if args.legacy else UPSERT_FUNCTIONS
+	posts_per_thread = args.posts // args.threads
+	with tempfile.TemporaryDirectory() as temp_dir:
+		db_utils.open_database(os.path.join(temp_dir, "benchmark.db"), args.backend)
+		db_utils.initialize_db()
+
+		threads = []
+		for thread_index in range(args.threads):
+			first_message_id = thread_index * posts_per_thread + 1
+			message_ids = range(first_message_id, first_message_id + posts_per_thread)
+			threads.append(threading.Thread(target=handle_posts, args=(message_ids, functions)))
+
+		start_time = time.perf_counter()
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		db_utils.flush()
+		elapsed_time = time.perf_counter() - start_time
+
+		duplicates = db_utils.get_cursor().execute(
+			"SELECT count(*) - count(DISTINCT main_message_id) FROM tickets_data").fetchone()[0]
+		db_utils.open_database(db_utils.DB_FILENAME)
+
+	posts = posts_per_thread * args.threads
+	mode = "legacy select and write" if args.legacy else "upsert"
+	print(f"Mode: {mode}, {args.backend} backend, {posts} posts, {args.threads} threads, {elapsed_time:.2f}s")
+	print(f"Throughput: {posts / elapsed_time:.0f} posts/s, {posts * 5 / elapsed_time:.0f} writes/s")
+	print(f"Duplicate ticket rows: {duplicates}")
+
+
+if __name__ == "__main__":
+	main()
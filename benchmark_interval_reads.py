@@ -0,0 +1,78 @@
+"""
+Compares reading of main channel messages by the interval scan: forwarding every message to the dump chat
+against batched core api requests. Messages are only read, nothing is edited in the channel.
+
+Requires config.json with the bot token, api id and api hash, the bot must be an admin of the channel and the dump chat.
+Time of the scan also includes DELAY_AFTER_ONE_SCAN that is made after every forwarded message
+and after every scan batch read through the core api.
+Usage:
+	python3 benchmark_interval_reads.py --channel -100123456789 --last-message 5000 [--messages 1000]
+"""
+import argparse
+import time
+
+import telebot
+
+import config_utils
+import core_api
+import db_utils
+import interval_updating_utils
+import threading_utils
+import utils
+
+
+def read_from_dump_chat(bot: telebot.TeleBot, channel_id: int, message_ids: list):
+	read_messages = 0
+	for message_id in message_ids:
+		try:
+			if utils.forward_main_message_to_dump_chat(bot, channel_id, message_id):
+				read_messages += 1
+		except telebot.apihelper.ApiTelegramException:
+			continue
+	return read_messages
+
+
+def read_from_core_api(channel_id: int, message_ids: list):
+	read_messages = 0
+	for message_json in core_api.get_messages_json(channel_id, message_ids).values():
+		if message_json is None:
+			continue
+		telebot.types.Message.de_json(message_json)
+		utils.get_forwarded_message_from_json(dict(message_json))
+		read_messages += 1
+	return read_messages
+
+
+def main():
+	parser = argparse.ArgumentParser(description="interval scan message reading benchmark")
+	parser.add_argument("--channel", type=int, required=True, help="id of the main channel")
+	parser.add_argument("--last-message", type=int, required=True, help="id of the newest message to read")
+	parser.add_argument("--messages", type=int, default=1000)
+	args = parser.parse_args()
+
+	db_utils.open_database(config_utils.DB_FILENAME, config_utils.DB_BACKEND, config_utils.ARCHIVE_DB_FILENAME)
+	telebot.apihelper.CUSTOM_REQUEST_SENDER = threading_utils.RATE_LIMITER.send_request
+	bot = telebot.TeleBot(config_utils.BOT_TOKEN)
+	message_ids = list(range(args.last_message, max(args.last_message - args.messages, 0), -1))
+
+	start_time = time.perf_counter()
+	core_api_messages = read_from_core_api(args.channel, message_ids)
+	core_api_time = time.perf_counter() - start_time
+	scan_batches = -(-len(message_ids) // interval_updating_utils._SCAN_BATCH_SIZE)
+	core_api.close_client()
+
+	start_time = time.perf_counter()
+	dump_chat_messages = read_from_dump_chat(bot, args.channel, message_ids)
+	dump_chat_time = time.perf_counter() - start_time
+
+	scale = 1000 / len(message_ids)
+	scan_delay = config_utils.DELAY_AFTER_ONE_SCAN
+	print(f"Messages: {len(message_ids)}, read through dump chat: {dump_chat_messages}, read through core api: {core_api_messages}")
+	print(f"Dump chat: {dump_chat_time * scale:.1f}s per 1k messages, "
+		  f"with scan delay: {(dump_chat_time + len(message_ids) * scan_delay) * scale:.1f}s")
+	print(f"Core api: {core_api_time * scale:.1f}s per 1k messages, "
+		  f"with scan delay: {(core_api_time + scan_batches * scan_delay) * scale:.1f}s")
+
+
+if __name__ == "__main__":
+	main()
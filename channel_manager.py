@@ -75,8 +75,7 @@ _DEFAULT_SETTINGS = {
 
 
 def get_individual_channel_settings(channel_id: int):
-	settings_str, priorities_str = db_utils.get_individual_channel_settings(channel_id)
-	settings = json.loads(settings_str) if settings_str else {}
+	settings, priorities_str = db_utils.get_cached_channel_settings(channel_id)
 	priorities = priorities_str.split(",") if priorities_str else []
 	return settings, priorities
 
@@ -530,14 +529,17 @@ def save_channel_settings(bot: telebot.TeleBot, call: CallbackQuery):
 	priorities_str = _TYPE_SEPARATOR.join(priorities)
 	settings_str = json.dumps(settings)
 
-	db_utils.update_individual_channel(channel_id, settings_str, priorities_str)
+	with db_utils.transaction():
+		db_utils.update_individual_channel(channel_id, settings_str, priorities_str)
+		db_utils.update_channel_priorities(channel_id, priorities)
 
 
 def add_new_user_tag_to_channels(main_channel_id: int, user_tag: str):
+	settings_version = db_utils.get_settings_cache_version()
 	channel_data = db_utils.get_all_individual_channels(main_channel_id)
 	for channel in channel_data:
 		channel_id, settings = channel
-		settings = json.loads(settings)
+		settings = db_utils.parse_channel_settings(channel_id, settings, settings_version)
 		assigned = settings.get(SETTING_TYPES.ASSIGNED) or []
 		reported = settings.get(SETTING_TYPES.REPORTED) or []
 		followed = settings.get(SETTING_TYPES.FOLLOWED) or []
@@ -554,10 +556,11 @@ def add_new_user_tag_to_channels(main_channel_id: int, user_tag: str):
 
 
 def remove_user_tag_from_channels(main_channel_id: int, user_tag: str):
+	settings_version = db_utils.get_settings_cache_version()
 	channel_data = db_utils.get_all_individual_channels(main_channel_id)
 	for channel in channel_data:
 		channel_id, settings = channel
-		settings = json.loads(settings)
+		settings = db_utils.parse_channel_settings(channel_id, settings, settings_version)
 
 		tag_filter = lambda t: t != user_tag
 		for setting_type in [SETTING_TYPES.ASSIGNED, SETTING_TYPES.REPORTED, SETTING_TYPES.FOLLOWED]:
@@ -1,8 +1,10 @@
 import copy
+import threading
 
 import pytz
 import telebot
 
+import backup_utils
 import channel_manager
 import config_utils
 import core_api
@@ -10,10 +12,15 @@ import db_utils
 import forwarding_utils
 import hashtag_data
 import interval_updating_utils
+import threading_utils
+import transport_utils
 import user_utils
 import utils
 from scheduled_messages_utils import scheduled_message_dispatcher
 
+DEFAULT_DB_STATS_COUNT = 10
+MAX_MESSAGE_LENGTH = 4096
+
 
 def initialize_bot_commands(bot: telebot.TeleBot):
 	commands = []
@@ -81,6 +88,11 @@ def handle_help_command(bot: telebot.TeleBot, msg_data: telebot.types.Message, a
 	help_text += "Example: /set_hashtag_text opened Op\n\n"
 	help_text += "/set_remind_without_interaction <MINUTES> — changes timeout for skipping daily reminder if user is interacted with tickets within this time\n"
 	help_text += "Example: /set_remind_without_interaction 1440\n\n"
+	help_text += "/db_stats <COUNT> — shows database functions with the largest total time, 10 functions by default\n"
+	help_text += "Example: /db_stats 5\n\n"
+	help_text += "/backup — creates backup of the database in the backups directory\n\n"
+	help_text += "/api_stats — shows queue depth and wait time of Bot API requests for every priority, reuse of connections and amount of skipped edits\n\n"
+	help_text += "/update_stats — shows amount of queued updates and their wait and handling time for every channel\n\n"
 	bot.send_message(chat_id=msg_data.chat.id, text=help_text)
 
 
@@ -330,6 +342,91 @@ def handle_change_remind_without_interaction(bot: telebot.TeleBot, msg_data: tel
 	config_utils.update_config({"REMINDER_TIME_WITHOUT_INTERACTION": config_utils.REMINDER_TIME_WITHOUT_INTERACTION})
 
 
+def format_histogram(histogram: list):
+	bucket_texts = []
+	for bucket_index, calls in enumerate(histogram):
+		if not calls:
+			continue
+		if bucket_index < len(db_utils.QUERY_TIME_BUCKETS):
+			bucket_name = f"≤{db_utils.QUERY_TIME_BUCKETS[bucket_index] * 1000:g}ms"
+		else:
+			bucket_name = f">{db_utils.QUERY_TIME_BUCKETS[-1] * 1000:g}ms"
+		bucket_texts.append(f"{bucket_name}: {calls}")
+	return ", ".join(bucket_texts)
+
+
+def handle_db_stats(bot: telebot.TeleBot, msg_data: telebot.types.Message, arguments: str):
+	try:
+		functions_count = int(arguments)
+	except ValueError:
+		functions_count = DEFAULT_DB_STATS_COUNT
+
+	top_functions = db_utils.get_query_stats(functions_count)
+	if not top_functions:
+		bot.send_message(chat_id=msg_data.chat.id, text="No database calls were recorded.")
+		return
+
+	stats_text = ""
+	for function_name, stats in top_functions:
+		stats_text += f"{function_name}: {stats['calls']} calls, total {stats['total_time'] * 1000:.1f}ms, "
+		stats_text += f"avg {stats['total_time'] * 1000 / stats['calls']:.2f}ms, max {stats['max_time'] * 1000:.1f}ms, "
+		stats_text += f"lock wait {stats['lock_wait_time'] * 1000:.1f}ms\n"
+		stats_text += f"time: {format_histogram(stats['time_histogram'])}\n"
+		stats_text += f"lock wait: {format_histogram(stats['lock_wait_histogram'])}\n\n"
+	bot.send_message(chat_id=msg_data.chat.id, text=stats_text[:MAX_MESSAGE_LENGTH])
+
+
+def handle_backup(bot: telebot.TeleBot, msg_data: telebot.types.Message, arguments: str):
+	def create_backup_and_report():
+		backup_files = backup_utils.create_backup()
+		if backup_files is None:
+			text = "Backup is already in progress."
+		elif not backup_files:
+			text = "Backup failed, check the logs for details."
+		else:
+			text = "Backup successfully created: " + ", ".join(backup_files)
+		bot.send_message(chat_id=msg_data.chat.id, text=text)
+
+	bot.send_message(chat_id=msg_data.chat.id, text="Backup started.")
+	threading.Thread(target=create_backup_and_report).start()
+
+
+def handle_api_stats(bot: telebot.TeleBot, msg_data: telebot.types.Message, arguments: str):
+	stats_text = ""
+	for priority, stats in threading_utils.RATE_LIMITER.scheduler.get_stats().items():
+		average_wait_time = stats["total_wait_time"] / stats["requests"] if stats["requests"] else 0
+		stats_text += f"{priority}: {stats['queue_depth']} queued, {stats['requests']} sent, "
+		stats_text += f"avg wait {average_wait_time * 1000:.1f}ms, max wait {stats['max_wait_time'] * 1000:.1f}ms\n"
+	connection_stats = transport_utils.get_connection_stats()
+	stats_text += f"connections: {connection_stats['connects']} connects, {connection_stats['requests']} requests, "
+	stats_text += f"{connection_stats['reused_requests']} sent through reused connections\n"
+	for connection in connection_stats["connections"]:
+		stats_text += f"connection: {connection['requests']} requests, {connection['connects']} connects, "
+		stats_text += f"age {connection['age'] / 60:.0f}min\n"
+	edit_counters = utils.get_edit_counters()
+	stats_text += f"edits: {edit_counters['sent']} sent, {edit_counters['suppressed']} suppressed without changes\n"
+	bot.send_message(chat_id=msg_data.chat.id, text=stats_text)
+
+
+def handle_update_stats(bot: telebot.TeleBot, msg_data: telebot.types.Message, arguments: str):
+	if not isinstance(bot.worker_pool, threading_utils.ShardedThreadPool):
+		bot.send_message(chat_id=msg_data.chat.id, text="Updates are not handled by the sharded worker pool.")
+		return
+
+	stats = bot.worker_pool.get_stats()
+	stats_text = f"Queued updates: {stats['queued_updates']}, max: {stats['max_queued_updates']}, "
+	stats_text += f"tickets in progress: {stats['active_shards']}\n\n"
+	sorted_shards = sorted(stats["shards"].items(), key=lambda item: item[1]["max_wait_time"], reverse=True)
+	for chat_id, shard_stats in sorted_shards:
+		updates = shard_stats["updates"]
+		stats_text += f"{chat_id}: {updates} updates, "
+		stats_text += f"avg wait {shard_stats['total_wait_time'] * 1000 / updates:.1f}ms, "
+		stats_text += f"max wait {shard_stats['max_wait_time'] * 1000:.1f}ms, "
+		stats_text += f"avg handling {shard_stats['total_handling_time'] * 1000 / updates:.1f}ms, "
+		stats_text += f"max handling {shard_stats['max_handling_time'] * 1000:.1f}ms\n"
+	bot.send_message(chat_id=msg_data.chat.id, text=stats_text[:MAX_MESSAGE_LENGTH])
+
+
 COMMAND_LIST = [
 	["/help", "Command explanations", handle_help_command],
 	["/set_dump_chat_id", "Set dump chat id", handle_set_dump_chat_id],
@@ -343,5 +440,9 @@ COMMAND_LIST = [
 	["/set_button_text", "Set text of specified button", handle_change_button_text],
 	["/set_hashtag_text", "Set text of specified hashtag", handle_change_hashtag_text],
 	["/set_remind_without_interaction", "Set time for reminding users", handle_change_remind_without_interaction],
+	["/db_stats", "Show slowest database functions", handle_db_stats],
+	["/backup", "Create backup of the database", handle_backup],
+	["/api_stats", "Show Bot API request queues and skipped edits", handle_api_stats],
+	["/update_stats", "Show queues of updates", handle_update_stats],
 ]
 
@@ -37,13 +37,14 @@ class CommentDispatcher:
 		main_message_id = db_utils.get_main_from_discussion_message(top_discussion_message_id, main_channel_id)
 
 		if main_message_id:
-			self.apply_hashtags(bot, msg_data, main_message_id, main_channel_id)
+			with utils.coalesced_edits():
+				self.apply_hashtags(bot, msg_data, main_message_id, main_channel_id)
 
-			msg_text = msg_data.text or msg_data.caption or ""
-			if msg_text.startswith(self.__NEXT_ACTION_COMMENT_PREFIX):
-				next_action_text = msg_text[len(self.__NEXT_ACTION_COMMENT_PREFIX):]
-				self.update_next_action(bot, main_message_id, main_channel_id, next_action_text)
-			interval_updating_utils.update_older_message(bot, main_channel_id, main_message_id)
+				msg_text = msg_data.text or msg_data.caption or ""
+				if msg_text.startswith(self.__NEXT_ACTION_COMMENT_PREFIX):
+					next_action_text = msg_text[len(self.__NEXT_ACTION_COMMENT_PREFIX):]
+					self.update_next_action(bot, main_message_id, main_channel_id, next_action_text)
+				interval_updating_utils.update_older_message(bot, main_channel_id, main_message_id)
 
 			self.update_user_last_interaction(main_message_id, main_channel_id, msg_data)
 			db_utils.set_ticket_update_time(main_message_id, main_channel_id, int(time.time()))
@@ -68,7 +69,7 @@ class CommentDispatcher:
 		if not is_service_hashtag_exists:
 			return
 
-		main_message_data = utils.get_message_content_by_id(bot, main_channel_id, main_message_id)
+		main_message_data = utils.get_message_content_by_id(bot, main_channel_id, main_message_id, use_cache=False)
 		if not main_message_data:
 			return
 
@@ -35,6 +35,27 @@ ADMIN_USERS: list = []
 TO_DELETE_MSG_TEXT = "#to_delete"
 REMINDER_TIME_WITHOUT_INTERACTION: int = 60 * 24  # 24 hours
 LAST_DAILY_REMINDER_TIME: int = 0
+DB_BACKEND: str = db_utils.SQLITE_BACKEND
+DB_FILENAME: str = db_utils.DB_FILENAME
+ARCHIVE_DB_FILENAME: str = "taskhelper_archive.db"
+CLOSED_TICKETS_RETENTION_DAYS: int = 90
+LAST_RETENTION_TIME: int = 0
+MAINTENANCE_HOUR: int = 4
+LAST_MAINTENANCE_TIME: int = 0
+SLOW_QUERY_THRESHOLD_MS: int = 100
+BACKUP_DIRECTORY: str = "backups"
+BACKUP_COUNT: int = 7
+BACKUP_INTERVAL: int = 60 * 24  # 24 hours
+LAST_BACKUP_TIME: int = 0
+UPDATE_WORKER_THREADS: int = 8
+UPDATE_MODE: str = "polling"
+WEBHOOK_URL: str = ""
+WEBHOOK_HOST: str = "127.0.0.1"
+WEBHOOK_PORT: int = 8080
+WEBHOOK_SECRET_TOKEN: str = ""
+WEBHOOK_MAX_CONNECTIONS: int = 1
+BOT_API_TIMEOUTS: dict = {}
+BOT_API_URL: str = ""
 
 BUTTON_TEXTS: dict = {
 	"OPENED_TICKET": "\U0001F7E9",
@@ -76,6 +97,13 @@ this_module = sys.modules[__name__]
 for key in config_json:
 	setattr(this_module, key, config_json[key])
 
+# empty url would remove the webhook and the bot wouldn't receive any updates
+if UPDATE_MODE == "webhook" and not WEBHOOK_URL:
+	logging.error("WEBHOOK_URL not declared in config file, it's required when UPDATE_MODE is webhook")
+	exit()
+
+db_utils.SLOW_QUERY_THRESHOLD = SLOW_QUERY_THRESHOLD_MS / 1000
+
 
 def load_discussion_chat_ids(bot: telebot.TeleBot):
 	main_channel_ids = db_utils.get_main_channel_ids()
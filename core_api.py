@@ -3,6 +3,13 @@ import logging
 from pyrogram import Client, utils
 from config_utils import BOT_TOKEN, APP_API_ID, APP_API_HASH
 
+# messages.getMessages and channels.getMessages accept up to 200 ids
+MAX_MESSAGES_PER_REQUEST = 200
+
+# fields of the Bot API media objects that are copied from the Pyrogram objects
+_MEDIA_FIELDS = ["file_id", "file_unique_id", "width", "height", "duration", "file_name", "mime_type", "file_size",
+                 "performer", "title"]
+
 '''
 This is a fix for get_peer_type in Pyrogram module.
 Original function throws an exception if channel id is less than -1002147483647.
@@ -50,6 +57,70 @@ def get_messages(chat_id, message_ids):
 	return app.get_messages(chat_id, message_ids)
 
 
+def get_entity_json(entity):
+	entity_json = {"type": entity.type.name.lower(), "offset": entity.offset, "length": entity.length}
+	if entity.url:
+		entity_json["url"] = entity.url
+	if entity.user:
+		entity_json["user"] = {"id": entity.user.id, "is_bot": entity.user.is_bot, "first_name": entity.user.first_name}
+	if entity.language:
+		entity_json["language"] = entity.language
+	if entity.custom_emoji_id:
+		entity_json["custom_emoji_id"] = str(entity.custom_emoji_id)
+	return entity_json
+
+
+def get_message_json(message):
+	"""
+	Converts Pyrogram message to the dict in the Bot API format, returns None for deleted messages.
+	Only content of the message is converted: text, caption, entities and media.
+	"""
+	if message.empty:
+		return
+
+	chat = {"id": message.chat.id, "type": message.chat.type.value, "title": message.chat.title}
+	message_json = {"message_id": message.id, "date": int(message.date.timestamp()), "chat": chat}
+	if message.chat.type.value == "channel":
+		message_json["sender_chat"] = chat
+	if message.edit_date:
+		message_json["edit_date"] = int(message.edit_date.timestamp())
+	if message.author_signature:
+		message_json["author_signature"] = message.author_signature
+	if message.media_group_id:
+		message_json["media_group_id"] = message.media_group_id
+
+	if message.text is not None:
+		message_json["text"] = str(message.text)
+		message_json["entities"] = [get_entity_json(entity) for entity in message.entities or []]
+		return message_json
+
+	if message.caption is not None:
+		message_json["caption"] = str(message.caption)
+		message_json["caption_entities"] = [get_entity_json(entity) for entity in message.caption_entities or []]
+
+	media_type = message.media.value if message.media else None
+	media = getattr(message, media_type, None) if media_type else None
+	if media:
+		media_json = {field: getattr(media, field) for field in _MEDIA_FIELDS if getattr(media, field, None) is not None}
+		message_json[media_type] = [media_json] if media_type == "photo" else media_json
+	return message_json
+
+
+@core_api_function
+def get_messages_json(chat_id, message_ids):
+	"""
+	Reads messages in chunks of MAX_MESSAGES_PER_REQUEST ids, returns dict with message id as a key
+	and message in the Bot API format or None for deleted messages as a value.
+	"""
+	message_ids = list(message_ids)
+	messages_json = {}
+	for chunk_start in range(0, len(message_ids), MAX_MESSAGES_PER_REQUEST):
+		chunk_ids = message_ids[chunk_start:chunk_start + MAX_MESSAGES_PER_REQUEST]
+		for message in app.get_messages(chat_id, chunk_ids):
+			messages_json[message.id] = get_message_json(message)
+	return messages_json
+
+
 @core_api_function
 def get_user(identifier):
 	try:
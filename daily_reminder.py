@@ -1,4 +1,3 @@
-import json
 import logging
 import threading
 import time
@@ -10,6 +9,7 @@ import db_utils
 import config_utils
 import forwarding_utils
 import interval_updating_utils
+import threading_utils
 from hashtag_data import HashtagData
 
 _DAILY_CHECK_INTERVAL = 60 * 60 * 24
@@ -17,10 +17,12 @@ _DAILY_CHECK_INTERVAL = 60 * 60 * 24
 
 def update_ticket_data(main_message_id: int, main_channel_id: int, hashtag_data: HashtagData):
 	user_tags = hashtag_data.get_all_users()
-	user_tags = ",".join(user_tags) if user_tags else None
+	user_tags_str = ",".join(user_tags) if user_tags else None
 	priority = hashtag_data.get_priority_number_or_default()
 	is_ticket_opened = hashtag_data.is_opened()
-	db_utils.insert_or_update_ticket_data(main_message_id, main_channel_id, is_ticket_opened, user_tags, priority)
+	with db_utils.transaction():
+		db_utils.insert_or_update_ticket_data(main_message_id, main_channel_id, is_ticket_opened, user_tags_str, priority)
+		db_utils.update_ticket_users(main_message_id, main_channel_id, user_tags)
 
 
 def ticket_update_time_comparator(ticket):
@@ -28,16 +30,21 @@ def ticket_update_time_comparator(ticket):
 	return max(update_time or 0, remind_time or 0)
 
 
-def get_message_for_reminding(main_channel_id: int, user_id: int, user_tag: str):
-	ticket_data = db_utils.get_tickets_for_reminding(main_channel_id, user_id, user_tag)
+def get_message_for_reminding(main_channel_id: int, user_id: int, user_tag: str, ticket_data: list = None):
+	if ticket_data is None:
+		ticket_data = db_utils.get_tickets_for_reminding(main_channel_id, user_id, user_tag)
 	if not ticket_data:
 		logging.info(f"No tickets for reminding were found in {user_tag, main_channel_id}")
 		return
 
+	settings_version = db_utils.get_settings_cache_version()
 	channel_ids = db_utils.get_user_individual_channels(main_channel_id, user_id)
 	channel_data = {}
 	for channel_id, settings in channel_ids:
-		channel_data[channel_id] = json.loads(settings)
+		channel_data[channel_id] = db_utils.parse_channel_settings(channel_id, settings, settings_version)
+
+	main_message_ids = [ticket[3] for ticket in ticket_data]
+	senders = db_utils.get_senders_many(main_channel_id, main_message_ids) or {}
 
 	filtered_ticket_data = []
 	for ticket in ticket_data:
@@ -60,7 +67,7 @@ def get_message_for_reminding(main_channel_id: int, user_id: int, user_tag: str)
 				filtered_ticket_data.append(ticket)
 				continue
 		if channel_manager.REMIND_TYPES.REPORTED in remind_settings:
-			sender_id = db_utils.get_main_message_sender(main_channel_id, main_message_id)
+			sender_id = senders.get(main_message_id)
 			if sender_id == user_id:
 				filtered_ticket_data.append(ticket)
 				continue
@@ -94,6 +101,8 @@ def get_message_for_reminding(main_channel_id: int, user_id: int, user_tag: str)
 
 def send_daily_reminders(bot: telebot.TeleBot):
 	user_data = db_utils.get_all_users()
+	# candidates of all users of the main channel are fetched with one query
+	reminder_candidates = {}
 	for user in user_data:
 		main_channel_id, user_id, user_tag = user
 		if not db_utils.is_user_reminder_data_exists(main_channel_id, user_tag):
@@ -104,19 +113,28 @@ def send_daily_reminders(bot: telebot.TeleBot):
 		if seconds_since_last_interaction < config_utils.REMINDER_TIME_WITHOUT_INTERACTION * 60:
 			continue
 
+		if main_channel_id not in reminder_candidates:
+			reminder_candidates[main_channel_id] = db_utils.get_reminder_candidates(main_channel_id) or {}
+		ticket_data = reminder_candidates[main_channel_id].get(user_tag, [])
+
 		message_to_remind = None
 		while not message_to_remind:
-			message_to_remind = get_message_for_reminding(main_channel_id, user_id, user_tag)
+			message_to_remind = get_message_for_reminding(main_channel_id, user_id, user_tag, ticket_data)
 			if not message_to_remind:
 				break
-			message_id_to_remind, copied_channel_id, copied_message_id = message_to_remind
-
-			forwarding_utils.delete_forwarded_message(bot, copied_channel_id, copied_message_id)
+			message_id_to_remind, copied_channel_id, _ = message_to_remind
+			# candidates are fetched once for all users, but reminders of previous users forward tickets again and
+			# delete_forwarded_message reassigns copied message ids, so the copy is found again right before using it
+			copied_message_id = db_utils.find_copied_message_in_channel(copied_channel_id, message_id_to_remind)
+			if copied_message_id:
+				forwarding_utils.delete_forwarded_message(bot, copied_channel_id, copied_message_id)
 			interval_updating_utils.update_older_message(bot, main_channel_id, message_id_to_remind)
 			new_message_id = db_utils.find_copied_message_in_channel(copied_channel_id, message_id_to_remind)
 			if not new_message_id:
 				logging.info(f"Tried to remind ticket {message_id_to_remind, main_channel_id}, but channel settings was changed.")
 				message_to_remind = None
+				# copies of the user's tickets were changed, so candidates are fetched again
+				ticket_data = None
 
 		if not message_to_remind:
 			continue
@@ -131,6 +149,7 @@ def start_reminder_thread(bot: telebot.TeleBot):
 
 
 def reminder_thread(bot: telebot.TeleBot):
+	threading_utils.set_request_priority(threading_utils.REQUEST_PRIORITIES.BACKGROUND)
 	while 1:
 		if time.time() - config_utils.LAST_DAILY_REMINDER_TIME > _DAILY_CHECK_INTERVAL:
 			send_daily_reminders(bot)
@@ -1,37 +1,770 @@
+import atexit
+import bisect
+import contextlib
+import json
 import logging
+import os
+import re
 import sqlite3
 import threading
+import time
 
 DB_FILENAME = "taskhelper_data.db"
 
-DB_CONNECTION = sqlite3.connect(DB_FILENAME, check_same_thread=False)
-CURSOR = DB_CONNECTION.cursor()
+SQLITE_BACKEND = "sqlite"
+MEMORY_BACKEND = "memory"
 
+# name of the attached database with rows moved out of the main database by the retention engine
+ARCHIVE_DATABASE = "archive"
+ARCHIVED_TABLES = [
+	"main_messages",
+	"next_action_comments",
+	"sent_scheduled_messages",
+	"reminded_tickets",
+	"comment_messages",
+]
+
+_CONNECTION_TIMEOUT = 30
+
+# SQLite versions before 3.32 don't allow more than 999 variables in one query
+_MAX_QUERY_VARIABLES = 999
+
+# changes are committed when this amount of seconds passed since the first uncommitted change
+GROUP_COMMIT_INTERVAL = 0.05
+# or when this amount of writing function calls is collected
+GROUP_COMMIT_MAX_STATEMENTS = 200
+
+_AUTO_VACUUM_INCREMENTAL = 2
+# rows read from each index by ANALYZE, keeps analysis of one table in a few milliseconds
+_ANALYSIS_LIMIT = 1000
+
+# serializes writers and readers that need to see uncommitted changes,
+# other readers use their own connections and never wait for this lock
 _DB_LOCK = threading.RLock()
+_WRITE_STATE = threading.local()
+_CALL_STATE = threading.local()
+
+# upper bounds in seconds of the histogram buckets of the database functions calls
+QUERY_TIME_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1)
+# calls of the database functions that took longer than this amount of seconds are logged
+SLOW_QUERY_THRESHOLD = 0.1
+# amount of the last statements of the slow call that are logged
+_SLOW_QUERY_STATEMENTS = 5
+_SQL_LITERAL_PATTERN = re.compile(r"'(?:[^']|'')*'|[xX]'[0-9a-fA-F]*'|(?<![\w.])-?\d+(?:\.\d+)?\b")
+
+
+class SqliteStorage:
+	"""
+	Database file opened in WAL mode, so readers don't block the writer and the writer doesn't block readers.
+	"""
+	shared_connection = False
+
+	def __init__(self, db_filename: str, archive_filename: str = None):
+		self.db_filename = db_filename
+		self.archive_filename = archive_filename
+
+	def connect(self):
+		new_database = not os.path.exists(self.db_filename)
+		connection = sqlite3.connect(self.db_filename, timeout=_CONNECTION_TIMEOUT, check_same_thread=False)
+		if new_database:
+			# has to be set before WAL mode writes the header, existing databases are converted by VACUUM
+			connection.execute("PRAGMA auto_vacuum=INCREMENTAL")
+		connection.execute("PRAGMA journal_mode=WAL")
+		connection.execute("PRAGMA synchronous=NORMAL")
+		if self.archive_filename:
+			connection.execute(f"ATTACH DATABASE ? AS {ARCHIVE_DATABASE}", (self.archive_filename,))
+			connection.execute(f"PRAGMA {ARCHIVE_DATABASE}.journal_mode=WAL")
+		return connection
+
+
+class MemoryStorage:
+	"""
+	Database that exists only in the memory of the process and is lost when it's closed, used to run tests
+	and benchmarks without filesystem I/O. There is only one connection, so readers wait for writers.
+	"""
+	shared_connection = True
+
+	def __init__(self, db_filename: str, archive_filename: str = None):
+		self.db_filename = db_filename
+		self.archive_filename = archive_filename
+
+	def connect(self):
+		connection = sqlite3.connect(":memory:", check_same_thread=False)
+		if self.archive_filename:
+			connection.execute(f"ATTACH DATABASE ':memory:' AS {ARCHIVE_DATABASE}")
+		return connection
+
+
+STORAGE_BACKENDS = {
+	SQLITE_BACKEND: SqliteStorage,
+	MEMORY_BACKEND: MemoryStorage,
+}
+
+
+class ConnectionPool:
+	"""
+	Gives every thread its own connection to the database for reading and keeps one shared writer connection.
+	If storage doesn't support several connections, the writer connection is used by all threads.
+	If archive_filename is set, the archive database is attached to every connection.
+	"""
+	def __init__(self, db_filename: str, backend: str = SQLITE_BACKEND, archive_filename: str = None):
+		if backend not in STORAGE_BACKENDS:
+			raise ValueError(f"Unknown database backend: {backend}")
+		self.db_filename = db_filename
+		self.backend = backend
+		self.archive_filename = archive_filename
+		self.storage = STORAGE_BACKENDS[backend](db_filename, archive_filename)
+		self.__local = threading.local()
+		self.__connections = {}
+		self.__connections_lock = threading.Lock()
+		self.__writer_connection = None
+
+	def get_connection(self):
+		if self.storage.shared_connection:
+			return self.get_writer_connection()
+
+		connection = getattr(self.__local, "connection", None)
+		if connection is None:
+			connection = self.__create_connection()
+			with self.__connections_lock:
+				self.__close_finished_threads_connections()
+				self.__connections[threading.current_thread()] = connection
+			self.__local.connection = connection
+		return connection
+
+	def get_writer_connection(self):
+		with self.__connections_lock:
+			if self.__writer_connection is None:
+				self.__writer_connection = self.__create_connection()
+			return self.__writer_connection
+
+	def __create_connection(self):
+		return self.storage.connect()
+
+	def __close_finished_threads_connections(self):
+		finished_threads = [thread for thread in self.__connections if not thread.is_alive()]
+		for thread in finished_threads:
+			self.__connections.pop(thread).close()
+
+	def close_all(self):
+		with self.__connections_lock:
+			for connection in self.__connections.values():
+				connection.close()
+			self.__connections.clear()
+			if self.__writer_connection is not None:
+				self.__writer_connection.close()
+				self.__writer_connection = None
+		self.__local = threading.local()
+
+
+class GroupCommit:
+	"""
+	Collects changes made by writing functions from all threads in one transaction of the writer connection
+	and commits it every GROUP_COMMIT_INTERVAL seconds or after GROUP_COMMIT_MAX_STATEMENTS writing calls,
+	so a burst of writes costs one fsync instead of one per write.
+	"""
+	def __init__(self):
+		self.pending_statements = 0
+		self.first_pending_time = None
+		self.commits_count = 0
+		self.committed_statements = 0
+		self.__flush_thread = None
+
+	def has_pending_changes(self):
+		return self.pending_statements > 0
+
+	def add_statement(self):
+		# should be called with _DB_LOCK acquired
+		if self.pending_statements == 0:
+			self.first_pending_time = time.monotonic()
+		self.pending_statements += 1
+		if self.pending_statements >= GROUP_COMMIT_MAX_STATEMENTS:
+			self.flush()
+		else:
+			self.__start_flush_thread()
+
+	def flush(self):
+		with _DB_LOCK:
+			if self.pending_statements == 0:
+				return
+			_CONNECTION_POOL.get_writer_connection().commit()
+			self.commits_count += 1
+			self.committed_statements += self.pending_statements
+			self.pending_statements = 0
+			self.first_pending_time = None
+
+	def discard(self):
+		# should be called with _DB_LOCK acquired after connection that had pending changes was closed
+		self.pending_statements = 0
+		self.first_pending_time = None
+
+	def __start_flush_thread(self):
+		if self.__flush_thread is None:
+			self.__flush_thread = threading.Thread(target=self.__flush_loop, daemon=True)
+			self.__flush_thread.start()
+
+	def __flush_loop(self):
+		while True:
+			first_pending_time = self.first_pending_time
+			if first_pending_time is None:
+				time.sleep(GROUP_COMMIT_INTERVAL)
+				continue
+
+			remaining_time = first_pending_time + GROUP_COMMIT_INTERVAL - time.monotonic()
+			if remaining_time > 0:
+				time.sleep(remaining_time)
+				continue
+
+			try:
+				self.flush()
+			except sqlite3.Error as E:
+				logging.error(f"SQLite error during group commit, error: {E.args}")
+				time.sleep(GROUP_COMMIT_INTERVAL)
+
+
+class ChannelRegistry:
+	"""
+	Keeps ids of main and individual channels in memory, so channel checks done for every update don't query
+	the database. Registry is loaded under _DB_LOCK and changed only by the writing functions after their
+	transaction succeeds, reading doesn't need any lock.
+	"""
+	def __init__(self):
+		self.__main_channel_ids = None
+		self.__individual_channels = None
+
+	def load(self):
+		with writer_connection_scope():
+			cursor = get_cursor()
+			cursor.execute("SELECT channel_id FROM main_channels")
+			main_channel_ids = {row[0] for row in cursor.fetchall()}
+			cursor.execute("SELECT channel_id, main_channel_id FROM individual_channel_settings")
+			individual_channels = {channel_id: main_channel_id for channel_id, main_channel_id in cursor.fetchall()}
+			self.__individual_channels = individual_channels
+			self.__main_channel_ids = main_channel_ids
+
+	def clear(self):
+		with _DB_LOCK:
+			self.__main_channel_ids = None
+			self.__individual_channels = None
+
+	def __ensure_loaded(self):
+		if self.__main_channel_ids is None:
+			with _DB_LOCK:
+				if self.__main_channel_ids is None:
+					self.load()
+
+	def is_main_channel(self, channel_id):
+		self.__ensure_loaded()
+		return channel_id in self.__main_channel_ids
+
+	def is_individual_channel(self, channel_id):
+		self.__ensure_loaded()
+		return channel_id in self.__individual_channels
+
+	# changes are skipped if registry isn't loaded yet, they will be loaded from the database
+	def add_main_channel(self, channel_id):
+		if self.__main_channel_ids is not None:
+			self.__main_channel_ids.add(channel_id)
+
+	def remove_main_channel(self, channel_id):
+		if self.__main_channel_ids is not None:
+			self.__main_channel_ids.discard(channel_id)
+
+	def add_individual_channel(self, channel_id, main_channel_id):
+		if self.__individual_channels is not None:
+			self.__individual_channels.setdefault(channel_id, main_channel_id)
+
+	def remove_individual_channel(self, channel_id):
+		if self.__individual_channels is not None:
+			self.__individual_channels.pop(channel_id, None)
+
+
+class ChannelSettings:
+	"""
+	Parsed settings of the individual channel, one object is shared between threads so it must not be changed.
+	Priorities are None if the entry was created from the query that doesn't read them.
+	"""
+	__slots__ = ("settings", "priorities", "parse_time")
+
+	def __init__(self, settings: dict, priorities: str, parse_time: float):
+		self.settings = settings
+		self.priorities = priorities
+		self.parse_time = parse_time
+
+	def to_dict(self):
+		return {key: list(value) if isinstance(value, list) else value for key, value in self.settings.items()}
+
+
+class ChannelSettingsCache:
+	"""
+	Caches parsed settings and priorities columns of individual_channel_settings table by channel id,
+	cached entries are returned without querying the database.
+	Every writing function that changes individual channel invalidates its entry after the transaction succeeds
+	and increases cache version, settings that were read before the last invalidation are not stored.
+	"""
+	def __init__(self):
+		self.__entries = {}
+		self.__version = 0
+		self.__lock = threading.Lock()
+		self.hits = 0
+		self.parses = 0
+		self.parse_time = 0.0
+		self.saved_parse_time = 0.0
+
+	@property
+	def version(self):
+		return self.__version
+
+	def get(self, channel_id: int, with_priorities: bool = False):
+		entry = self.__entries.get(channel_id)
+		if entry is None or (with_priorities and entry.priorities is None):
+			return None
+		with self.__lock:
+			self.hits += 1
+			self.saved_parse_time += entry.parse_time
+		return entry
+
+	def add(self, channel_id: int, settings_str: str, priorities: str, version: int):
+		start_time = time.perf_counter()
+		settings = json.loads(settings_str) if settings_str else {}
+		parse_time = time.perf_counter() - start_time
+
+		entry = ChannelSettings(settings, priorities, parse_time)
+		with self.__lock:
+			self.parses += 1
+			self.parse_time += parse_time
+			if version == self.__version:
+				self.__entries[channel_id] = entry
+		return entry
+
+	def invalidate(self, channel_id: int):
+		with self.__lock:
+			self.__version += 1
+			self.__entries.pop(channel_id, None)
+
+	def clear(self):
+		with self.__lock:
+			self.__version += 1
+			self.__entries.clear()
+
+	def get_stats(self):
+		with self.__lock:
+			requests_count = self.hits + self.parses
+			return {
+				"entries": len(self.__entries),
+				"hits": self.hits,
+				"parses": self.parses,
+				"hit_rate": self.hits / requests_count if requests_count else 0.0,
+				"parse_time": self.parse_time,
+				"saved_parse_time": self.saved_parse_time,
+			}
+
+
+class FunctionStats:
+	__slots__ = ("calls", "total_time", "max_time", "lock_wait_time", "time_histogram", "lock_wait_histogram")
+
+	def __init__(self):
+		self.calls = 0
+		self.total_time = 0
+		self.max_time = 0
+		self.lock_wait_time = 0
+		# the last bucket counts calls longer than the last bound
+		self.time_histogram = [0] * (len(QUERY_TIME_BUCKETS) + 1)
+		self.lock_wait_histogram = [0] * (len(QUERY_TIME_BUCKETS) + 1)
+
+	def merge(self, other):
+		self.calls += other.calls
+		self.total_time += other.total_time
+		self.max_time = max(self.max_time, other.max_time)
+		self.lock_wait_time += other.lock_wait_time
+		self.time_histogram = [a + b for a, b in zip(self.time_histogram, other.time_histogram)]
+		self.lock_wait_histogram = [a + b for a, b in zip(self.lock_wait_histogram, other.lock_wait_histogram)]
+
+	def to_dict(self):
+		return {name: getattr(self, name) for name in self.__slots__}
+
+
+class QueryStats:
+	"""
+	Collects execution time and time spent waiting for _DB_LOCK of every database function into histograms.
+	Every thread updates its own stats without locking, they are merged when stats are requested.
+	"""
+	def __init__(self):
+		self.__lock = threading.Lock()
+		self.__local = threading.local()
+		self.__threads_functions = []
+
+	def add(self, function_name: str, execution_time: float, lock_wait_time: float):
+		functions = getattr(self.__local, "functions", None)
+		if functions is None:
+			functions = self.__local.functions = {}
+			with self.__lock:
+				self.__threads_functions.append(functions)
+
+		stats = functions.get(function_name)
+		if stats is None:
+			stats = functions[function_name] = FunctionStats()
+		stats.calls += 1
+		stats.total_time += execution_time
+		if execution_time > stats.max_time:
+			stats.max_time = execution_time
+		stats.time_histogram[bisect.bisect_left(QUERY_TIME_BUCKETS, execution_time)] += 1
+		if lock_wait_time:
+			stats.lock_wait_time += lock_wait_time
+			stats.lock_wait_histogram[bisect.bisect_left(QUERY_TIME_BUCKETS, lock_wait_time)] += 1
+		else:
+			stats.lock_wait_histogram[0] += 1
+
+	def get_top_functions(self, count: int):
+		"""
+		Returns stats of count functions with the largest total time including lock waiting.
+		"""
+		merged_functions = {}
+		with self.__lock:
+			threads_functions = list(self.__threads_functions)
+		for functions in threads_functions:
+			for function_name, stats in list(functions.items()):
+				merged_stats = merged_functions.setdefault(function_name, FunctionStats())
+				merged_stats.merge(stats)
+
+		top_functions = sorted(merged_functions.items(), key=lambda item: item[1].total_time + item[1].lock_wait_time, reverse=True)
+		return [(function_name, stats.to_dict()) for function_name, stats in top_functions[:count]]
+
+	def clear(self):
+		with self.__lock:
+			for functions in self.__threads_functions:
+				functions.clear()
+
+
+_CONNECTION_POOL = ConnectionPool(DB_FILENAME)
+_GROUP_COMMIT = GroupCommit()
+_CHANNEL_REGISTRY = ChannelRegistry()
+_SETTINGS_CACHE = ChannelSettingsCache()
+_QUERY_STATS = QueryStats()
+
+
+def open_database(db_filename: str, backend: str = SQLITE_BACKEND, archive_filename: str = None):
+	global _CONNECTION_POOL
+	with _DB_LOCK:
+		flush()
+		_CONNECTION_POOL.close_all()
+		_CONNECTION_POOL = ConnectionPool(db_filename, backend, archive_filename)
+		_CHANNEL_REGISTRY.clear()
+		_SETTINGS_CACHE.clear()
+
+
+def flush():
+	"""
+	Commits changes collected by the group commit immediately.
+	"""
+	_GROUP_COMMIT.flush()
+
+
+atexit.register(flush)
+
+
+def get_connection():
+	if getattr(_WRITE_STATE, "depth", 0) > 0:
+		return _CONNECTION_POOL.get_writer_connection()
+	return _CONNECTION_POOL.get_connection()
+
+
+def trace_statement(statement):
+	statements = getattr(_CALL_STATE, "statements", None)
+	if statements is not None:
+		statements.append(statement)
+		if len(statements) > _SLOW_QUERY_STATEMENTS:
+			del statements[0]
+
+
+class TracedCursor(sqlite3.Cursor):
+	"""
+	Remembers statements executed by the database functions for the slow query log,
+	the statements are stored without bound parameters.
+	"""
+	def execute(self, sql, parameters=()):
+		trace_statement(sql)
+		return super().execute(sql, parameters)
+
+	def executemany(self, sql, seq_of_parameters):
+		trace_statement(sql)
+		return super().executemany(sql, seq_of_parameters)
+
+
+def get_cursor():
+	return get_connection().cursor(TracedCursor)
+
+
+@contextlib.contextmanager
+def writer_connection_scope():
+	"""
+	Makes get_connection() return the shared writer connection in the current thread.
+	"""
+	with _DB_LOCK:
+		depth = getattr(_WRITE_STATE, "depth", 0)
+		_WRITE_STATE.depth = depth + 1
+		try:
+			yield depth == 0
+		finally:
+			_WRITE_STATE.depth = depth
+
+
+@contextlib.contextmanager
+def transaction():
+	"""
+	Executes all writing functions called inside it atomically, if an exception is raised all their changes
+	are rolled back and changes collected from other calls remain untouched.
+	Nested transactions become part of the outer one.
+	"""
+	with writer_connection_scope() as is_outer_scope:
+		if not is_outer_scope:
+			yield
+			return
+
+		connection = get_connection()
+		if not connection.in_transaction:
+			connection.execute("BEGIN")
+		connection.execute("SAVEPOINT write_transaction")
+		_WRITE_STATE.callbacks = []
+		try:
+			yield
+		except BaseException:
+			connection.execute("ROLLBACK TO write_transaction")
+			connection.execute("RELEASE write_transaction")
+			raise
+		finally:
+			callbacks = _WRITE_STATE.callbacks
+			_WRITE_STATE.callbacks = []
+		connection.execute("RELEASE write_transaction")
+		_GROUP_COMMIT.add_statement()
+		for callback in callbacks:
+			callback()
+
+
+def after_transaction(callback):
+	"""
+	Calls callback after the current transaction succeeds, it is not called if the transaction is rolled back.
+	Should be used by writing functions to update in-memory caches of the database data.
+	"""
+	if getattr(_WRITE_STATE, "depth", 0) > 0:
+		_WRITE_STATE.callbacks.append(callback)
+	else:
+		callback()
+
+
+def redact_sql(statement):
+	"""
+	Replaces literals in the statement with "?", so logs don't contain messages data.
+	"""
+	return _SQL_LITERAL_PATTERN.sub("?", " ".join(statement.split()))
+
+
+def acquire_lock():
+	wait_start_time = time.perf_counter()
+	_DB_LOCK.acquire()
+	return time.perf_counter() - wait_start_time
+
+
+def start_call():
+	"""
+	Starts collecting statements for the slow query log, returns True if it's the outermost database function call,
+	statements of nested calls are logged together with the outermost call.
+	"""
+	if getattr(_CALL_STATE, "statements", None) is None:
+		_CALL_STATE.statements = []
+		return True
+	return False
+
+
+def finish_call(function_name, arguments, is_outer_call, start_time, lock_wait_time):
+	"""
+	Records execution time and lock wait time of the database function call and logs the call if it is slow.
+	"""
+	total_time = time.perf_counter() - start_time
+	execution_time = total_time - lock_wait_time
+	_QUERY_STATS.add(function_name, execution_time, lock_wait_time)
+	if not is_outer_call:
+		return
+
+	statements = _CALL_STATE.statements
+	_CALL_STATE.statements = None
+	if total_time >= SLOW_QUERY_THRESHOLD:
+		redacted_arguments = ", ".join(type(argument).__name__ for argument in arguments)
+		redacted_statements = "; ".join(redact_sql(statement) for statement in statements)
+		logging.warning(f"Slow database call {function_name}({redacted_arguments}): "
+						f"{execution_time * 1000:.1f}ms, lock wait {lock_wait_time * 1000:.1f}ms, "
+						f"statements: {redacted_statements}")
+
+
+def db_read_only(func):
+	def inner_function(*args, **kwargs):
+		is_outer_call = start_call()
+		start_time = time.perf_counter()
+		lock_wait_time = 0
+		try:
+			if _GROUP_COMMIT.has_pending_changes() or _CONNECTION_POOL.storage.shared_connection:
+				# uncommitted changes are visible only to the writer connection,
+				# storage with shared connection has no other connections
+				lock_wait_time = acquire_lock()
+				try:
+					with writer_connection_scope():
+						return func(*args, **kwargs)
+				finally:
+					_DB_LOCK.release()
+			return func(*args, **kwargs)
+		except sqlite3.Error as E:
+			logging.error(f"SQLite error in {func.__name__} function, error: {E.args}")
+		finally:
+			finish_call(func.__name__, args, is_outer_call, start_time, lock_wait_time)
+	return inner_function
 
 
 def db_thread_lock(func):
+	"""
+	Serializes writing functions, their changes are committed by the group commit.
+	"""
 	def inner_function(*args, **kwargs):
-		with _DB_LOCK:
+		is_outer_call = start_call()
+		start_time = time.perf_counter()
+		lock_wait_time = 0
+		try:
+			lock_wait_time = acquire_lock()
 			try:
-				return func(*args, **kwargs)
-			except sqlite3.Error as E:
-				logging.error(f"SQLite error in {func.__name__} function, error: {E.args}")
+				with transaction():
+					return func(*args, **kwargs)
+			finally:
+				_DB_LOCK.release()
+		except sqlite3.Error as E:
+			logging.error(f"SQLite error in {func.__name__} function, error: {E.args}")
+		finally:
+			finish_call(func.__name__, args, is_outer_call, start_time, lock_wait_time)
 	return inner_function
 
 
+def get_query_stats(count):
+	return _QUERY_STATS.get_top_functions(count)
+
+
+def clear_query_stats():
+	_QUERY_STATS.clear()
+
+
+def split_into_chunks(values, reserved_variables=0):
+	"""
+	Splits values of the bulk query, so every query fits into the SQLite variables limit.
+	"""
+	values = list(dict.fromkeys(values))
+	chunk_size = _MAX_QUERY_VARIABLES - reserved_variables
+	for i in range(0, len(values), chunk_size):
+		yield values[i:i + chunk_size]
+
+
+def get_placeholders(count):
+	return ", ".join(["?"] * count)
+
+
+def is_archive_attached():
+	return bool(_CONNECTION_POOL.archive_filename)
+
+
+def get_databases():
+	"""
+	Returns names of the databases in the order they should be searched, rows of the archived tables
+	that weren't found in the main database can be found in the archive.
+	"""
+	if is_archive_attached():
+		return ["main", ARCHIVE_DATABASE]
+	return ["main"]
+
+
+def fetch_one_with_archive(sql, parameters):
+	"""
+	Executes sql in the main database and repeats it in the archive if nothing was found,
+	archived tables in sql should be prefixed with {database}.
+	"""
+	cursor = get_cursor()
+	for database in get_databases():
+		cursor.execute(sql.format(database=database), parameters)
+		result = cursor.fetchone()
+		if result:
+			return result
+
+
+def fetch_many_with_archive(sql, main_channel_id, main_message_ids):
+	"""
+	Bulk version of fetch_one_with_archive, the first selected column should be main_message_id and
+	the list of ids in sql should be replaced with {placeholders}. Only ids that weren't found
+	in the main database are searched in the archive.
+	"""
+	rows = []
+	missing_ids = list(dict.fromkeys(main_message_ids))
+	cursor = get_cursor()
+	for database in get_databases():
+		if not missing_ids:
+			break
+		found_ids = set()
+		for chunk in split_into_chunks(missing_ids, reserved_variables=1):
+			chunk_sql = sql.format(database=database, placeholders=get_placeholders(len(chunk)))
+			cursor.execute(chunk_sql, (main_channel_id, *chunk,))
+			for row in cursor.fetchall():
+				rows.append(row)
+				found_ids.add(row[0])
+		missing_ids = [main_message_id for main_message_id in missing_ids if main_message_id not in found_ids]
+	return rows
+
+
 def initialize_db():
-	create_tables()
+	with _DB_LOCK:
+		flush()
+		check_incremental_vacuum()
+		create_tables()
+		apply_migrations()
+		if is_archive_attached():
+			create_archive_tables()
+		_CHANNEL_REGISTRY.load()
+
+
+def check_incremental_vacuum():
+	"""
+	Incremental vacuum allows maintenance to return free pages to the filesystem in small steps. New databases are created
+	with it, databases created before are converted by convert_to_incremental_vacuum in the maintenance window.
+	"""
+	if not is_incremental_vacuum_enabled():
+		logging.warning("Incremental vacuum isn't enabled, the database will be rebuilt by VACUUM in the maintenance window")
+
+
+def is_incremental_vacuum_enabled():
+	# reader connections keep the mode they read when they were opened, the writer connection is the one that converts it
+	with _DB_LOCK:
+		cursor = _CONNECTION_POOL.get_writer_connection().cursor()
+		cursor.execute("PRAGMA auto_vacuum")
+		return cursor.fetchone()[0] == _AUTO_VACUUM_INCREMENTAL
+
+
+def convert_to_incremental_vacuum():
+	"""
+	Rebuilds the existing database with VACUUM to enable incremental vacuum. It holds the database lock
+	for the whole rebuild, so it should be called only in the maintenance window, returns time of the rebuild.
+	"""
+	with _DB_LOCK:
+		flush()
+		start_time = time.perf_counter()
+		cursor = _CONNECTION_POOL.get_writer_connection().cursor()
+		cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+		cursor.execute("VACUUM")
+		return time.perf_counter() - start_time
 
 
 def is_table_exists(table_name):
 	sql = "SELECT count(name) FROM sqlite_master WHERE type='table' AND name=(?)"
-	CURSOR.execute(sql, (table_name,))
-	result = CURSOR.fetchone()[0]
+	cursor = get_cursor()
+	cursor.execute(sql, (table_name,))
+	result = cursor.fetchone()[0]
 	return bool(result)
 
 
 def create_tables():
+	cursor = get_cursor()
 	if not is_table_exists("discussion_messages"):
 		discussion_messages_table_sql = '''
 			CREATE TABLE "discussion_messages" (
@@ -41,7 +774,7 @@ def create_tables():
 				"discussion_message_id"	INT NOT NULL
 			); '''
 
-		CURSOR.execute(discussion_messages_table_sql)
+		cursor.execute(discussion_messages_table_sql)
 
 	if not is_table_exists("copied_messages"):
 		copied_messages_table_sql = '''
@@ -53,7 +786,7 @@ def create_tables():
 				"copied_channel_id"	INT NOT NULL
 			); '''
 
-		CURSOR.execute(copied_messages_table_sql)
+		cursor.execute(copied_messages_table_sql)
 
 	if not is_table_exists("last_message_ids"):
 		last_message_ids_table_sql = '''
@@ -63,7 +796,7 @@ def create_tables():
 				"last_message_id"	INT NOT NULL
 			); '''
 
-		CURSOR.execute(last_message_ids_table_sql)
+		cursor.execute(last_message_ids_table_sql)
 
 	if not is_table_exists("comment_messages"):
 		comment_messages_table_sql = '''
@@ -75,7 +808,7 @@ def create_tables():
 				"sender_id"	INT NOT NULL
 			); '''
 
-		CURSOR.execute(comment_messages_table_sql)
+		cursor.execute(comment_messages_table_sql)
 
 	if not is_table_exists("scheduled_messages"):
 		scheduled_messages_table_sql = '''
@@ -88,7 +821,7 @@ def create_tables():
 				"send_time"	INT NOT NULL
 			); '''
 
-		CURSOR.execute(scheduled_messages_table_sql)
+		cursor.execute(scheduled_messages_table_sql)
 
 	if not is_table_exists("sent_scheduled_messages"):
 		sent_scheduled_messages_table_sql = '''
@@ -99,7 +832,7 @@ def create_tables():
 				"sent_at"   INT NOT NULL
 			); '''
 
-		CURSOR.execute(sent_scheduled_messages_table_sql)
+		cursor.execute(sent_scheduled_messages_table_sql)
 
 	if not is_table_exists("interval_updates_status"):
 		interval_updates_status_table_sql = '''
@@ -109,7 +842,7 @@ def create_tables():
 				"current_message_id"    INT NOT NULL
 			); '''
 
-		CURSOR.execute(interval_updates_status_table_sql)
+		cursor.execute(interval_updates_status_table_sql)
 
 	if not is_table_exists("individual_channel_settings"):
 		individual_channel_settings_table_sql = '''
@@ -122,7 +855,7 @@ def create_tables():
 				"user_id"           INT
 			); '''
 
-		CURSOR.execute(individual_channel_settings_table_sql)
+		cursor.execute(individual_channel_settings_table_sql)
 
 	if not is_table_exists("users"):
 		users_table_sql = '''
@@ -133,7 +866,7 @@ def create_tables():
 				"user_tag"          TEXT NOT NULL		
 			); '''
 
-		CURSOR.execute(users_table_sql)
+		cursor.execute(users_table_sql)
 
 	if not is_table_exists("main_channels"):
 		main_channels_table_sql = '''
@@ -142,7 +875,7 @@ def create_tables():
 				"channel_id"    INT NOT NULL
 			); '''
 
-		CURSOR.execute(main_channels_table_sql)
+		cursor.execute(main_channels_table_sql)
 
 	if not is_table_exists("main_messages"):
 		main_messages_table_sql = '''
@@ -153,7 +886,7 @@ def create_tables():
 				"sender_id"         INT
 			); '''
 
-		CURSOR.execute(main_messages_table_sql)
+		cursor.execute(main_messages_table_sql)
 
 	if not is_table_exists("next_action_comments"):
 		next_action_comments_table_sql = '''
@@ -165,7 +898,7 @@ def create_tables():
 				"current_comment_text"  TEXT
 			); '''
 
-		CURSOR.execute(next_action_comments_table_sql)
+		cursor.execute(next_action_comments_table_sql)
 
 	if not is_table_exists("tickets_data"):
 		tickets_data_table_sql = '''
@@ -179,7 +912,7 @@ def create_tables():
 				"update_time"           INT
 			); '''
 
-		CURSOR.execute(tickets_data_table_sql)
+		cursor.execute(tickets_data_table_sql)
 
 	if not is_table_exists("user_reminder_data"):
 		user_interactions_table_sql = '''
@@ -190,7 +923,7 @@ def create_tables():
 				"last_interaction_time"     INT
 			); '''
 
-		CURSOR.execute(user_interactions_table_sql)
+		cursor.execute(user_interactions_table_sql)
 
 	if not is_table_exists("reminded_tickets"):
 		reminded_tickets_table_sql = '''
@@ -202,7 +935,7 @@ def create_tables():
 				"reminded_at"               INT NOT NULL
 			); '''
 
-		CURSOR.execute(reminded_tickets_table_sql)
+		cursor.execute(reminded_tickets_table_sql)
 
 	if not is_table_exists("custom_channel_hashtags"):
 		custom_channel_hashtags_table_sql = '''
@@ -212,36 +945,383 @@ def create_tables():
 				"custom_hashtag"       TEXT
 			); '''
 
-		CURSOR.execute(custom_channel_hashtags_table_sql)
+		cursor.execute(custom_channel_hashtags_table_sql)
+
+	if not is_table_exists("ticket_users"):
+		ticket_users_table_sql = '''
+			CREATE TABLE "ticket_users" (
+				"id"	INTEGER PRIMARY KEY AUTOINCREMENT,
+				"main_channel_id"           INT NOT NULL,
+				"main_message_id"           INT NOT NULL,
+				"user_tag"                  TEXT NOT NULL COLLATE NOCASE,
+				"position"                  INT NOT NULL
+			); '''
+
+		cursor.execute(ticket_users_table_sql)
+
+	if not is_table_exists("channel_priorities"):
+		channel_priorities_table_sql = '''
+			CREATE TABLE "channel_priorities" (
+				"id"	INTEGER PRIMARY KEY AUTOINCREMENT,
+				"channel_id"           INT NOT NULL,
+				"priority"             TEXT NOT NULL
+			); '''
+
+		cursor.execute(channel_priorities_table_sql)
+
+	if not is_table_exists("comment_stats"):
+		comment_stats_table_sql = '''
+			CREATE TABLE "comment_stats" (
+				"id"	INTEGER PRIMARY KEY AUTOINCREMENT,
+				"discussion_chat_id"        INT NOT NULL,
+				"thread_root_id"            INT NOT NULL,
+				"sender_id"                 INT NOT NULL,
+				"comments_count"            INT NOT NULL,
+				"last_comment_id"           INT NOT NULL
+			); '''
+
+		cursor.execute(comment_stats_table_sql)
+
+	if not is_table_exists("open_ticket_assignments"):
+		open_ticket_assignments_table_sql = '''
+			CREATE TABLE "open_ticket_assignments" (
+				"id"	INTEGER PRIMARY KEY AUTOINCREMENT,
+				"main_channel_id"           INT NOT NULL,
+				"main_message_id"           INT NOT NULL,
+				"user_tags"                 TEXT,
+				"priority"                  TEXT,
+				"update_time"               INT
+			); '''
+
+		cursor.execute(open_ticket_assignments_table_sql)
+
+	if not is_table_exists("message_contents"):
+		message_contents_table_sql = '''
+			CREATE TABLE "message_contents" (
+				"id"	INTEGER PRIMARY KEY AUTOINCREMENT,
+				"chat_id"                   INT NOT NULL,
+				"message_id"                INT NOT NULL,
+				"content_type"              TEXT NOT NULL,
+				"edit_date"                 INT NOT NULL,
+				"message_json"              TEXT NOT NULL
+			); '''
+
+		cursor.execute(message_contents_table_sql)
+
+	if not is_table_exists("rendered_messages"):
+		rendered_messages_table_sql = '''
+			CREATE TABLE "rendered_messages" (
+				"id"	INTEGER PRIMARY KEY AUTOINCREMENT,
+				"chat_id"                   INT NOT NULL,
+				"message_id"                INT NOT NULL,
+				"content_hash"              TEXT,
+				"keyboard_hash"             TEXT
+			); '''
+
+		cursor.execute(rendered_messages_table_sql)
+
+	if not is_table_exists("schema_version"):
+		schema_version_table_sql = '''
+			CREATE TABLE "schema_version" (
+				"version"	INT NOT NULL
+			); '''
 
-	DB_CONNECTION.commit()
+		cursor.execute(schema_version_table_sql)
+		cursor.execute("INSERT INTO schema_version (version) VALUES (0)")
+
+	get_connection().commit()
+
+
+def get_schema_version():
+	sql = "SELECT version FROM schema_version"
+	cursor = get_cursor()
+	cursor.execute(sql, ())
+	result = cursor.fetchone()
+	return result[0] if result else 0
+
+
+def set_schema_version(version):
+	sql = "UPDATE schema_version SET version=(?)"
+	cursor = get_cursor()
+	cursor.execute(sql, (version,))
+
+
+def apply_migrations():
+	"""
+	Applies every migration from MIGRATIONS list that is newer than the stored schema version.
+	Each migration is executed in its own transaction together with the schema version update,
+	so the database is never left with a partially applied migration.
+	"""
+	cursor = get_cursor()
+	current_version = get_schema_version()
+	for version in range(current_version + 1, len(MIGRATIONS) + 1):
+		migration = MIGRATIONS[version - 1]
+		logging.info(f"Applying database migration {version}: {migration.__name__}")
+		try:
+			cursor.execute("BEGIN")
+			migration()
+			set_schema_version(version)
+			get_connection().commit()
+		except sqlite3.Error as E:
+			get_connection().rollback()
+			logging.error(f"SQLite error during database migration {version}, error: {E.args}")
+			raise E
+
+
+def migration_add_lookup_indexes():
+	cursor = get_cursor()
+	# indexes match WHERE clauses of the lookup functions below, without them every lookup is a full table scan
+	index_sql_list = [
+		'CREATE INDEX IF NOT EXISTS "idx_discussion_messages_main" ON "discussion_messages" ("main_channel_id", "main_message_id")',
+		'CREATE INDEX IF NOT EXISTS "idx_discussion_messages_discussion" ON "discussion_messages" ("main_channel_id", "discussion_message_id")',
+		'CREATE INDEX IF NOT EXISTS "idx_copied_messages_main" ON "copied_messages" ("main_channel_id", "main_message_id")',
+		'CREATE INDEX IF NOT EXISTS "idx_copied_messages_copied" ON "copied_messages" ("copied_channel_id", "copied_message_id")',
+		'CREATE INDEX IF NOT EXISTS "idx_copied_messages_channel_main" ON "copied_messages" ("copied_channel_id", "main_message_id")',
+		'CREATE INDEX IF NOT EXISTS "idx_last_message_ids_chat" ON "last_message_ids" ("chat_id")',
+		'CREATE INDEX IF NOT EXISTS "idx_comment_messages_message" ON "comment_messages" ("discussion_chat_id", "message_id")',
+		'CREATE INDEX IF NOT EXISTS "idx_comment_messages_reply" ON "comment_messages" ("discussion_chat_id", "reply_to_message_id")',
+		'CREATE INDEX IF NOT EXISTS "idx_scheduled_messages_main" ON "scheduled_messages" ("main_channel_id", "main_message_id")',
+		'CREATE INDEX IF NOT EXISTS "idx_sent_scheduled_messages_main" ON "sent_scheduled_messages" ("main_channel_id", "main_message_id")',
+		'CREATE INDEX IF NOT EXISTS "idx_interval_updates_status_channel" ON "interval_updates_status" ("main_channel_id")',
+		'CREATE INDEX IF NOT EXISTS "idx_individual_channel_settings_channel" ON "individual_channel_settings" ("channel_id")',
+		'CREATE INDEX IF NOT EXISTS "idx_individual_channel_settings_user" ON "individual_channel_settings" ("main_channel_id", "user_id")',
+		'CREATE INDEX IF NOT EXISTS "idx_users_tag" ON "users" ("main_channel_id", "user_tag")',
+		'CREATE INDEX IF NOT EXISTS "idx_users_user" ON "users" ("user_id")',
+		'CREATE INDEX IF NOT EXISTS "idx_main_channels_channel" ON "main_channels" ("channel_id")',
+		'CREATE INDEX IF NOT EXISTS "idx_main_messages_main" ON "main_messages" ("main_channel_id", "main_message_id")',
+		'CREATE INDEX IF NOT EXISTS "idx_next_action_comments_main" ON "next_action_comments" ("main_channel_id", "main_message_id")',
+		'CREATE INDEX IF NOT EXISTS "idx_tickets_data_main" ON "tickets_data" ("main_channel_id", "main_message_id")',
+		'CREATE INDEX IF NOT EXISTS "idx_user_reminder_data_tag" ON "user_reminder_data" ("main_channel_id", "user_tag")',
+		'CREATE INDEX IF NOT EXISTS "idx_reminded_tickets_main" ON "reminded_tickets" ("main_channel_id", "main_message_id", "user_tag")',
+		'CREATE INDEX IF NOT EXISTS "idx_custom_channel_hashtags_channel" ON "custom_channel_hashtags" ("channel_id")',
+	]
+
+	for sql in index_sql_list:
+		cursor.execute(sql)
+
+
+def migration_analyze_tables():
+	cursor = get_cursor()
+	cursor.execute("ANALYZE")
+
+
+# natural keys of the tables, insert_or_update_* functions rely on them in ON CONFLICT clauses
+UNIQUE_KEYS = {
+	"discussion_messages": ("main_channel_id", "main_message_id"),
+	"last_message_ids": ("chat_id",),
+	"comment_messages": ("discussion_chat_id", "message_id"),
+	"sent_scheduled_messages": ("main_channel_id", "main_message_id"),
+	"interval_updates_status": ("main_channel_id",),
+	"individual_channel_settings": ("channel_id",),
+	"users": ("main_channel_id", "user_tag"),
+	"main_channels": ("channel_id",),
+	"main_messages": ("main_channel_id", "main_message_id"),
+	"next_action_comments": ("main_channel_id", "main_message_id"),
+	"tickets_data": ("main_channel_id", "main_message_id"),
+	"user_reminder_data": ("main_channel_id", "user_tag"),
+	"reminded_tickets": ("main_channel_id", "main_message_id", "user_tag"),
+	"custom_channel_hashtags": ("channel_id",),
+}
+
+
+def migration_add_unique_constraints():
+	cursor = get_cursor()
+	# lookup indexes on the same columns are replaced by unique indexes
+	redundant_indexes = [
+		"idx_discussion_messages_main",
+		"idx_last_message_ids_chat",
+		"idx_comment_messages_message",
+		"idx_sent_scheduled_messages_main",
+		"idx_interval_updates_status_channel",
+		"idx_individual_channel_settings_channel",
+		"idx_users_tag",
+		"idx_main_channels_channel",
+		"idx_main_messages_main",
+		"idx_next_action_comments_main",
+		"idx_tickets_data_main",
+		"idx_user_reminder_data_tag",
+		"idx_reminded_tickets_main",
+		"idx_custom_channel_hashtags_channel",
+	]
+	for index_name in redundant_indexes:
+		cursor.execute(f'DROP INDEX IF EXISTS "{index_name}"')
+
+	for table_name, key_columns in UNIQUE_KEYS.items():
+		columns = ", ".join(f'"{column}"' for column in key_columns)
+		# every update was applied to all duplicates, so the newest row contains all data
+		cursor.execute(f'DELETE FROM "{table_name}" WHERE id NOT IN (SELECT max(id) FROM "{table_name}" GROUP BY {columns})')
+		cursor.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS "uq_{table_name}" ON "{table_name}" ({columns})')
+
+
+def migration_backfill_ticket_users_and_channel_priorities():
+	cursor = get_cursor()
+	index_sql_list = [
+		'CREATE UNIQUE INDEX IF NOT EXISTS "uq_ticket_users" ON "ticket_users" ("main_channel_id", "main_message_id", "position")',
+		'CREATE INDEX IF NOT EXISTS "idx_ticket_users_tag" ON "ticket_users" ("main_channel_id", "user_tag")',
+		'CREATE UNIQUE INDEX IF NOT EXISTS "uq_channel_priorities" ON "channel_priorities" ("channel_id", "priority")',
+		'CREATE INDEX IF NOT EXISTS "idx_channel_priorities_priority" ON "channel_priorities" ("priority", "channel_id")',
+	]
+	for sql in index_sql_list:
+		cursor.execute(sql)
+
+	cursor.execute("SELECT main_channel_id, main_message_id, user_tags FROM tickets_data WHERE user_tags IS NOT NULL")
+	ticket_users = []
+	for main_channel_id, main_message_id, user_tags in cursor.fetchall():
+		user_tags = [user_tag for user_tag in user_tags.split(",") if user_tag]
+		for position, user_tag in enumerate(user_tags):
+			ticket_users.append((main_channel_id, main_message_id, user_tag, position))
+	cursor.executemany(
+		"INSERT INTO ticket_users (main_channel_id, main_message_id, user_tag, position) VALUES (?, ?, ?, ?)",
+		ticket_users
+	)
+
+	cursor.execute("SELECT channel_id, priorities FROM individual_channel_settings WHERE priorities IS NOT NULL")
+	channel_priorities = []
+	for channel_id, priorities in cursor.fetchall():
+		for priority in set(priorities.split(",")):
+			if priority:
+				channel_priorities.append((channel_id, priority))
+	cursor.executemany("INSERT INTO channel_priorities (channel_id, priority) VALUES (?, ?)", channel_priorities)
+
+
+def migration_add_comment_thread_roots():
+	cursor = get_cursor()
+	cursor.execute('ALTER TABLE "comment_messages" ADD COLUMN "thread_root_id" INT')
+	cursor.execute(
+		'CREATE INDEX IF NOT EXISTS "idx_comment_messages_thread" ON "comment_messages" ("discussion_chat_id", "thread_root_id")'
+	)
+	cursor.execute(
+		'CREATE UNIQUE INDEX IF NOT EXISTS "uq_comment_stats" ON "comment_stats" ("discussion_chat_id", "thread_root_id", "sender_id")'
+	)
+
+	cursor.execute("SELECT discussion_chat_id, message_id, reply_to_message_id FROM comment_messages")
+	reply_to_ids = {}
+	for discussion_chat_id, message_id, reply_to_message_id in cursor.fetchall():
+		reply_to_ids[(discussion_chat_id, message_id)] = reply_to_message_id
+
+	thread_root_ids = {}
+	for comment_key in reply_to_ids:
+		discussion_chat_id, _ = comment_key
+		# walk up to the first comment with a known root or to the message that isn't a comment
+		path = []
+		path_keys = set()
+		current_key = comment_key
+		while current_key in reply_to_ids and current_key not in thread_root_ids and current_key not in path_keys:
+			path.append(current_key)
+			path_keys.add(current_key)
+			current_key = (discussion_chat_id, reply_to_ids[current_key])
+		thread_root_id = thread_root_ids.get(current_key, current_key[1])
+		for path_key in path:
+			thread_root_ids[path_key] = thread_root_id
+
+	thread_roots = [(root_id, chat_id, message_id) for (chat_id, message_id), root_id in thread_root_ids.items()]
+	cursor.executemany(
+		"UPDATE comment_messages SET thread_root_id=(?) WHERE discussion_chat_id=(?) AND message_id=(?)",
+		thread_roots
+	)
+
+	cursor.execute('''
+		INSERT INTO comment_stats (discussion_chat_id, thread_root_id, sender_id, comments_count, last_comment_id)
+		SELECT discussion_chat_id, thread_root_id, sender_id, count(*), max(message_id) FROM comment_messages
+		GROUP BY discussion_chat_id, thread_root_id, sender_id
+	''')
+
+
+def migration_add_open_ticket_assignments():
+	cursor = get_cursor()
+	cursor.execute(
+		'CREATE UNIQUE INDEX IF NOT EXISTS "uq_open_ticket_assignments" ON "open_ticket_assignments" ("main_channel_id", "main_message_id")'
+	)
+	cursor.execute('''
+		INSERT OR REPLACE INTO open_ticket_assignments (main_channel_id, main_message_id, user_tags, priority, update_time)
+		SELECT main_channel_id, main_message_id, user_tags, priority, update_time FROM tickets_data WHERE is_opened=1
+	''')
+
+
+def migration_add_message_contents_index():
+	cursor = get_cursor()
+	cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS "uq_message_contents" ON "message_contents" ("chat_id", "message_id")')
+
+
+def migration_add_rendered_messages_index():
+	cursor = get_cursor()
+	cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS "uq_rendered_messages" ON "rendered_messages" ("chat_id", "message_id")')
+
+
+def migration_add_ticket_closed_time():
+	cursor = get_cursor()
+	cursor.execute('ALTER TABLE "tickets_data" ADD COLUMN "closed_time" INT')
+	# close time of already closed tickets is unknown, so they are kept for the whole retention period from now
+	cursor.execute("UPDATE tickets_data SET closed_time=(?) WHERE is_opened=0", (int(time.time()),))
+
+
+# append new migrations to the end of the list, position in the list is the schema version of the migration
+MIGRATIONS = [
+	migration_add_lookup_indexes,
+	migration_analyze_tables,
+	migration_add_unique_constraints,
+	migration_backfill_ticket_users_and_channel_priorities,
+	migration_add_comment_thread_roots,
+	migration_add_open_ticket_assignments,
+	migration_add_message_contents_index,
+	migration_add_rendered_messages_index,
+	migration_add_ticket_closed_time,
+]
+
+
+def get_table_columns(table_name, database="main"):
+	cursor = get_cursor()
+	cursor.execute(f"PRAGMA {database}.table_info({table_name})")
+	return [row[1] for row in cursor.fetchall()]
+
+
+def create_archive_tables():
+	cursor = get_cursor()
+	for table_name in ARCHIVED_TABLES:
+		sql = f"CREATE TABLE IF NOT EXISTS {ARCHIVE_DATABASE}.{table_name} AS SELECT * FROM main.{table_name} WHERE 0"
+		cursor.execute(sql)
+		# columns added to the main table by migrations after the archive table was created
+		archive_columns = get_table_columns(table_name, ARCHIVE_DATABASE)
+		for column in get_table_columns(table_name):
+			if column not in archive_columns:
+				cursor.execute(f"ALTER TABLE {ARCHIVE_DATABASE}.{table_name} ADD COLUMN {column}")
+
+		key_columns = ", ".join(UNIQUE_KEYS[table_name])
+		sql = f"CREATE UNIQUE INDEX IF NOT EXISTS {ARCHIVE_DATABASE}.uq_{table_name} ON {table_name} ({key_columns})"
+		cursor.execute(sql)
+	# archived comments are restored by their thread
+	sql = f"CREATE INDEX IF NOT EXISTS {ARCHIVE_DATABASE}.idx_comment_messages_thread ON comment_messages (discussion_chat_id, thread_root_id)"
+	cursor.execute(sql)
+	get_connection().commit()
 
 
 @db_thread_lock
 def insert_or_update_discussion_message(main_message_id, main_channel_id, discussion_message_id):
-	if get_discussion_message_id(main_message_id, main_channel_id):
-		sql = "UPDATE discussion_messages SET discussion_message_id=(?) WHERE main_message_id=(?) and main_channel_id=(?)"
-	else:
-		sql = "INSERT INTO discussion_messages (discussion_message_id, main_message_id, main_channel_id) VALUES (?, ?, ?)"
+	sql = '''
+		INSERT INTO discussion_messages (discussion_message_id, main_message_id, main_channel_id) VALUES (?, ?, ?)
+		ON CONFLICT (main_channel_id, main_message_id) DO UPDATE SET discussion_message_id=excluded.discussion_message_id
+	'''
 
-	CURSOR.execute(sql, (discussion_message_id, main_message_id, main_channel_id, ))
-	DB_CONNECTION.commit()
+	cursor = get_cursor()
+	cursor.execute(sql, (discussion_message_id, main_message_id, main_channel_id, ))
 
 
-@db_thread_lock
+@db_read_only
 def get_discussion_message_id(main_message_id, main_channel_id):
 	sql = "SELECT discussion_message_id FROM discussion_messages WHERE main_message_id=(?) and main_channel_id=(?)"
-	CURSOR.execute(sql, (main_message_id, main_channel_id,))
-	result = CURSOR.fetchone()
+	cursor = get_cursor()
+	cursor.execute(sql, (main_message_id, main_channel_id,))
+	result = cursor.fetchone()
 	if result:
 		return result[0]
 
 
-@db_thread_lock
+@db_read_only
 def get_main_from_discussion_message(discussion_message_id, main_channel_id):
 	sql = "SELECT main_message_id FROM discussion_messages WHERE discussion_message_id=(?) and main_channel_id=(?)"
-	CURSOR.execute(sql, (discussion_message_id, main_channel_id,))
-	result = CURSOR.fetchone()
+	cursor = get_cursor()
+	cursor.execute(sql, (discussion_message_id, main_channel_id,))
+	result = cursor.fetchone()
 	if result:
 		return result[0]
 
@@ -249,39 +1329,42 @@ def get_main_from_discussion_message(discussion_message_id, main_channel_id):
 @db_thread_lock
 def insert_copied_message(main_message_id, main_channel_id, copied_message_id, copied_channel_id):
 	sql = "INSERT INTO copied_messages (copied_message_id, copied_channel_id, main_message_id, main_channel_id) VALUES (?, ?, ?, ?)"
-	CURSOR.execute(sql, (copied_message_id, copied_channel_id, main_message_id, main_channel_id,))
-	DB_CONNECTION.commit()
+	cursor = get_cursor()
+	cursor.execute(sql, (copied_message_id, copied_channel_id, main_message_id, main_channel_id,))
 
 
 @db_thread_lock
 def delete_copied_message(copied_message_id, copied_channel_id):
 	sql = "DELETE FROM copied_messages WHERE copied_message_id=(?) and copied_channel_id=(?)"
-	CURSOR.execute(sql, (copied_message_id, copied_channel_id))
-	DB_CONNECTION.commit()
+	cursor = get_cursor()
+	cursor.execute(sql, (copied_message_id, copied_channel_id))
 
 
-@db_thread_lock
+@db_read_only
 def get_copied_message_data(main_message_id, main_channel_id):
 	sql = "SELECT copied_message_id, copied_channel_id FROM copied_messages WHERE main_message_id=(?) and main_channel_id=(?)"
-	CURSOR.execute(sql, (main_message_id, main_channel_id,))
-	result = CURSOR.fetchall()
+	cursor = get_cursor()
+	cursor.execute(sql, (main_message_id, main_channel_id,))
+	result = cursor.fetchall()
 	return result
 
 
-@db_thread_lock
+@db_read_only
 def get_main_message_from_copied(copied_message_id, copied_channel_id):
 	sql = "SELECT main_message_id, main_channel_id FROM copied_messages WHERE copied_message_id=(?) and copied_channel_id=(?)"
-	CURSOR.execute(sql, (copied_message_id, copied_channel_id,))
-	result = CURSOR.fetchone()
+	cursor = get_cursor()
+	cursor.execute(sql, (copied_message_id, copied_channel_id,))
+	result = cursor.fetchone()
 	if result:
 		return result
 
 
-@db_thread_lock
+@db_read_only
 def get_oldest_copied_message(copied_channel_id):
 	sql = "SELECT min(copied_message_id) FROM copied_messages WHERE copied_channel_id=(?)"
-	CURSOR.execute(sql, (copied_channel_id,))
-	result = CURSOR.fetchone()
+	cursor = get_cursor()
+	cursor.execute(sql, (copied_channel_id,))
+	result = cursor.fetchone()
 	if result:
 		return result[0]
 
@@ -289,200 +1372,283 @@ def get_oldest_copied_message(copied_channel_id):
 @db_thread_lock
 def update_copied_message_id(copied_message_id, copied_channel_id, updated_message_id):
 	sql = "UPDATE copied_messages SET copied_message_id=(?) WHERE copied_message_id=(?) AND copied_channel_id=(?)"
-	CURSOR.execute(sql, (updated_message_id, copied_message_id, copied_channel_id,))
-	DB_CONNECTION.commit()
+	cursor = get_cursor()
+	cursor.execute(sql, (updated_message_id, copied_message_id, copied_channel_id,))
 
 
-@db_thread_lock
+@db_read_only
 def get_copied_messages_from_main(main_message_id, main_channel_id):
 	sql = "SELECT copied_message_id, copied_channel_id FROM copied_messages WHERE main_message_id=(?) AND main_channel_id=(?)"
-	CURSOR.execute(sql, (main_message_id, main_channel_id,))
-	result = CURSOR.fetchall()
+	cursor = get_cursor()
+	cursor.execute(sql, (main_message_id, main_channel_id,))
+	result = cursor.fetchall()
 	return result
 
 
-@db_thread_lock
+@db_read_only
 def get_newest_copied_message(copied_channel_id):
 	sql = "SELECT max(copied_message_id) FROM copied_messages WHERE copied_channel_id=(?)"
-	CURSOR.execute(sql, (copied_channel_id,))
-	result = CURSOR.fetchone()
+	cursor = get_cursor()
+	cursor.execute(sql, (copied_channel_id,))
+	result = cursor.fetchone()
 	if result:
 		return result[0]
 
 
 @db_thread_lock
 def insert_or_update_last_msg_id(last_message_id, chat_id):
-	if get_last_message_id(chat_id):
-		sql = "UPDATE last_message_ids SET last_message_id=(?) WHERE chat_id=(?)"
-	else:
-		sql = "INSERT INTO last_message_ids (last_message_id, chat_id) VALUES (?, ?)"
+	# updates of different shards are handled out of order, so the stored id never moves backwards
+	sql = '''
+		INSERT INTO last_message_ids (last_message_id, chat_id) VALUES (?, ?)
+		ON CONFLICT (chat_id) DO UPDATE SET last_message_id=max(last_message_id, excluded.last_message_id)
+	'''
 
-	CURSOR.execute(sql, (last_message_id, chat_id,))
-	DB_CONNECTION.commit()
+	cursor = get_cursor()
+	cursor.execute(sql, (last_message_id, chat_id,))
 
 
 @db_thread_lock
+def insert_or_update_message_content(chat_id, message_id, content_type, edit_date, message_json):
+	# updates arrive out of order, so older version of the message never replaces the newer one
+	sql = '''
+		INSERT INTO message_contents (chat_id, message_id, content_type, edit_date, message_json) VALUES (?, ?, ?, ?, ?)
+		ON CONFLICT (chat_id, message_id) DO UPDATE SET
+		content_type=excluded.content_type, edit_date=excluded.edit_date, message_json=excluded.message_json
+		WHERE excluded.edit_date >= message_contents.edit_date
+	'''
+
+	cursor = get_cursor()
+	cursor.execute(sql, (chat_id, message_id, content_type, edit_date or 0, message_json,))
+
+
+@db_read_only
+def get_message_content(chat_id, message_id):
+	sql = "SELECT message_json FROM message_contents WHERE chat_id=(?) AND message_id=(?)"
+	cursor = get_cursor()
+	cursor.execute(sql, (chat_id, message_id,))
+	result = cursor.fetchone()
+	if result:
+		return result[0]
+
+
+@db_thread_lock
+def delete_message_content(chat_id, message_id):
+	sql = "DELETE FROM message_contents WHERE chat_id=(?) AND message_id=(?)"
+	cursor = get_cursor()
+	cursor.execute(sql, (chat_id, message_id,))
+
+
+@db_thread_lock
+def insert_or_update_rendered_message(chat_id, message_id, content_hash, keyboard_hash):
+	# keyboard edits don't change content, so content hash is kept if it's not specified
+	sql = '''
+		INSERT INTO rendered_messages (chat_id, message_id, content_hash, keyboard_hash) VALUES (?, ?, ?, ?)
+		ON CONFLICT (chat_id, message_id) DO UPDATE SET
+		content_hash=coalesce(excluded.content_hash, rendered_messages.content_hash), keyboard_hash=excluded.keyboard_hash
+	'''
+
+	cursor = get_cursor()
+	cursor.execute(sql, (chat_id, message_id, content_hash, keyboard_hash,))
+
+
+@db_read_only
+def get_rendered_message(chat_id, message_id):
+	sql = "SELECT content_hash, keyboard_hash FROM rendered_messages WHERE chat_id=(?) AND message_id=(?)"
+	cursor = get_cursor()
+	cursor.execute(sql, (chat_id, message_id,))
+	return cursor.fetchone()
+
+
+@db_thread_lock
+def delete_rendered_message(chat_id, message_id):
+	sql = "DELETE FROM rendered_messages WHERE chat_id=(?) AND message_id=(?)"
+	cursor = get_cursor()
+	cursor.execute(sql, (chat_id, message_id,))
+
+
+@db_read_only
 def get_last_message_id(chat_id):
 	sql = "SELECT last_message_id FROM last_message_ids WHERE chat_id=(?)"
-	CURSOR.execute(sql, (chat_id,))
-	result = CURSOR.fetchone()
+	cursor = get_cursor()
+	cursor.execute(sql, (chat_id,))
+	result = cursor.fetchone()
 	if result:
 		return result[0]
 
 
 @db_thread_lock
 def insert_comment_message(reply_to_message_id, discussion_message_id, discussion_chat_id, sender_id):
-	if is_comment_exist(discussion_message_id, discussion_chat_id):
+	thread_root_id = get_comment_thread_root(reply_to_message_id, discussion_chat_id) or reply_to_message_id
+	restore_archived_rows({"comment_messages": ("discussion_chat_id=(?) AND thread_root_id=(?)", (discussion_chat_id, thread_root_id,))})
+	sql = '''
+		INSERT INTO comment_messages (reply_to_message_id, message_id, discussion_chat_id, sender_id, thread_root_id)
+		VALUES (?, ?, ?, ?, ?) ON CONFLICT (discussion_chat_id, message_id) DO NOTHING
+	'''
+	cursor = get_cursor()
+	cursor.execute(sql, (reply_to_message_id, discussion_message_id, discussion_chat_id, sender_id, thread_root_id,))
+	if cursor.rowcount == 0:
 		return
 
-	sql = "INSERT INTO comment_messages (reply_to_message_id, message_id, discussion_chat_id, sender_id) VALUES (?, ?, ?, ?)"
-	CURSOR.execute(sql, (reply_to_message_id, discussion_message_id, discussion_chat_id, sender_id,))
-	DB_CONNECTION.commit()
+	# replies can be saved before the comment they reply to (e.g. during export), in that case
+	# they were counted as a separate thread that now is moved to the thread of this comment
+	sql = "UPDATE comment_messages SET thread_root_id=(?) WHERE thread_root_id=(?) AND discussion_chat_id=(?)"
+	cursor.execute(sql, (thread_root_id, discussion_message_id, discussion_chat_id,))
+	if cursor.rowcount > 0:
+		sql = '''
+			INSERT INTO comment_stats (discussion_chat_id, thread_root_id, sender_id, comments_count, last_comment_id)
+			SELECT discussion_chat_id, (?), sender_id, comments_count, last_comment_id FROM comment_stats
+			WHERE discussion_chat_id=(?) AND thread_root_id=(?)
+			ON CONFLICT (discussion_chat_id, thread_root_id, sender_id) DO UPDATE SET
+			comments_count=comments_count + excluded.comments_count,
+			last_comment_id=max(last_comment_id, excluded.last_comment_id)
+		'''
+		cursor.execute(sql, (thread_root_id, discussion_chat_id, discussion_message_id,))
+		sql = "DELETE FROM comment_stats WHERE discussion_chat_id=(?) AND thread_root_id=(?)"
+		cursor.execute(sql, (discussion_chat_id, discussion_message_id,))
 
+	sql = '''
+		INSERT INTO comment_stats (discussion_chat_id, thread_root_id, sender_id, comments_count, last_comment_id)
+		VALUES (?, ?, ?, 1, ?) ON CONFLICT (discussion_chat_id, thread_root_id, sender_id) DO UPDATE SET
+		comments_count=comments_count + 1, last_comment_id=max(last_comment_id, excluded.last_comment_id)
+	'''
+	cursor.execute(sql, (discussion_chat_id, thread_root_id, sender_id, discussion_message_id,))
 
-@db_thread_lock
+
+@db_read_only
 def is_comment_exist(discussion_message_id, discussion_chat_id):
-	sql = "SELECT id FROM comment_messages WHERE message_id=(?) and discussion_chat_id=(?)"
-	CURSOR.execute(sql, (discussion_message_id, discussion_chat_id,))
-	result = CURSOR.fetchone()
+	sql = "SELECT id FROM {database}.comment_messages WHERE message_id=(?) and discussion_chat_id=(?)"
+	result = fetch_one_with_archive(sql, (discussion_message_id, discussion_chat_id,))
 	return bool(result)
 
 
-@db_thread_lock
+@db_read_only
+def get_comment_thread_root(discussion_message_id, discussion_chat_id):
+	sql = "SELECT thread_root_id FROM {database}.comment_messages WHERE message_id=(?) and discussion_chat_id=(?)"
+	result = fetch_one_with_archive(sql, (discussion_message_id, discussion_chat_id,))
+	if result:
+		return result[0]
+
+
+@db_read_only
 def get_comments_count(discussion_message_id, discussion_chat_id, ignored_sender_id=0):
+	# discussion_message_id is the root of the thread, counters are stored per sender of the comments
 	sql = '''
-		WITH RECURSIVE
-		  reply_messages(comment_id) AS (
-			 SELECT (?)
-			 UNION ALL
-			 SELECT message_id FROM comment_messages, reply_messages WHERE reply_to_message_id = reply_messages.comment_id
-			 AND discussion_chat_id = (?) AND sender_id != (?)
-		  )
-		SELECT count(comment_id) - 1 FROM reply_messages;
+		SELECT coalesce(sum(comments_count), 0) FROM comment_stats
+		WHERE thread_root_id=(?) AND discussion_chat_id=(?) AND sender_id != (?)
 	'''
 
-	CURSOR.execute(sql, (discussion_message_id, discussion_chat_id, ignored_sender_id,))
-	result = CURSOR.fetchone()
+	cursor = get_cursor()
+	cursor.execute(sql, (discussion_message_id, discussion_chat_id, ignored_sender_id,))
+	result = cursor.fetchone()
 	return result[0]
 
 
-@db_thread_lock
+@db_read_only
 def get_comment_top_parent(discussion_message_id, discussion_chat_id):
-	sql = '''
-		WITH RECURSIVE
-		  reply_messages(comment_id) AS (
-		   SELECT (?)
-		   UNION ALL
-		   SELECT reply_to_message_id FROM comment_messages, reply_messages WHERE message_id = reply_messages.comment_id
-		   AND discussion_chat_id = (?)
-		  )
-		SELECT MIN(comment_id) FROM reply_messages;	
-	'''
-
-	CURSOR.execute(sql, (discussion_message_id, discussion_chat_id,))
-	result = CURSOR.fetchone()
-	return result[0]
+	thread_root_id = get_comment_thread_root(discussion_message_id, discussion_chat_id)
+	return thread_root_id or discussion_message_id
 
 
-@db_thread_lock
+@db_read_only
 def get_last_comment(discussion_message_id, discussion_chat_id, ignored_sender_id=0):
 	sql = '''
-		WITH RECURSIVE
-		  reply_messages(comment_id) AS (
-			 SELECT (?)
-			 UNION ALL
-			 SELECT message_id FROM comment_messages, reply_messages WHERE reply_to_message_id = reply_messages.comment_id
-			 AND discussion_chat_id = (?) AND sender_id != (?)
-		  )
-		SELECT MAX(comment_id) FROM reply_messages;
+		SELECT max(last_comment_id) FROM comment_stats
+		WHERE thread_root_id=(?) AND discussion_chat_id=(?) AND sender_id != (?)
 	'''
 
-	CURSOR.execute(sql, (discussion_message_id, discussion_chat_id, ignored_sender_id,))
-	result = CURSOR.fetchone()
-	return result[0]
+	cursor = get_cursor()
+	cursor.execute(sql, (discussion_message_id, discussion_chat_id, ignored_sender_id,))
+	result = cursor.fetchone()
+	return result[0] or discussion_message_id
 
 
 @db_thread_lock
 def insert_scheduled_message(main_message_id, main_channel_id, scheduled_message_id, scheduled_channel_id, send_time):
 	sql = "INSERT INTO scheduled_messages (main_message_id, main_channel_id, scheduled_message_id, scheduled_channel_id, send_time) VALUES (?, ?, ?, ?, ?)"
-	CURSOR.execute(sql, (main_message_id, main_channel_id, scheduled_message_id, scheduled_channel_id, send_time,))
-	DB_CONNECTION.commit()
+	cursor = get_cursor()
+	cursor.execute(sql, (main_message_id, main_channel_id, scheduled_message_id, scheduled_channel_id, send_time,))
 
 
 @db_thread_lock
 def update_scheduled_message(main_message_id, main_channel_id, send_time):
 	sql = "UPDATE scheduled_messages SET send_time=(?) WHERE main_message_id=(?) and main_channel_id=(?)"
-	CURSOR.execute(sql, (send_time, main_message_id, main_channel_id,))
-	DB_CONNECTION.commit()
+	cursor = get_cursor()
+	cursor.execute(sql, (send_time, main_message_id, main_channel_id,))
 
 
-@db_thread_lock
+@db_read_only
 def get_scheduled_message_send_time(main_message_id, main_channel_id):
 	sql = "SELECT send_time FROM scheduled_messages WHERE main_message_id=(?) and main_channel_id=(?)"
-	CURSOR.execute(sql, (main_message_id, main_channel_id,))
-	result = CURSOR.fetchone()
+	cursor = get_cursor()
+	cursor.execute(sql, (main_message_id, main_channel_id,))
+	result = cursor.fetchone()
 	if result:
 		return result[0]
 
 
-@db_thread_lock
+@db_read_only
 def is_message_scheduled(main_message_id, main_channel_id):
 	sql = "SELECT id FROM scheduled_messages WHERE main_message_id=(?) and main_channel_id=(?)"
-	CURSOR.execute(sql, (main_message_id, main_channel_id,))
-	result = CURSOR.fetchone()
+	cursor = get_cursor()
+	cursor.execute(sql, (main_message_id, main_channel_id,))
+	result = cursor.fetchone()
 	return bool(result)
 
 
 @db_thread_lock
 def delete_scheduled_message_main(main_message_id, main_channel_id):
 	sql = "DELETE FROM scheduled_messages WHERE main_message_id=(?) AND main_channel_id=(?)"
-	CURSOR.execute(sql, (main_message_id, main_channel_id,))
-	DB_CONNECTION.commit()
+	cursor = get_cursor()
+	cursor.execute(sql, (main_message_id, main_channel_id,))
 
 
-@db_thread_lock
+@db_read_only
 def get_all_scheduled_messages():
 	sql = "SELECT main_message_id, main_channel_id, send_time FROM scheduled_messages"
-	CURSOR.execute(sql, ())
-	result = CURSOR.fetchall()
+	cursor = get_cursor()
+	cursor.execute(sql, ())
+	result = cursor.fetchall()
 	return result
 
 
-@db_thread_lock
+@db_read_only
 def get_finished_update_channels():
 	sql = "SELECT main_channel_id FROM interval_updates_status WHERE current_message_id <= 0"
-	CURSOR.execute(sql, ())
-	result = CURSOR.fetchall()
+	cursor = get_cursor()
+	cursor.execute(sql, ())
+	result = cursor.fetchall()
 	if result:
 		return [row[0] for row in result]
 	else:
 		return []
 
 
-@db_thread_lock
+@db_read_only
 def get_unfinished_update_channel():
 	sql = "SELECT main_channel_id, current_message_id FROM interval_updates_status WHERE current_message_id > 0"
-	CURSOR.execute(sql, ())
-	result = CURSOR.fetchone()
+	cursor = get_cursor()
+	cursor.execute(sql, ())
+	result = cursor.fetchone()
 	if result:
 		return result
 
 
 @db_thread_lock
 def insert_or_update_channel_update_progress(main_channel_id, current_message_id):
-	if get_update_in_progress_channel(main_channel_id):
-		sql = "UPDATE interval_updates_status SET current_message_id=(?) WHERE main_channel_id=(?)"
-	else:
-		sql = "INSERT INTO interval_updates_status(current_message_id, main_channel_id) VALUES (?, ?)"
-	CURSOR.execute(sql, (current_message_id, main_channel_id))
-	DB_CONNECTION.commit()
+	sql = '''
+		INSERT INTO interval_updates_status (current_message_id, main_channel_id) VALUES (?, ?)
+		ON CONFLICT (main_channel_id) DO UPDATE SET current_message_id=excluded.current_message_id
+	'''
+	cursor = get_cursor()
+	cursor.execute(sql, (current_message_id, main_channel_id))
 
 
-@db_thread_lock
+@db_read_only
 def get_update_in_progress_channel(main_channel_id):
 	sql = "SELECT current_message_id FROM interval_updates_status WHERE main_channel_id=(?)"
-	CURSOR.execute(sql, (main_channel_id,))
-	result = CURSOR.fetchone()
+	cursor = get_cursor()
+	cursor.execute(sql, (main_channel_id,))
+	result = cursor.fetchone()
 	if result:
 		return result
 
@@ -490,350 +1656,499 @@ def get_update_in_progress_channel(main_channel_id):
 @db_thread_lock
 def clear_updates_in_progress():
 	sql = "DELETE FROM interval_updates_status"
-	CURSOR.execute(sql, ())
-	DB_CONNECTION.commit()
+	cursor = get_cursor()
+	cursor.execute(sql, ())
 
 
-@db_thread_lock
+@db_read_only
 def get_main_channel_ids():
 	sql = "SELECT channel_id FROM main_channels"
-	CURSOR.execute(sql, ())
-	result = CURSOR.fetchall()
+	cursor = get_cursor()
+	cursor.execute(sql, ())
+	result = cursor.fetchall()
 	if result:
 		return [row[0] for row in result]
 	else:
 		return []
 
 
-@db_thread_lock
 def is_main_channel_exists(main_channel_id):
-	sql = "SELECT id FROM main_channels WHERE channel_id=(?)"
-	CURSOR.execute(sql, (main_channel_id,))
-	result = CURSOR.fetchone()
-	return bool(result)
+	return _CHANNEL_REGISTRY.is_main_channel(main_channel_id)
 
 
 @db_thread_lock
 def insert_main_channel(main_channel_id):
-	sql = "INSERT INTO main_channels(channel_id) VALUES (?)"
-	CURSOR.execute(sql, (main_channel_id,))
-	DB_CONNECTION.commit()
+	sql = "INSERT INTO main_channels(channel_id) VALUES (?) ON CONFLICT (channel_id) DO NOTHING"
+	cursor = get_cursor()
+	cursor.execute(sql, (main_channel_id,))
+	after_transaction(lambda: _CHANNEL_REGISTRY.add_main_channel(main_channel_id))
 
 
 @db_thread_lock
 def delete_main_channel(main_channel_id):
 	sql = "DELETE FROM main_channels WHERE channel_id=(?)"
-	CURSOR.execute(sql, (main_channel_id,))
-	DB_CONNECTION.commit()
+	cursor = get_cursor()
+	cursor.execute(sql, (main_channel_id,))
+	after_transaction(lambda: _CHANNEL_REGISTRY.remove_main_channel(main_channel_id))
 
 
-@db_thread_lock
+@db_read_only
 def get_main_channel_from_user(user_id):
 	sql = "SELECT main_channel_id FROM users WHERE user_id=(?)"
-	CURSOR.execute(sql, (user_id,))
-	result = CURSOR.fetchone()
+	cursor = get_cursor()
+	cursor.execute(sql, (user_id,))
+	result = cursor.fetchone()
 	if result:
 		return result[0]
 
 
-@db_thread_lock
+@db_read_only
 def get_tags_from_user_id(user_id):
 	sql = "SELECT user_tag FROM users WHERE user_id=(?)"
-	CURSOR.execute(sql, (user_id,))
-	result = CURSOR.fetchall()  # one user can have multiple tags assigned to him
+	cursor = get_cursor()
+	cursor.execute(sql, (user_id,))
+	result = cursor.fetchall()  # one user can have multiple tags assigned to him
 	if result:
 		return [row[0] for row in result]
 	else:
 		return []
 
 
-@db_thread_lock
+@db_read_only
 def get_main_channel_user_tags(main_channel_id):
 	sql = "SELECT user_tag FROM users WHERE main_channel_id=(?)"
-	CURSOR.execute(sql, (main_channel_id,))
-	result = CURSOR.fetchall()
+	cursor = get_cursor()
+	cursor.execute(sql, (main_channel_id,))
+	result = cursor.fetchall()
 	if result:
 		return [row[0] for row in result]
 
 
 @db_thread_lock
 def insert_or_update_user(main_channel_id, user_tag, user_id):
-	if is_user_tag_exists(main_channel_id, user_tag):
-		sql = "UPDATE users SET user_id=(?) WHERE main_channel_id=(?) AND user_tag=(?)"
-	else:
-		sql = "INSERT INTO users(user_id, main_channel_id, user_tag) VALUES (?, ?, ?)"
+	sql = '''
+		INSERT INTO users (user_id, main_channel_id, user_tag) VALUES (?, ?, ?)
+		ON CONFLICT (main_channel_id, user_tag) DO UPDATE SET user_id=excluded.user_id
+	'''
 
-	CURSOR.execute(sql, (user_id, main_channel_id, user_tag,))
-	DB_CONNECTION.commit()
+	cursor = get_cursor()
+	cursor.execute(sql, (user_id, main_channel_id, user_tag,))
 
 
 @db_thread_lock
 def delete_user_by_tag(main_channel_id, user_tag):
 	sql = "DELETE FROM users WHERE main_channel_id=(?) AND user_tag=(?)"
-	CURSOR.execute(sql, (main_channel_id, user_tag,))
-	DB_CONNECTION.commit()
+	cursor = get_cursor()
+	cursor.execute(sql, (main_channel_id, user_tag,))
 
 
-@db_thread_lock
+@db_read_only
 def get_main_message_sender(main_channel_id, main_message_id):
-	sql = "SELECT sender_id FROM main_messages WHERE main_channel_id=(?) AND main_message_id=(?)"
-	CURSOR.execute(sql, (main_channel_id, main_message_id,))
-	result = CURSOR.fetchone()
+	sql = "SELECT sender_id FROM {database}.main_messages WHERE main_channel_id=(?) AND main_message_id=(?)"
+	result = fetch_one_with_archive(sql, (main_channel_id, main_message_id,))
 	if result:
 		return result[0]
 
 
 @db_thread_lock
 def insert_main_channel_message(main_channel_id, main_message_id, sender_id):
-	if not is_main_message_exists(main_channel_id, main_message_id):
-		sql = '''
-			INSERT INTO main_messages
-			(main_channel_id, main_message_id, sender_id)
-			VALUES (?, ?, ?)
-		'''
-		CURSOR.execute(sql, (main_channel_id, main_message_id, sender_id,))
-		DB_CONNECTION.commit()
+	restore_archived_ticket(main_message_id, main_channel_id)
+	sql = '''
+		INSERT INTO main_messages
+		(main_channel_id, main_message_id, sender_id)
+		VALUES (?, ?, ?)
+		ON CONFLICT (main_channel_id, main_message_id) DO NOTHING
+	'''
+	cursor = get_cursor()
+	cursor.execute(sql, (main_channel_id, main_message_id, sender_id,))
 
 
-@db_thread_lock
+@db_read_only
 def get_main_message_sender(main_channel_id, main_message_id):
-	sql = "SELECT sender_id FROM main_messages WHERE main_channel_id=(?) AND main_message_id=(?)"
-	CURSOR.execute(sql, (main_channel_id, main_message_id,))
-	result = CURSOR.fetchone()
+	sql = "SELECT sender_id FROM {database}.main_messages WHERE main_channel_id=(?) AND main_message_id=(?)"
+	result = fetch_one_with_archive(sql, (main_channel_id, main_message_id,))
 	if result:
 		return result[0]
 
 
-@db_thread_lock
+@db_read_only
+def get_senders_many(main_channel_id, main_message_ids):
+	sql = '''
+		SELECT main_message_id, sender_id FROM {database}.main_messages
+		WHERE main_channel_id=(?) AND main_message_id IN ({placeholders})
+	'''
+	return dict(fetch_many_with_archive(sql, main_channel_id, main_message_ids))
+
+
+@db_read_only
+def main_messages_exist_many(main_channel_id, main_message_ids):
+	existing_messages = {main_message_id: False for main_message_id in main_message_ids}
+	sql = '''
+		SELECT main_message_id FROM {database}.main_messages
+		WHERE main_channel_id=(?) AND main_message_id IN ({placeholders})
+	'''
+	for row in fetch_many_with_archive(sql, main_channel_id, main_message_ids):
+		existing_messages[row[0]] = True
+	return existing_messages
+
+
+@db_read_only
 def is_main_message_exists(main_channel_id, main_message_id):
-	sql = "SELECT id FROM main_messages WHERE main_channel_id=(?) AND main_message_id=(?)"
-	CURSOR.execute(sql, (main_channel_id, main_message_id,))
-	result = CURSOR.fetchone()
+	sql = "SELECT id FROM {database}.main_messages WHERE main_channel_id=(?) AND main_message_id=(?)"
+	result = fetch_one_with_archive(sql, (main_channel_id, main_message_id,))
 	return bool(result)
 
 
-@db_thread_lock
+@db_read_only
 def is_user_tag_exists(main_channel_id, user_tag):
 	sql = "SELECT id FROM users WHERE main_channel_id=(?) AND user_tag=(?)"
-	CURSOR.execute(sql, (main_channel_id, user_tag,))
-	result = CURSOR.fetchone()
+	cursor = get_cursor()
+	cursor.execute(sql, (main_channel_id, user_tag,))
+	result = cursor.fetchone()
 	return bool(result)
 
 
-@db_thread_lock
+@db_read_only
 def get_all_users():
 	sql = "SELECT main_channel_id, user_id, user_tag FROM users"
-	CURSOR.execute(sql, ())
-	result = CURSOR.fetchall()
+	cursor = get_cursor()
+	cursor.execute(sql, ())
+	result = cursor.fetchall()
 	return result
 
 
-@db_thread_lock
+@db_read_only
 def get_channel_user_tags(main_channel_id):
 	sql = "SELECT user_tag FROM users WHERE main_channel_id=(?)"
-	CURSOR.execute(sql, (main_channel_id,))
-	result = CURSOR.fetchall()
+	cursor = get_cursor()
+	cursor.execute(sql, (main_channel_id,))
+	result = cursor.fetchall()
 	if result:
 		return [row[0] for row in result]
 	else:
 		return []
 
 
-@db_thread_lock
+@db_read_only
 def get_next_action_text(main_message_id, main_channel_id):
-	sql = "SELECT current_comment_text FROM next_action_comments WHERE main_channel_id=(?) AND main_message_id=(?)"
-	CURSOR.execute(sql, (main_channel_id, main_message_id,))
-	result = CURSOR.fetchone()
+	sql = "SELECT current_comment_text FROM {database}.next_action_comments WHERE main_channel_id=(?) AND main_message_id=(?)"
+	result = fetch_one_with_archive(sql, (main_channel_id, main_message_id,))
 	if result:
 		return result[0]
 
 
 @db_thread_lock
 def insert_or_update_current_next_action(main_message_id, main_channel_id, comment_text):
-	if get_next_action_text(main_message_id, main_channel_id) is not None:
-		sql = "UPDATE next_action_comments SET current_comment_text=(?) WHERE main_message_id=(?) and main_channel_id=(?)"
-	else:
-		sql = "INSERT INTO next_action_comments (current_comment_text, main_message_id, main_channel_id) VALUES (?, ?, ?)"
+	restore_archived_ticket(main_message_id, main_channel_id)
+	sql = '''
+		INSERT INTO next_action_comments (current_comment_text, main_message_id, main_channel_id) VALUES (?, ?, ?)
+		ON CONFLICT (main_channel_id, main_message_id) DO UPDATE SET current_comment_text=excluded.current_comment_text
+	'''
 
-	CURSOR.execute(sql, (comment_text, main_message_id, main_channel_id, ))
-	DB_CONNECTION.commit()
+	cursor = get_cursor()
+	cursor.execute(sql, (comment_text, main_message_id, main_channel_id, ))
 
 
 @db_thread_lock
 def update_previous_next_action(main_message_id, main_channel_id, comment_text):
+	restore_archived_ticket(main_message_id, main_channel_id)
 	sql = "UPDATE next_action_comments SET previous_comment_text=(?) WHERE main_message_id=(?) and main_channel_id=(?)"
-	CURSOR.execute(sql, (comment_text, main_message_id, main_channel_id, ))
-	DB_CONNECTION.commit()
+	cursor = get_cursor()
+	cursor.execute(sql, (comment_text, main_message_id, main_channel_id, ))
 
 
 @db_thread_lock
 def insert_or_update_ticket_data(main_message_id, main_channel_id, is_opened, user_tags, priority):
-	if get_ticket_data(main_message_id, main_channel_id):
-		sql = "UPDATE tickets_data SET is_opened=(?), user_tags=(?), priority=(?) WHERE main_message_id=(?) and main_channel_id=(?)"
-	else:
-		sql = "INSERT INTO tickets_data(is_opened, user_tags, priority, main_message_id, main_channel_id) VALUES (?, ?, ?, ?, ?)"
+	# closed_time keeps the time the ticket was closed, it's reset when the ticket is reopened
+	sql = '''
+		INSERT INTO tickets_data (is_opened, user_tags, priority, main_message_id, main_channel_id, closed_time)
+		VALUES (?, ?, ?, ?, ?, ?)
+		ON CONFLICT (main_channel_id, main_message_id) DO UPDATE SET
+		is_opened=excluded.is_opened, user_tags=excluded.user_tags, priority=excluded.priority,
+		closed_time=CASE WHEN excluded.is_opened=1 THEN NULL ELSE coalesce(tickets_data.closed_time, excluded.closed_time) END
+	'''
 	is_opened = 1 if is_opened else 0
-	CURSOR.execute(sql, (is_opened, user_tags, priority, main_message_id, main_channel_id, ))
-	DB_CONNECTION.commit()
+	closed_time = None if is_opened else int(time.time())
+	if is_opened:
+		restore_archived_ticket(main_message_id, main_channel_id)
+	cursor = get_cursor()
+	cursor.execute(sql, (is_opened, user_tags, priority, main_message_id, main_channel_id, closed_time, ))
+	update_open_ticket_assignment(main_message_id, main_channel_id)
+
+
+def update_open_ticket_assignment(main_message_id, main_channel_id):
+	# open_ticket_assignments contains copies of opened tickets_data rows, it's updated together with tickets_data
+	cursor = get_cursor()
+	sql = "DELETE FROM open_ticket_assignments WHERE main_message_id=(?) AND main_channel_id=(?)"
+	cursor.execute(sql, (main_message_id, main_channel_id,))
+	sql = '''
+		INSERT INTO open_ticket_assignments (main_channel_id, main_message_id, user_tags, priority, update_time)
+		SELECT main_channel_id, main_message_id, user_tags, priority, update_time FROM tickets_data
+		WHERE main_message_id=(?) AND main_channel_id=(?) AND is_opened=1
+	'''
+	cursor.execute(sql, (main_message_id, main_channel_id,))
 
 
-@db_thread_lock
+@db_read_only
 def get_ticket_data(main_message_id, main_channel_id):
 	sql = "SELECT user_tags, priority, update_time FROM tickets_data WHERE main_message_id=(?) and main_channel_id=(?)"
-	CURSOR.execute(sql, (main_message_id, main_channel_id, ))
-	result = CURSOR.fetchone()
+	cursor = get_cursor()
+	cursor.execute(sql, (main_message_id, main_channel_id, ))
+	result = cursor.fetchone()
 	return result
 
 
 @db_thread_lock
 def set_ticket_update_time(main_message_id, main_channel_id, update_time):
+	restore_archived_ticket(main_message_id, main_channel_id)
 	sql = "UPDATE tickets_data SET update_time=(?) WHERE main_message_id=(?) AND main_channel_id=(?)"
-	CURSOR.execute(sql, (update_time, main_message_id, main_channel_id, ))
-	DB_CONNECTION.commit()
+	cursor = get_cursor()
+	cursor.execute(sql, (update_time, main_message_id, main_channel_id, ))
+	sql = "UPDATE open_ticket_assignments SET update_time=(?) WHERE main_message_id=(?) AND main_channel_id=(?)"
+	cursor.execute(sql, (update_time, main_message_id, main_channel_id, ))
 
 
-@db_thread_lock
+@db_read_only
 def get_user_highest_priority(main_channel_id, user_tag):
-	sql = "SELECT min(priority) FROM tickets_data WHERE user_tags LIKE '%' || ? || '%' AND main_channel_id=(?)"
-	CURSOR.execute(sql, (user_tag, main_channel_id,))
-	result = CURSOR.fetchone()
+	sql = '''
+		SELECT min(tickets_data.priority) FROM ticket_users INNER JOIN tickets_data ON
+		tickets_data.main_channel_id = ticket_users.main_channel_id AND
+		tickets_data.main_message_id = ticket_users.main_message_id
+		WHERE ticket_users.user_tag=(?) AND ticket_users.main_channel_id=(?)
+	'''
+	cursor = get_cursor()
+	cursor.execute(sql, (user_tag, main_channel_id,))
+	result = cursor.fetchone()
 	return result[0]
 
 
 @db_thread_lock
 def delete_ticket_data(main_message_id, main_channel_id):
 	sql = "DELETE FROM tickets_data WHERE main_message_id=(?) AND main_channel_id=(?)"
-	CURSOR.execute(sql, (main_message_id, main_channel_id,))
-	DB_CONNECTION.commit()
+	cursor = get_cursor()
+	cursor.execute(sql, (main_message_id, main_channel_id,))
+	sql = "DELETE FROM ticket_users WHERE main_message_id=(?) AND main_channel_id=(?)"
+	cursor.execute(sql, (main_message_id, main_channel_id,))
+	sql = "DELETE FROM open_ticket_assignments WHERE main_message_id=(?) AND main_channel_id=(?)"
+	cursor.execute(sql, (main_message_id, main_channel_id,))
 
 
 @db_thread_lock
-def insert_or_update_last_user_interaction(main_channel_id, user_tag, interaction_time):
-	if is_user_reminder_data_exists(main_channel_id, user_tag):
-		sql = "UPDATE user_reminder_data SET last_interaction_time=(?) WHERE user_tag=(?) AND main_channel_id=(?)"
-	else:
-		sql = "INSERT INTO user_reminder_data(last_interaction_time, user_tag, main_channel_id) VALUES (?, ?, ?)"
-	CURSOR.execute(sql, (interaction_time, user_tag, main_channel_id,))
-	DB_CONNECTION.commit()
+def update_ticket_users(main_message_id, main_channel_id, user_tags):
+	sql = "DELETE FROM ticket_users WHERE main_message_id=(?) AND main_channel_id=(?)"
+	cursor = get_cursor()
+	cursor.execute(sql, (main_message_id, main_channel_id,))
+	if not user_tags:
+		return
+
+	sql = "INSERT INTO ticket_users (main_channel_id, main_message_id, user_tag, position) VALUES (?, ?, ?, ?)"
+	rows = [(main_channel_id, main_message_id, user_tag, position) for position, user_tag in enumerate(user_tags)]
+	cursor.executemany(sql, rows)
+
+
+@db_read_only
+def get_ticket_users(main_message_id, main_channel_id):
+	sql = "SELECT user_tag FROM ticket_users WHERE main_message_id=(?) AND main_channel_id=(?) ORDER BY position"
+	cursor = get_cursor()
+	cursor.execute(sql, (main_message_id, main_channel_id,))
+	result = cursor.fetchall()
+	return [row[0] for row in result]
 
 
 @db_thread_lock
+def insert_or_update_last_user_interaction(main_channel_id, user_tag, interaction_time):
+	sql = '''
+		INSERT INTO user_reminder_data (last_interaction_time, user_tag, main_channel_id) VALUES (?, ?, ?)
+		ON CONFLICT (main_channel_id, user_tag) DO UPDATE SET last_interaction_time=excluded.last_interaction_time
+	'''
+	cursor = get_cursor()
+	cursor.execute(sql, (interaction_time, user_tag, main_channel_id,))
+
+
+@db_read_only
 def get_last_interaction_time(main_channel_id, user_tag):
 	sql = "SELECT last_interaction_time FROM user_reminder_data WHERE user_tag=(?) AND main_channel_id=(?)"
-	CURSOR.execute(sql, (user_tag, main_channel_id,))
-	result = CURSOR.fetchone()
+	cursor = get_cursor()
+	cursor.execute(sql, (user_tag, main_channel_id,))
+	result = cursor.fetchone()
 	if result:
 		return result[0]
 
 
-@db_thread_lock
+@db_read_only
 def is_user_reminder_data_exists(main_channel_id, user_tag):
 	sql = "SELECT id FROM user_reminder_data WHERE user_tag=(?) AND main_channel_id=(?)"
-	CURSOR.execute(sql, (user_tag, main_channel_id,))
-	result = CURSOR.fetchone()
+	cursor = get_cursor()
+	cursor.execute(sql, (user_tag, main_channel_id,))
+	result = cursor.fetchone()
 	return bool(result)
 
 
-@db_thread_lock
+@db_read_only
 def get_ticket_remind_time(main_message_id, main_channel_id, user_tag):
-	sql = "SELECT reminded_at FROM reminded_tickets WHERE main_message_id=(?) AND main_channel_id=(?) AND user_tag=(?)"
-	CURSOR.execute(sql, (main_message_id, main_channel_id, user_tag,))
-	result = CURSOR.fetchone()
+	sql = "SELECT reminded_at FROM {database}.reminded_tickets WHERE main_message_id=(?) AND main_channel_id=(?) AND user_tag=(?)"
+	result = fetch_one_with_archive(sql, (main_message_id, main_channel_id, user_tag,))
 	if result:
 		return result[0]
 
 
 @db_thread_lock
 def insert_or_update_remind_time(main_message_id, main_channel_id, user_tag, remind_time):
-	if get_ticket_remind_time(main_message_id, main_channel_id, user_tag):
-		sql = "UPDATE reminded_tickets SET reminded_at=(?) WHERE user_tag=(?) AND main_channel_id=(?) AND main_message_id=(?)"
-	else:
-		sql = "INSERT INTO reminded_tickets(reminded_at, user_tag, main_channel_id, main_message_id) VALUES (?, ?, ?, ?)"
-	CURSOR.execute(sql, (remind_time, user_tag, main_channel_id, main_message_id,))
-	DB_CONNECTION.commit()
+	restore_archived_ticket(main_message_id, main_channel_id)
+	sql = '''
+		INSERT INTO reminded_tickets (reminded_at, user_tag, main_channel_id, main_message_id) VALUES (?, ?, ?, ?)
+		ON CONFLICT (main_channel_id, main_message_id, user_tag) DO UPDATE SET reminded_at=excluded.reminded_at
+	'''
+	cursor = get_cursor()
+	cursor.execute(sql, (remind_time, user_tag, main_channel_id, main_message_id,))
 
 
-@db_thread_lock
+@db_read_only
 def get_custom_hashtag(channel_id):
 	sql = "SELECT custom_hashtag FROM custom_channel_hashtags WHERE channel_id=(?)"
-	CURSOR.execute(sql, (channel_id,))
-	result = CURSOR.fetchone()
+	cursor = get_cursor()
+	cursor.execute(sql, (channel_id,))
+	result = cursor.fetchone()
 	if result:
 		return result[0]
 
 
-@db_thread_lock
+@db_read_only
 def is_custom_hashtag_exists(channel_id):
 	sql = "SELECT id FROM custom_channel_hashtags WHERE channel_id=(?)"
-	CURSOR.execute(sql, (channel_id,))
-	result = CURSOR.fetchone()
+	cursor = get_cursor()
+	cursor.execute(sql, (channel_id,))
+	result = cursor.fetchone()
 	return bool(result)
 
 
 @db_thread_lock
 def insert_or_update_custom_hashtag(channel_id, custom_hashtag):
-	if is_custom_hashtag_exists(channel_id):
-		sql = "UPDATE custom_channel_hashtags SET custom_hashtag=(?) WHERE channel_id=(?)"
-	else:
-		sql = "INSERT INTO custom_channel_hashtags(custom_hashtag, channel_id) VALUES (?, ?)"
-	CURSOR.execute(sql, (custom_hashtag, channel_id,))
-	DB_CONNECTION.commit()
+	sql = '''
+		INSERT INTO custom_channel_hashtags (custom_hashtag, channel_id) VALUES (?, ?)
+		ON CONFLICT (channel_id) DO UPDATE SET custom_hashtag=excluded.custom_hashtag
+	'''
+	cursor = get_cursor()
+	cursor.execute(sql, (custom_hashtag, channel_id,))
 
 
-@db_thread_lock
 def is_individual_channel_exists(channel_id):
-	sql = "SELECT id FROM individual_channel_settings WHERE channel_id=(?)"
-	CURSOR.execute(sql, (channel_id,))
-	result = CURSOR.fetchone()
-	return bool(result)
+	return _CHANNEL_REGISTRY.is_individual_channel(channel_id)
 
 
-@db_thread_lock
+def get_settings_cache_version():
+	"""
+	Should be called before reading settings that will be parsed by parse_channel_settings.
+	"""
+	return _SETTINGS_CACHE.version
+
+
+def parse_channel_settings(channel_id, settings, cache_version):
+	"""
+	Returns settings of the channel from the cache, settings read from the database are parsed only on cache miss.
+	"""
+	entry = _SETTINGS_CACHE.get(channel_id)
+	if entry is None:
+		entry = _SETTINGS_CACHE.add(channel_id, settings, None, cache_version)
+	return entry.to_dict()
+
+
+def get_cached_channel_settings(channel_id):
+	"""
+	Returns parsed settings and priorities string of the individual channel, the database is queried only on cache miss.
+	"""
+	entry = _SETTINGS_CACHE.get(channel_id, with_priorities=True)
+	if entry is None:
+		cache_version = _SETTINGS_CACHE.version
+		result = get_individual_channel_settings(channel_id)
+		if not result:
+			return None
+		settings_str, priorities_str = result
+		entry = _SETTINGS_CACHE.add(channel_id, settings_str, priorities_str or "", cache_version)
+	return entry.to_dict(), entry.priorities
+
+
+def get_settings_cache_stats():
+	return _SETTINGS_CACHE.get_stats()
+
+
+@db_read_only
 def get_individual_channel_settings(channel_id):
 	sql = "SELECT settings, priorities FROM individual_channel_settings WHERE channel_id=(?)"
-	CURSOR.execute(sql, (channel_id,))
-	result = CURSOR.fetchone()
+	cursor = get_cursor()
+	cursor.execute(sql, (channel_id,))
+	result = cursor.fetchone()
 	return result
 
 
 @db_thread_lock
 def insert_individual_channel(main_channel_id, channel_id, settings, user_id):
-	if is_individual_channel_exists(channel_id):
-		return
-	sql = "INSERT INTO individual_channel_settings (main_channel_id, channel_id, settings, user_id) VALUES (?, ?, ?, ?)"
-	CURSOR.execute(sql, (main_channel_id, channel_id, settings, user_id,))
-	DB_CONNECTION.commit()
+	sql = '''
+		INSERT INTO individual_channel_settings (main_channel_id, channel_id, settings, user_id) VALUES (?, ?, ?, ?)
+		ON CONFLICT (channel_id) DO NOTHING
+	'''
+	cursor = get_cursor()
+	cursor.execute(sql, (main_channel_id, channel_id, settings, user_id,))
+	after_transaction(lambda: _CHANNEL_REGISTRY.add_individual_channel(channel_id, main_channel_id))
+	after_transaction(lambda: _SETTINGS_CACHE.invalidate(channel_id))
 
 
 @db_thread_lock
 def update_individual_channel_settings(channel_id, settings):
 	sql = "UPDATE individual_channel_settings SET settings=(?) WHERE channel_id=(?)"
-	CURSOR.execute(sql, (settings, channel_id,))
-	DB_CONNECTION.commit()
+	cursor = get_cursor()
+	cursor.execute(sql, (settings, channel_id,))
+	after_transaction(lambda: _SETTINGS_CACHE.invalidate(channel_id))
 
 
 @db_thread_lock
 def update_individual_channel(channel_id, settings, priority):
 	sql = "UPDATE individual_channel_settings SET settings=(?), priorities=(?) WHERE channel_id=(?)"
-	CURSOR.execute(sql, (settings, priority, channel_id,))
-	DB_CONNECTION.commit()
+	cursor = get_cursor()
+	cursor.execute(sql, (settings, priority, channel_id,))
+	after_transaction(lambda: _SETTINGS_CACHE.invalidate(channel_id))
 
 
 @db_thread_lock
 def delete_individual_channel(channel_id):
 	sql = "DELETE FROM individual_channel_settings WHERE channel_id=(?)"
-	CURSOR.execute(sql, (channel_id,))
-	DB_CONNECTION.commit()
+	cursor = get_cursor()
+	cursor.execute(sql, (channel_id,))
+	sql = "DELETE FROM channel_priorities WHERE channel_id=(?)"
+	cursor.execute(sql, (channel_id,))
+	after_transaction(lambda: _CHANNEL_REGISTRY.remove_individual_channel(channel_id))
+	after_transaction(lambda: _SETTINGS_CACHE.invalidate(channel_id))
 
 
 @db_thread_lock
+def update_channel_priorities(channel_id, priorities):
+	sql = "DELETE FROM channel_priorities WHERE channel_id=(?)"
+	cursor = get_cursor()
+	cursor.execute(sql, (channel_id,))
+	sql = "INSERT INTO channel_priorities (channel_id, priority) VALUES (?, ?) ON CONFLICT (channel_id, priority) DO NOTHING"
+	cursor.executemany(sql, [(channel_id, priority) for priority in priorities])
+
+
+@db_read_only
+def get_channel_priorities(channel_id):
+	sql = "SELECT priority FROM channel_priorities WHERE channel_id=(?) ORDER BY priority"
+	cursor = get_cursor()
+	cursor.execute(sql, (channel_id,))
+	result = cursor.fetchall()
+	return [row[0] for row in result]
+
+
+@db_read_only
 def get_individual_channels_by_priority(main_channel_id, priority):
 	sql = '''
-		SELECT channel_id, settings FROM individual_channel_settings WHERE main_channel_id=(?) AND
-		priorities LIKE '%' || ? || '%'
+		SELECT individual_channel_settings.channel_id, individual_channel_settings.settings
+		FROM channel_priorities INNER JOIN individual_channel_settings ON
+		individual_channel_settings.channel_id = channel_priorities.channel_id
+		WHERE individual_channel_settings.main_channel_id=(?) AND channel_priorities.priority=(?)
 	'''
-	CURSOR.execute(sql, (main_channel_id, priority,))
-	result = CURSOR.fetchall()
+	cursor = get_cursor()
+	cursor.execute(sql, (main_channel_id, priority,))
+	result = cursor.fetchall()
 	if result:
 		return result
 	else:
@@ -843,113 +2158,353 @@ def get_individual_channels_by_priority(main_channel_id, priority):
 @db_thread_lock
 def update_individual_channel_user(channel_id, user_id):
 	sql = "UPDATE individual_channel_settings SET user_id=(?) WHERE channel_id=(?)"
-	CURSOR.execute(sql, (user_id, channel_id,))
-	DB_CONNECTION.commit()
+	cursor = get_cursor()
+	cursor.execute(sql, (user_id, channel_id,))
+	after_transaction(lambda: _SETTINGS_CACHE.invalidate(channel_id))
 
 
-@db_thread_lock
+@db_read_only
 def get_user_individual_channels(main_channel_id, user_id):
 	sql = "SELECT channel_id, settings FROM individual_channel_settings WHERE main_channel_id=(?) AND user_id=(?)"
-	CURSOR.execute(sql, (main_channel_id, user_id,))
-	result = CURSOR.fetchall()
+	cursor = get_cursor()
+	cursor.execute(sql, (main_channel_id, user_id,))
+	result = cursor.fetchall()
 	if result:
 		return result
 	else:
 		return []
 
 
-@db_thread_lock
+@db_read_only
 def get_tickets_for_reminding(main_channel_id, user_id, user_tag):
 	# finds all forwarded tickets from every channel where user is channel's owner
 	# that match priority and is opened (scheduled tickets is ignored)
 	sql = '''
 		SELECT copied_messages.copied_channel_id, copied_messages.copied_message_id, copied_messages.main_channel_id,
-		copied_messages.main_message_id, tickets_data.user_tags, tickets_data.priority, tickets_data.update_time,
-		reminded_tickets.reminded_at FROM copied_messages LEFT JOIN tickets_data ON
-		tickets_data.main_channel_id = copied_messages.main_channel_id AND
-		tickets_data.main_message_id = copied_messages.main_message_id
+		copied_messages.main_message_id, open_tickets.user_tags, open_tickets.priority, open_tickets.update_time,
+		reminded_tickets.reminded_at FROM individual_channel_settings AS channels
+		JOIN copied_messages ON copied_messages.copied_channel_id = channels.channel_id
+		JOIN open_ticket_assignments AS open_tickets ON
+		open_tickets.main_channel_id = copied_messages.main_channel_id AND
+		open_tickets.main_message_id = copied_messages.main_message_id
 		LEFT JOIN reminded_tickets ON
 		reminded_tickets.main_channel_id = copied_messages.main_channel_id AND
 		reminded_tickets.main_message_id = copied_messages.main_message_id AND
 		reminded_tickets.user_tag = (?)
-		WHERE copied_channel_id IN (
-			SELECT channel_id FROM individual_channel_settings WHERE user_id = (?) AND main_channel_id = (?)
-		) AND copied_messages.main_message_id NOT IN (
-			SELECT main_message_id FROM scheduled_messages WHERE main_channel_id = copied_messages.main_channel_id
-		) AND tickets_data.is_opened=1;
+		WHERE channels.user_id = (?) AND channels.main_channel_id = (?) AND NOT EXISTS (
+			SELECT 1 FROM scheduled_messages WHERE scheduled_messages.main_channel_id = copied_messages.main_channel_id
+			AND scheduled_messages.main_message_id = copied_messages.main_message_id
+		);
 	'''
 
-	CURSOR.execute(sql, (user_tag, user_id, main_channel_id,))
-	result = CURSOR.fetchall()
+	cursor = get_cursor()
+	cursor.execute(sql, (user_tag, user_id, main_channel_id,))
+	result = cursor.fetchall()
 	return result
 
 
-@db_thread_lock
+@db_read_only
+def get_reminder_candidates(main_channel_id):
+	"""
+	Same as get_tickets_for_reminding, but for all users of the main channel in one query.
+	Returns dict with user tags as keys and lists of tickets as values.
+	"""
+	sql = '''
+		SELECT users.user_tag, copied_messages.copied_channel_id, copied_messages.copied_message_id,
+		copied_messages.main_channel_id, copied_messages.main_message_id, open_tickets.user_tags, open_tickets.priority,
+		open_tickets.update_time, reminded_tickets.reminded_at FROM users
+		JOIN individual_channel_settings AS channels ON
+		channels.main_channel_id = users.main_channel_id AND channels.user_id = users.user_id
+		JOIN copied_messages ON
+		copied_messages.copied_channel_id = channels.channel_id AND copied_messages.main_channel_id = users.main_channel_id
+		JOIN open_ticket_assignments AS open_tickets ON
+		open_tickets.main_channel_id = copied_messages.main_channel_id AND
+		open_tickets.main_message_id = copied_messages.main_message_id
+		LEFT JOIN reminded_tickets ON
+		reminded_tickets.main_channel_id = copied_messages.main_channel_id AND
+		reminded_tickets.main_message_id = copied_messages.main_message_id AND
+		reminded_tickets.user_tag = users.user_tag
+		WHERE users.main_channel_id = (?) AND NOT EXISTS (
+			SELECT 1 FROM scheduled_messages WHERE scheduled_messages.main_channel_id = copied_messages.main_channel_id
+			AND scheduled_messages.main_message_id = copied_messages.main_message_id
+		);
+	'''
+
+	cursor = get_cursor()
+	cursor.execute(sql, (main_channel_id,))
+	candidates = {}
+	for row in cursor.fetchall():
+		candidates.setdefault(row[0], []).append(row[1:])
+	return candidates
+
+
+@db_read_only
 def find_copied_message_from_main(main_message_id, main_channel_id, user_id, priority):
 	sql = '''
 		SELECT copied_message_id, copied_channel_id FROM copied_messages WHERE copied_channel_id IN (
-			SELECT channel_id FROM individual_channel_settings WHERE user_id=(?) AND main_channel_id=(?)
-			AND priorities LIKE '%' || ? || '%'
+			SELECT individual_channel_settings.channel_id FROM channel_priorities
+			INNER JOIN individual_channel_settings ON individual_channel_settings.channel_id = channel_priorities.channel_id
+			WHERE individual_channel_settings.user_id=(?) AND individual_channel_settings.main_channel_id=(?)
+			AND channel_priorities.priority=(?)
 		) AND main_message_id=(?) AND main_channel_id=(?)
 	'''
-	CURSOR.execute(sql, (user_id, main_channel_id, priority, main_message_id, main_channel_id))
-	result = CURSOR.fetchone()
+	cursor = get_cursor()
+	cursor.execute(sql, (user_id, main_channel_id, priority, main_message_id, main_channel_id))
+	result = cursor.fetchone()
 	return result
 
 
-@db_thread_lock
+@db_read_only
 def find_copied_message_in_channel(individual_channel_id, main_message_id):
 	sql = "SELECT copied_message_id FROM copied_messages WHERE copied_channel_id = (?) AND main_message_id = (?)"
-	CURSOR.execute(sql, (individual_channel_id, main_message_id,))
-	result = CURSOR.fetchone()
+	cursor = get_cursor()
+	cursor.execute(sql, (individual_channel_id, main_message_id,))
+	result = cursor.fetchone()
 	if result:
 		return result[0]
 
 
-@db_thread_lock
+@db_read_only
 def get_all_individual_channels(main_channel_id):
 	sql = "SELECT channel_id, settings FROM individual_channel_settings WHERE main_channel_id=(?)"
-	CURSOR.execute(sql, (main_channel_id,))
-	result = CURSOR.fetchall()
+	cursor = get_cursor()
+	cursor.execute(sql, (main_channel_id,))
+	result = cursor.fetchall()
 	if result:
 		return result
 	else:
 		return []
 
 
-@db_thread_lock
+@db_read_only
 def get_all_copied_messages(main_channel_id, main_message_id):
 	sql = '''
 		SELECT copied_channel_id, copied_message_id FROM copied_messages
 		WHERE main_channel_id = (?) AND main_message_id = (?)
 	'''
-	CURSOR.execute(sql, (main_channel_id, main_message_id))
-	return CURSOR.fetchall()
+	cursor = get_cursor()
+	cursor.execute(sql, (main_channel_id, main_message_id))
+	return cursor.fetchall()
 
 
-@db_thread_lock
+@db_read_only
 def get_sent_scheduled_message_time(main_message_id, main_channel_id):
-	sql = "SELECT sent_at FROM sent_scheduled_messages WHERE main_message_id = (?) AND main_channel_id=(?)"
-	CURSOR.execute(sql, (main_message_id, main_channel_id,))
-	result = CURSOR.fetchone()
+	sql = "SELECT sent_at FROM {database}.sent_scheduled_messages WHERE main_message_id = (?) AND main_channel_id=(?)"
+	result = fetch_one_with_archive(sql, (main_message_id, main_channel_id,))
 	if result:
 		return result[0]
 
 
 @db_thread_lock
 def insert_or_update_sent_scheduled_message(main_message_id, main_channel_id, sent_at):
-	if is_message_was_scheduled(main_message_id, main_channel_id):
-		sql = "UPDATE sent_scheduled_messages SET sent_at=(?) WHERE main_message_id=(?) and main_channel_id=(?)"
-	else:
-		sql = "INSERT INTO sent_scheduled_messages (sent_at, main_message_id, main_channel_id) VALUES (?, ?, ?)"
+	restore_archived_ticket(main_message_id, main_channel_id)
+	sql = '''
+		INSERT INTO sent_scheduled_messages (sent_at, main_message_id, main_channel_id) VALUES (?, ?, ?)
+		ON CONFLICT (main_channel_id, main_message_id) DO UPDATE SET sent_at=excluded.sent_at
+	'''
 
-	CURSOR.execute(sql, (sent_at, main_message_id, main_channel_id,))
-	DB_CONNECTION.commit()
+	cursor = get_cursor()
+	cursor.execute(sql, (sent_at, main_message_id, main_channel_id,))
 
 
-@db_thread_lock
+@db_read_only
 def is_message_was_scheduled(main_message_id, main_channel_id):
-	sql = "SELECT sent_at FROM sent_scheduled_messages WHERE main_message_id = (?) AND main_channel_id=(?)"
-	CURSOR.execute(sql, (main_message_id, main_channel_id,))
-	result = CURSOR.fetchone()
+	sql = "SELECT sent_at FROM {database}.sent_scheduled_messages WHERE main_message_id = (?) AND main_channel_id=(?)"
+	result = fetch_one_with_archive(sql, (main_message_id, main_channel_id,))
 	return bool(result)
+
+
+@db_read_only
+def get_archivable_tickets(main_channel_id, discussion_chat_id, closed_before, after_message_id, limit):
+	"""
+	Returns ids of closed tickets that weren't closed or updated since closed_before and still have rows in the archived tables,
+	ids are returned in ascending order starting after after_message_id.
+	"""
+	ticket_rows_conditions = [
+		f"EXISTS (SELECT 1 FROM {table_name} AS archived WHERE archived.main_channel_id=tickets_data.main_channel_id "
+		f"AND archived.main_message_id=tickets_data.main_message_id)"
+		for table_name in ARCHIVED_TABLES if table_name != "comment_messages"
+	]
+	ticket_rows_conditions.append('''EXISTS (
+		SELECT 1 FROM discussion_messages JOIN comment_messages ON
+		comment_messages.discussion_chat_id=(?) AND comment_messages.thread_root_id=discussion_messages.discussion_message_id
+		WHERE discussion_messages.main_channel_id=tickets_data.main_channel_id AND
+		discussion_messages.main_message_id=tickets_data.main_message_id
+	)''')
+	sql = f'''
+		SELECT main_message_id FROM tickets_data
+		WHERE main_channel_id=(?) AND main_message_id > (?) AND is_opened=0 AND max(coalesce(update_time, 0), coalesce(closed_time, 0)) < (?)
+		AND ({" OR ".join(ticket_rows_conditions)})
+		ORDER BY main_message_id LIMIT (?)
+	'''
+	cursor = get_cursor()
+	cursor.execute(sql, (main_channel_id, after_message_id, closed_before, discussion_chat_id, limit,))
+	return [row[0] for row in cursor.fetchall()]
+
+
+def get_archive_conditions(main_channel_id, main_message_ids, discussion_chat_id):
+	placeholders = get_placeholders(len(main_message_ids))
+	ticket_condition = (f"main_channel_id=(?) AND main_message_id IN ({placeholders})", (main_channel_id, *main_message_ids,))
+	conditions = {table_name: ticket_condition for table_name in ARCHIVED_TABLES if table_name != "comment_messages"}
+	if discussion_chat_id is None:
+		return conditions
+
+	sql = f"SELECT discussion_message_id FROM discussion_messages WHERE main_channel_id=(?) AND main_message_id IN ({placeholders})"
+	cursor = get_cursor()
+	cursor.execute(sql, (main_channel_id, *main_message_ids,))
+	thread_root_ids = [row[0] for row in cursor.fetchall()]
+	if thread_root_ids:
+		comments_condition = f"discussion_chat_id=(?) AND thread_root_id IN ({get_placeholders(len(thread_root_ids))})"
+		conditions["comment_messages"] = (comments_condition, (discussion_chat_id, *thread_root_ids,))
+	return conditions
+
+
+def restore_archived_rows(conditions):
+	"""
+	Moves rows that match conditions from the archive back to the main database, should be called by writing functions
+	before they change rows of the archived tables, so changed rows aren't split between the databases.
+	Rows that already exist in the main database are newer, so they are kept.
+	"""
+	if not is_archive_attached():
+		return
+	cursor = get_cursor()
+	for table_name, (condition, parameters) in conditions.items():
+		columns = ", ".join(get_table_columns(table_name))
+		sql = f'''
+			INSERT OR IGNORE INTO main.{table_name} ({columns})
+			SELECT {columns} FROM {ARCHIVE_DATABASE}.{table_name} WHERE {condition}
+		'''
+		cursor.execute(sql, parameters)
+		cursor.execute(f"DELETE FROM {ARCHIVE_DATABASE}.{table_name} WHERE {condition}", parameters)
+
+
+def restore_archived_ticket(main_message_id, main_channel_id):
+	"""
+	Moves rows of the reopened or changed ticket from the archive back to the main database, comments are restored
+	by insert_comment_message when a new comment is added to their thread.
+	"""
+	ticket_condition = ("main_channel_id=(?) AND main_message_id=(?)", (main_channel_id, main_message_id,))
+	restore_archived_rows({table_name: ticket_condition for table_name in ARCHIVED_TABLES if table_name != "comment_messages"})
+
+
+def archive_tickets(main_channel_id, main_message_ids, discussion_chat_id):
+	"""
+	Moves rows of the tickets from the archived tables to the archive database and returns amount of moved rows
+	for every table. Rows are copied and committed before they are deleted, so an interrupted move leaves
+	duplicates that are replaced by the next move instead of losing rows.
+	main_message_ids should fit into one query, so the lock is held only for one small batch.
+	"""
+	try:
+		with _DB_LOCK:
+			with transaction():
+				conditions = get_archive_conditions(main_channel_id, main_message_ids, discussion_chat_id)
+				cursor = get_cursor()
+				for table_name, (condition, parameters) in conditions.items():
+					columns = ", ".join(get_table_columns(table_name))
+					sql = f'''
+						INSERT OR REPLACE INTO {ARCHIVE_DATABASE}.{table_name} ({columns})
+						SELECT {columns} FROM main.{table_name} WHERE {condition}
+					'''
+					cursor.execute(sql, parameters)
+			flush()
+
+			moved_rows = {}
+			with transaction():
+				cursor = get_cursor()
+				for table_name, (condition, parameters) in conditions.items():
+					cursor.execute(f"DELETE FROM main.{table_name} WHERE {condition}", parameters)
+					moved_rows[table_name] = cursor.rowcount
+			flush()
+			return moved_rows
+	except sqlite3.Error as E:
+		logging.error(f"SQLite error in archive_tickets function, error: {E.args}")
+		return {}
+
+
+@db_read_only
+def get_database_size(database="main"):
+	"""
+	Returns size of the database pages that store data. Pages freed by deleted rows are reused for new rows,
+	but the file itself shrinks only after vacuum.
+	"""
+	cursor = get_cursor()
+	page_size = cursor.execute(f"PRAGMA {database}.page_size").fetchone()[0]
+	page_count = cursor.execute(f"PRAGMA {database}.page_count").fetchone()[0]
+	freelist_count = cursor.execute(f"PRAGMA {database}.freelist_count").fetchone()[0]
+	return (page_count - freelist_count) * page_size
+
+
+@db_read_only
+def get_freelist_count(database="main"):
+	cursor = get_cursor()
+	cursor.execute(f"PRAGMA {database}.freelist_count")
+	return cursor.fetchone()[0]
+
+
+@db_read_only
+def get_table_names():
+	sql = "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+	cursor = get_cursor()
+	cursor.execute(sql)
+	return [row[0] for row in cursor.fetchall()]
+
+
+@db_thread_lock
+def optimize_database():
+	cursor = get_cursor()
+	cursor.execute("PRAGMA optimize")
+	cursor.fetchall()
+
+
+@db_thread_lock
+def analyze_table(table_name):
+	cursor = get_cursor()
+	cursor.execute(f"PRAGMA analysis_limit={_ANALYSIS_LIMIT}")
+	cursor.execute(f'ANALYZE "{table_name}"')
+
+
+@db_thread_lock
+def incremental_vacuum(pages_count):
+	"""
+	Returns up to pages_count free pages to the filesystem, the file is truncated when the change is committed.
+	"""
+	cursor = get_cursor()
+	# sqlite3 module executes only the first step of the statement that returns no rows,
+	# and every step frees one page
+	for _ in range(pages_count):
+		cursor.execute("PRAGMA incremental_vacuum(1)")
+
+
+def backup_database(target_filename, database="main", pages_per_step=100, step_delay=0.05):
+	"""
+	Copies the database into target_filename with the backup API in steps of pages_per_step pages.
+	The writer connection is the source of the backup, so changes written between steps are copied as well instead of
+	restarting the backup, _DB_LOCK is released between steps.
+	"""
+	def release_lock_between_steps(status, remaining, total):
+		if remaining == 0:
+			return
+		_DB_LOCK.release()
+		time.sleep(step_delay)
+		_DB_LOCK.acquire()
+		flush()
+
+	target_connection = sqlite3.connect(target_filename)
+	try:
+		with _DB_LOCK:
+			flush()
+			source_connection = _CONNECTION_POOL.get_writer_connection()
+			source_connection.backup(target_connection, pages=pages_per_step, progress=release_lock_between_steps, name=database)
+	finally:
+		target_connection.close()
+
+
+def check_database_integrity(db_filename):
+	"""
+	Opens separate database file and returns result of the integrity check, ["ok"] if no problems were found.
+	"""
+	connection = sqlite3.connect(db_filename)
+	try:
+		return [row[0] for row in connection.execute("PRAGMA integrity_check")]
+	finally:
+		connection.close()
@@ -0,0 +1,321 @@
+"""
+Fake Telegram Bot API server for tests and benchmarks, keeps chats and messages in memory.
+
+Implements the methods the bot uses: getUpdates, sendMessage, copyMessage, forwardMessage, deleteMessage,
+editMessageText, editMessageCaption, editMessageReplyMarkup, getChat, getChatAdministrators and a few methods
+that are called on startup. Responses can be delayed and random requests can be answered with 429 error.
+TeleBot is connected to the server with the API URL override:
+	telebot.apihelper.API_URL = fake_server.api_url
+Usage as a standalone server, set BOT_API_URL in config.json to the printed url:
+	python3 fake_bot_api.py [--port 8081] [--latency 0.05] [--too-many-requests-rate 0.01] [--channel -100123]
+"""
+import argparse
+import collections
+import http.server
+import json
+import random
+import threading
+import time
+import urllib.parse
+
+# parameters that are sent as JSON strings
+_JSON_PARAMETERS = ("entities", "caption_entities", "reply_markup")
+# keys of the message that are copied by copyMessage and forwardMessage
+_CONTENT_KEYS = ("text", "entities", "caption", "caption_entities", "photo", "document", "video", "audio", "voice", "animation")
+
+NOT_MODIFIED_ERROR = "Bad Request: message is not modified: specified new message content and reply markup are exactly the same as a current content and reply markup of the message"
+
+
+class BotApiError(Exception):
+	def __init__(self, error_code: int, description: str, retry_after: int = None):
+		super().__init__(description)
+		self.error_code = error_code
+		self.description = description
+		self.retry_after = retry_after
+
+
+class FakeBotApiServer:
+	def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0, too_many_requests_rate: float = 0,
+				 retry_after: int = 1, seed: int = None):
+		self.latency = latency
+		self.too_many_requests_rate = too_many_requests_rate
+		self.retry_after = retry_after
+		self.random = random.Random(seed)
+		self.lock = threading.Condition()
+		self.chats = {}
+		self.messages = {}
+		self.last_message_ids = collections.defaultdict(int)
+		self.updates = []
+		self.last_update_id = 0
+		self.method_calls = collections.Counter()
+		self.too_many_requests_errors = collections.Counter()
+		self.forced_errors = collections.defaultdict(list)
+		self.bot_user = None
+
+		self.http_server = http.server.ThreadingHTTPServer((host, port), self.create_request_handler())
+		self.http_server.daemon_threads = True
+
+	@property
+	def api_url(self):
+		host, port = self.http_server.server_address[:2]
+		return f"http://{host}:{port}/bot{{0}}/{{1}}"
+
+	def start(self):
+		threading.Thread(target=self.http_server.serve_forever, daemon=True).start()
+		return self
+
+	def stop(self):
+		self.http_server.shutdown()
+		self.http_server.server_close()
+
+	def create_request_handler(self):
+		fake_server = self
+
+		class RequestHandler(http.server.BaseHTTPRequestHandler):
+			protocol_version = "HTTP/1.1"
+			# headers and body are written separately, without it every response waits for the delayed ACK
+			disable_nagle_algorithm = True
+
+			def do_GET(self):
+				self.handle_api_request()
+
+			def do_POST(self):
+				self.handle_api_request()
+
+			def handle_api_request(self):
+				url = urllib.parse.urlparse(self.path)
+				params = dict(urllib.parse.parse_qsl(url.query))
+				content_length = int(self.headers.get("Content-Length", 0))
+				body = self.rfile.read(content_length) if content_length else b""
+				if self.headers.get("Content-Type", "").startswith("application/x-www-form-urlencoded"):
+					params.update(urllib.parse.parse_qsl(body.decode()))
+
+				path_parts = url.path.strip("/").split("/")
+				token = path_parts[0][3:] if path_parts and path_parts[0].startswith("bot") else ""
+				method_name = path_parts[-1] if len(path_parts) > 1 else ""
+				status_code, response = fake_server.handle_request(token, method_name, params)
+
+				response_body = json.dumps(response).encode()
+				self.send_response(status_code)
+				self.send_header("Content-Type", "application/json")
+				self.send_header("Content-Length", str(len(response_body)))
+				self.end_headers()
+				self.wfile.write(response_body)
+
+			def log_message(self, format, *args):
+				pass
+
+		return RequestHandler
+
+	def handle_request(self, token: str, method_name: str, params: dict):
+		method = getattr(self, f"api_{method_name}", None)
+		if method is None:
+			return 404, {"ok": False, "error_code": 404, "description": "Not Found"}
+
+		if self.latency:
+			time.sleep(self.latency)
+
+		params = {key: json.loads(value) if key in _JSON_PARAMETERS else value for key, value in params.items()}
+		try:
+			with self.lock:
+				self.method_calls[method_name] += 1
+				if self.bot_user is None:
+					self.bot_user = {"id": int(token.split(":")[0] or 1), "is_bot": True, "first_name": "Fake bot", "username": "fake_bot"}
+				self.check_errors(method_name, params)
+			if method_name == "getUpdates":
+				return 200, {"ok": True, "result": self.api_getUpdates(params)}
+			with self.lock:
+				return 200, {"ok": True, "result": method(params)}
+		except BotApiError as E:
+			response = {"ok": False, "error_code": E.error_code, "description": E.description}
+			if E.retry_after is not None:
+				response["parameters"] = {"retry_after": E.retry_after}
+			return E.error_code, response
+
+	def check_errors(self, method_name: str, params: dict):
+		if self.forced_errors[method_name]:
+			raise self.forced_errors[method_name].pop(0)
+
+		if method_name != "getUpdates" and self.too_many_requests_rate and self.random.random() < self.too_many_requests_rate:
+			self.too_many_requests_errors[method_name] += 1
+			raise BotApiError(429, f"Too Many Requests: retry after {self.retry_after}", self.retry_after)
+
+	def add_error(self, method_name: str, error_code: int = 429, description: str = None, retry_after: int = None):
+		"""
+		Next request of the method is answered with the error.
+		"""
+		if error_code == 429:
+			retry_after = self.retry_after if retry_after is None else retry_after
+			description = description or f"Too Many Requests: retry after {retry_after}"
+		with self.lock:
+			self.forced_errors[method_name].append(BotApiError(error_code, description or "Bad Request", retry_after))
+
+	def add_chat(self, chat_id: int, chat_type: str = "channel", title: str = None, linked_chat_id: int = None, owner_id: int = 1):
+		with self.lock:
+			self.chats[chat_id] = {
+				"chat": {"id": chat_id, "type": chat_type, "title": title or str(chat_id)},
+				"linked_chat_id": linked_chat_id,
+				"owner_id": owner_id,
+			}
+
+	def add_update(self, update: dict):
+		with self.lock:
+			self.last_update_id += 1
+			update["update_id"] = self.last_update_id
+			self.updates.append(update)
+			self.lock.notify_all()
+		return update
+
+	def post_channel_message(self, chat_id: int, text: str, entities: list = None):
+		"""
+		Creates the post in the channel like a user did it and adds channel_post update about it.
+		"""
+		with self.lock:
+			message = self.create_message(chat_id, {"text": text, "entities": entities})
+		return self.add_update({"channel_post": message})
+
+	def get_message(self, chat_id: int, message_id: int):
+		with self.lock:
+			return self.messages.get((chat_id, message_id))
+
+	def get_chat(self, chat_id):
+		chat_id = int(chat_id)
+		if chat_id not in self.chats:
+			raise BotApiError(400, "Bad Request: chat not found")
+		return self.chats[chat_id]
+
+	def find_message(self, chat_id, message_id, error_description: str):
+		if message_id is None:
+			raise BotApiError(400, "Bad Request: message identifier is not specified")
+		message = self.messages.get((int(chat_id), int(message_id)))
+		if message is None:
+			raise BotApiError(400, error_description)
+		return message
+
+	def create_message(self, chat_id, content: dict, reply_to_message_id=None):
+		chat = self.get_chat(chat_id)["chat"]
+		self.last_message_ids[chat["id"]] += 1
+		message = {"message_id": self.last_message_ids[chat["id"]], "date": int(time.time()), "chat": chat}
+		if chat["type"] == "channel":
+			message["sender_chat"] = chat
+		else:
+			message["from"] = self.bot_user or {"id": 1, "is_bot": True, "first_name": "Fake bot"}
+		message.update({key: value for key, value in content.items() if value})
+		if reply_to_message_id:
+			message["reply_to_message"] = self.find_message(chat["id"], reply_to_message_id, "Bad Request: message to reply not found")
+		self.messages[(chat["id"], message["message_id"])] = message
+		return message
+
+	def edit_message(self, params: dict, content: dict):
+		message = self.find_message(params.get("chat_id"), params.get("message_id"), "Bad Request: message to edit not found")
+		content["reply_markup"] = params.get("reply_markup")
+		if all(message.get(key) == (value or None) for key, value in content.items()):
+			raise BotApiError(400, NOT_MODIFIED_ERROR)
+
+		for key, value in content.items():
+			if value:
+				message[key] = value
+			else:
+				message.pop(key, None)
+		message["edit_date"] = int(time.time())
+		return message
+
+	def api_getMe(self, params: dict):
+		return self.bot_user
+
+	def api_getUpdates(self, params: dict):
+		offset = int(params.get("offset", 0))
+		timeout = float(params.get("timeout", 0))
+		deadline = time.monotonic() + timeout
+		with self.lock:
+			self.updates = [update for update in self.updates if update["update_id"] >= offset]
+			while not self.updates and time.monotonic() < deadline:
+				self.lock.wait(deadline - time.monotonic())
+			return self.updates[:int(params.get("limit", 100))]
+
+	def api_deleteWebhook(self, params: dict):
+		return True
+
+	def api_setMyCommands(self, params: dict):
+		return True
+
+	def api_answerCallbackQuery(self, params: dict):
+		return True
+
+	def api_sendMessage(self, params: dict):
+		content = {"text": params.get("text"), "entities": params.get("entities"), "reply_markup": params.get("reply_markup")}
+		return self.create_message(params.get("chat_id"), content, params.get("reply_to_message_id"))
+
+	def api_copyMessage(self, params: dict):
+		source = self.find_message(params.get("from_chat_id"), params.get("message_id"), "Bad Request: message to copy not found")
+		content = {key: source[key] for key in _CONTENT_KEYS if key in source}
+		content["reply_markup"] = params.get("reply_markup")
+		message = self.create_message(params.get("chat_id"), content, params.get("reply_to_message_id"))
+		return {"message_id": message["message_id"]}
+
+	def api_forwardMessage(self, params: dict):
+		source = self.find_message(params.get("from_chat_id"), params.get("message_id"), "Bad Request: message to forward not found")
+		content = {key: source[key] for key in _CONTENT_KEYS if key in source}
+		content["forward_date"] = source["date"]
+		if source["chat"]["type"] == "channel":
+			content["forward_from_chat"] = source["chat"]
+			content["forward_from_message_id"] = source["message_id"]
+		elif "from" in source:
+			content["forward_from"] = source["from"]
+		return self.create_message(params.get("chat_id"), content)
+
+	def api_deleteMessage(self, params: dict):
+		key = (int(params.get("chat_id")), int(params.get("message_id")))
+		if key not in self.messages:
+			raise BotApiError(400, "Bad Request: message to delete not found")
+		del self.messages[key]
+		return True
+
+	def api_editMessageText(self, params: dict):
+		return self.edit_message(params, {"text": params.get("text"), "entities": params.get("entities")})
+
+	def api_editMessageCaption(self, params: dict):
+		return self.edit_message(params, {"caption": params.get("caption"), "caption_entities": params.get("caption_entities")})
+
+	def api_editMessageReplyMarkup(self, params: dict):
+		return self.edit_message(params, {})
+
+	def api_getChat(self, params: dict):
+		chat_data = self.get_chat(params.get("chat_id"))
+		chat = dict(chat_data["chat"])
+		if chat_data["linked_chat_id"]:
+			chat["linked_chat_id"] = chat_data["linked_chat_id"]
+		return chat
+
+	def api_getChatAdministrators(self, params: dict):
+		chat_data = self.get_chat(params.get("chat_id"))
+		owner = {"id": chat_data["owner_id"], "is_bot": False, "first_name": "Owner"}
+		administrators = [{"status": "creator", "user": owner, "is_anonymous": False}]
+		if self.bot_user:
+			administrators.append({
+				"status": "administrator", "user": self.bot_user, "can_be_edited": False, "is_anonymous": False,
+				"can_manage_chat": True, "can_delete_messages": True, "can_manage_video_chats": False,
+				"can_restrict_members": False, "can_promote_members": False, "can_change_info": False,
+				"can_invite_users": False, "can_post_messages": True, "can_edit_messages": True,
+			})
+		return administrators
+
+
+def main():
+	parser = argparse.ArgumentParser(description="fake Telegram Bot API server")
+	parser.add_argument("--host", default="127.0.0.1")
+	parser.add_argument("--port", type=int, default=8081)
+	parser.add_argument("--latency", type=float, default=0, help="delay of every response in seconds")
+	parser.add_argument("--too-many-requests-rate", type=float, default=0, help="share of requests answered with 429 error")
+	parser.add_argument("--channel", type=int, action="append", default=[], help="id of the channel that exists on start")
+	args = parser.parse_args()
+
+	fake_server = FakeBotApiServer(args.host, args.port, args.latency, args.too_many_requests_rate)
+	for channel_id in args.channel:
+		fake_server.add_chat(channel_id)
+	print(f"Fake Bot API url: {fake_server.api_url}")
+	fake_server.http_server.serve_forever()
+
+
+if __name__ == "__main__":
+	main()
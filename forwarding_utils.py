@@ -1,4 +1,3 @@
-import json
 import logging
 import threading
 import time
@@ -103,6 +102,7 @@ def forward_to_subchannel(bot: telebot.TeleBot, post_data: telebot.types.Message
 			if post_data.text is None:
 				text, entities = utils.get_post_content(post_data)
 				copied_message = bot.send_message(chat_id=subchannel_id, text=text, entities=entities)
+				utils.store_message_content(copied_message)
 			else:
 				copied_message = utils.copy_message(bot, chat_id=subchannel_id, message_id=main_message_id,
 			                                    from_chat_id=main_channel_id)
@@ -166,7 +166,8 @@ def delete_forwarded_message(bot: telebot.TeleBot, chat_id: int, message_id: int
 				if oldest_message_id is None:
 					break
 
-				oldest_message_data = utils.get_message_content_by_id(bot, chat_id, oldest_message_id)
+				# stored content is left after the copy is deleted by user, so the message is read from Telegram
+				oldest_message_data = utils.get_message_content_by_id(bot, chat_id, oldest_message_id, use_cache=False)
 				if oldest_message_data is None:
 					db_utils.delete_copied_message(oldest_message_id, chat_id)
 					logging.info(f"Message {[oldest_message_id, chat_id]} doesn't exists, deleted from db")
@@ -202,8 +203,9 @@ def delete_forwarded_message(bot: telebot.TeleBot, chat_id: int, message_id: int
 
 					utils.edit_message_content(bot, msg_to_delete_data, chat_id=chat_id, message_id=message_id,
 					                           reply_markup=keyboard, text=text, entities=entities)
-					db_utils.delete_copied_message(message_id, chat_id)
-					db_utils.update_copied_message_id(oldest_message_id, chat_id, message_id)
+					with db_utils.transaction():
+						db_utils.delete_copied_message(message_id, chat_id)
+						db_utils.update_copied_message_id(oldest_message_id, chat_id, message_id)
 				else:
 					# if oldest message is the message that needs to be deleted than just delete it from db
 					db_utils.delete_copied_message(message_id, chat_id)
@@ -243,6 +245,7 @@ def delete_main_message(bot: telebot.TeleBot, main_channel_id: int, main_message
 		if discussion_chat_id:
 			bot.send_message(chat_id=discussion_chat_id, text=f"A user manually deleted ticket {main_message_id}")
 		db_utils.delete_ticket_data(main_message_id, main_channel_id)
+		db_utils.delete_message_content(main_channel_id, main_message_id)
 		logging.info(f"Deleted ticket {main_message_id, main_channel_id} that doesn't exists in main channel anymore")
 
 
@@ -276,8 +279,12 @@ def filter_due_deferred_tickets(main_channel_id: int, main_message_id: int, hash
 def get_subchannel_ids_from_hashtags(main_channel_id: int, main_message_id: int, hashtag_data: HashtagData):
 	subchannel_ids = set()
 	priority = hashtag_data.get_priority_number_or_default()
+	settings_version = db_utils.get_settings_cache_version()
 	channel_data = db_utils.get_individual_channels_by_priority(main_channel_id, priority)
-	channel_data = [[channel_id, json.loads(settings)] for channel_id, settings in channel_data]
+	channel_data = [
+		[channel_id, db_utils.parse_channel_settings(channel_id, settings, settings_version)]
+		for channel_id, settings in channel_data
+	]
 
 	channel_data = filter_due_deferred_tickets(main_channel_id, main_message_id, hashtag_data, channel_data)
 
@@ -695,17 +702,20 @@ def forward_and_add_inline_keyboard(bot: telebot.TeleBot, post_data: telebot.typ
 
 	updated_post_data = hashtag_data.get_updated_post_data()
 
-	update_main_message_content(bot, hashtag_data, updated_post_data, post_data)
-	comment_dispatcher.add_next_action_comment(bot, updated_post_data)
-	add_control_buttons(bot, updated_post_data, hashtag_data)
-	forward_to_subchannel(bot, updated_post_data, hashtag_data)
+	# new content and control buttons of the main message are sent in one edit before it's copied to subchannels
+	with utils.coalesced_edits():
+		update_main_message_content(bot, hashtag_data, updated_post_data, post_data)
+		comment_dispatcher.add_next_action_comment(bot, updated_post_data)
+		add_control_buttons(bot, updated_post_data, hashtag_data)
+		forward_to_subchannel(bot, updated_post_data, hashtag_data)
 
 
 def update_message_and_forward_to_subchannels(bot: telebot.TeleBot, hashtag_data: HashtagData):
 	updated_message = hashtag_data.get_updated_post_data()
-	update_main_message_content(bot, hashtag_data, updated_message)
-	add_control_buttons(bot, updated_message, hashtag_data)
-	forward_to_subchannel(bot, updated_message, hashtag_data)
+	with utils.coalesced_edits():
+		update_main_message_content(bot, hashtag_data, updated_message)
+		add_control_buttons(bot, updated_message, hashtag_data)
+		forward_to_subchannel(bot, updated_message, hashtag_data)
 
 
 def update_main_message_content(bot: telebot.TeleBot, hashtag_data: HashtagData, post_data: telebot.types.Message,
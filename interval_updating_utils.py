@@ -5,28 +5,36 @@ import telebot
 from telebot.apihelper import ApiTelegramException
 
 import config_utils
+import core_api
 import utils
 import db_utils
 import forwarding_utils
 import post_link_utils
+import threading_utils
 import threading
 
 from config_utils import DISCUSSION_CHAT_DATA, DELAY_AFTER_ONE_SCAN
 
 _INTERVAL_UPDATING_THREAD: threading.Thread = None
 _UPDATE_STATUS: bool = False
+_SCAN_BATCH_SIZE = 500
 
 
-def update_older_message(bot: telebot.TeleBot, main_channel_id: int, main_message_id: int):
+def update_older_message(bot: telebot.TeleBot, main_channel_id: int, main_message_id: int,
+						 main_message: telebot.types.Message = None):
 	if not db_utils.is_main_message_exists(main_channel_id, main_message_id):
 		logging.info(f"Ticket update for {main_channel_id, main_message_id} was skipped because it's not in db")
 		return
 
-	try:
-		forwarded_message = utils.get_main_message_content_by_id(bot, main_channel_id, main_message_id)
-	except ApiTelegramException:
-		forwarding_utils.delete_main_message(bot, main_channel_id, main_message_id)
-		return
+	if main_message:
+		forwarded_message = main_message
+	else:
+		try:
+			# message is read from Telegram instead of the stored content, because it's the only way to find deleted tickets
+			forwarded_message = utils.get_main_message_content_by_id(bot, main_channel_id, main_message_id, use_cache=False)
+		except ApiTelegramException:
+			forwarding_utils.delete_main_message(bot, main_channel_id, main_message_id)
+			return
 
 	if forwarded_message is None:
 		return
@@ -40,17 +48,52 @@ def update_older_message(bot: telebot.TeleBot, main_channel_id: int, main_messag
 	forwarded_message.chat = forwarded_message.forward_from_chat
 	if not utils.check_content_type(bot, forwarded_message):
 		return
+	utils.invalidate_rendered_message(forwarded_message, check_keyboard=False)
 
-	updated_message = post_link_utils.update_post_link(bot, forwarded_message)
+	with utils.coalesced_edits():
+		updated_message = post_link_utils.update_post_link(bot, forwarded_message)
 
-	if not updated_message:
-		updated_message = forwarded_message
+		if not updated_message:
+			updated_message = forwarded_message
 
-	forwarding_utils.forward_and_add_inline_keyboard(bot, updated_message)
+		forwarding_utils.forward_and_add_inline_keyboard(bot, updated_message)
 
 	return main_channel_message_id
 
 
+def read_main_messages(main_channel_id: int, message_ids: list):
+	"""
+	Reads main messages through the core api, returns dict with message id as a key and message in the same form
+	as the message forwarded to the dump chat or None for deleted messages as a value.
+	Messages that couldn't be read are not in the result, they are read from the dump chat.
+	"""
+	try:
+		messages_json = core_api.get_messages_json(main_channel_id, message_ids)
+	except Exception as E:
+		logging.warning(f"Core api reading of messages in {main_channel_id} failed, dump chat is used instead - {E}")
+		return {}
+
+	main_messages = {}
+	for message_id, message_json in messages_json.items():
+		if message_json is None:
+			main_messages[message_id] = None
+			continue
+		utils.store_message_content(telebot.types.Message.de_json(message_json))
+		main_messages[message_id] = utils.get_forwarded_message_from_json(dict(message_json))
+	return main_messages
+
+
+def get_latest_main_message(main_channel_id: int, main_message_id: int, main_message: telebot.types.Message):
+	"""
+	Returns stored content of the main message instead of the message read in the batch if the message was edited
+	after the batch was read, because the batch is processed with delays and edits are stored by updates.
+	"""
+	stored_message = utils.get_stored_message_content(main_channel_id, main_message_id)
+	if stored_message and (stored_message.edit_date or 0) > (main_message.edit_date or 0):
+		return stored_message
+	return main_message
+
+
 def store_discussion_message(bot: telebot.TeleBot, main_channel_id: int, current_msg_id: int, discussion_chat_id: int):
 	# retrieve message from discussion chat, get message_id of the message in main channel and save it to db
 
@@ -82,6 +125,7 @@ def start_interval_updating(bot: telebot.TeleBot, start_delay: int = 0):
 
 
 def interval_update_thread(bot: telebot.TeleBot, start_delay: int = 0):
+	threading_utils.set_request_priority(threading_utils.REQUEST_PRIORITIES.BACKGROUND)
 	start_time = time.time()
 	last_update_time = 0
 	while _UPDATE_STATUS:
@@ -112,6 +156,7 @@ def interval_update_thread(bot: telebot.TeleBot, start_delay: int = 0):
 			check_discussion_messages(bot, main_channel_id, discussion_chat_id)
 
 		logging.info(f"Interval check is finished")
+		core_api.close_client()  # close client to prevent different event loop error in the next interval thread
 		db_utils.clear_updates_in_progress()
 		if _UPDATE_STATUS and config_utils.HASHTAGS_BEFORE_UPDATE:
 			config_utils.HASHTAGS_BEFORE_UPDATE = None
@@ -124,13 +169,37 @@ def check_main_messages(bot: telebot.TeleBot, main_channel_id: int, start_from_m
 	if start_msg_id is None:
 		return
 
+	existing_message_ids = {}
+	main_messages = {}
 	for current_msg_id in range(start_msg_id, 0, -1):
-		time.sleep(DELAY_AFTER_ONE_SCAN)
+		if current_msg_id not in existing_message_ids:
+			if not _UPDATE_STATUS:
+				logging.error(f"Main channel check stopped ({main_channel_id, current_msg_id}) - Interval update stop requested")
+				return
+			batch_message_ids = range(current_msg_id, max(current_msg_id - _SCAN_BATCH_SIZE, 0), -1)
+			existing_message_ids = db_utils.main_messages_exist_many(main_channel_id, batch_message_ids) or {}
+			# contents of the whole batch are read with a few core api requests instead of forwarding every message
+			message_ids_to_read = [message_id for message_id in batch_message_ids if existing_message_ids.get(message_id)]
+			main_messages = read_main_messages(main_channel_id, message_ids_to_read) if message_ids_to_read else {}
+			if main_messages:
+				time.sleep(DELAY_AFTER_ONE_SCAN)
+		if not existing_message_ids.get(current_msg_id):
+			# messages that are not in db are skipped by update_older_message, so no delay is needed
+			continue
+
+		if current_msg_id not in main_messages:
+			time.sleep(DELAY_AFTER_ONE_SCAN)
 		try:
 			if not _UPDATE_STATUS:
 				raise Exception("Interval update stop requested")
 
-			update_older_message(bot, main_channel_id, current_msg_id)
+			main_message = main_messages.get(current_msg_id)
+			if current_msg_id in main_messages and main_message is None:
+				forwarding_utils.delete_main_message(bot, main_channel_id, current_msg_id)
+			else:
+				if main_message:
+					main_message = get_latest_main_message(main_channel_id, current_msg_id, main_message)
+				update_older_message(bot, main_channel_id, current_msg_id, main_message)
 			db_utils.insert_or_update_channel_update_progress(main_channel_id, current_msg_id)
 		except ApiTelegramException as E:
 			if E.error_code == 429:
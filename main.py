@@ -12,20 +12,39 @@ import forwarding_utils
 import interval_updating_utils
 import post_link_utils
 import db_utils
+import retention_utils
+import threading_utils
+import transport_utils
+import maintenance_utils
+import backup_utils
 from scheduled_messages_utils import scheduled_message_dispatcher
 import user_utils
 import utils
+import webhook_utils
 
 import messages_export_utils
 from config_utils import BOT_TOKEN, DISCUSSION_CHAT_DATA, SUPPORTED_CONTENT_TYPES, INTERVAL_UPDATE_START_DELAY
 
+# database is opened on startup, so importing the modules doesn't touch the database files
+db_utils.open_database(config_utils.DB_FILENAME, config_utils.DB_BACKEND, config_utils.ARCHIVE_DB_FILENAME)
 db_utils.initialize_db()
 logging.basicConfig(format='%(asctime)s - {%(pathname)s:%(lineno)d} %(levelname)s: %(message)s', level=logging.INFO)
 
+# besides the update workers requests are sent by the polling, scheduler, reminder and interval threads
+transport_utils.install_session(config_utils.UPDATE_WORKER_THREADS + 4, config_utils.BOT_API_TIMEOUTS)
+telebot.apihelper.CUSTOM_REQUEST_SENDER = threading_utils.RATE_LIMITER.send_request
+if config_utils.BOT_API_URL:
+	telebot.apihelper.API_URL = config_utils.BOT_API_URL
 bot = telebot.TeleBot(BOT_TOKEN, num_threads=1)
+# updates of one ticket are handled in order, updates of different tickets are handled in parallel
+bot.worker_pool.close()
+bot.worker_pool = threading_utils.ShardedThreadPool(bot, utils.get_update_ticket_key, config_utils.UPDATE_WORKER_THREADS)
 
 config_utils.BOT_ID = bot.user.id
 config_utils.load_discussion_chat_ids(bot)
+for discussion_chat_id in DISCUSSION_CHAT_DATA.values():
+	if discussion_chat_id:
+		threading_utils.RATE_LIMITER.add_group_chat(discussion_chat_id)
 user_utils.load_users(bot)
 
 utils.check_last_messages(bot)
@@ -35,6 +54,10 @@ scheduled_message_dispatcher.start_scheduled_thread(bot)
 
 daily_reminder.start_reminder_thread(bot)
 
+retention_utils.start_retention_thread()
+maintenance_utils.start_maintenance_thread()
+backup_utils.start_backup_thread()
+
 messages_export_utils.start_exporting()
 
 interval_updating_utils.start_interval_updating(bot, INTERVAL_UPDATE_START_DELAY)
@@ -44,7 +67,9 @@ subchannel_filter = lambda message_data: db_utils.is_individual_channel_exists(m
 
 
 @bot.channel_post_handler(func=main_channel_filter, content_types=SUPPORTED_CONTENT_TYPES)
+@threading_utils.with_request_priority(threading_utils.REQUEST_PRIORITIES.INTERACTIVE)
 def handle_post(post_data: telebot.types.Message):
+	utils.store_message_content(post_data)
 	db_utils.insert_or_update_last_msg_id(post_data.message_id, post_data.chat.id)
 	if post_data.media_group_id:
 		return
@@ -59,7 +84,9 @@ def handle_post(post_data: telebot.types.Message):
 
 
 @bot.message_handler(func=lambda msg_data: msg_data.is_automatic_forward, content_types=SUPPORTED_CONTENT_TYPES)
+@threading_utils.with_request_priority(threading_utils.REQUEST_PRIORITIES.INTERACTIVE)
 def handle_automatically_forwarded_message(msg_data: telebot.types.Message):
+	utils.store_message_content(msg_data)
 	db_utils.insert_or_update_last_msg_id(msg_data.message_id, msg_data.chat.id)
 
 	if msg_data.media_group_id:
@@ -89,6 +116,7 @@ def handle_automatically_forwarded_message(msg_data: telebot.types.Message):
 @bot.message_handler(func=lambda msg_data: msg_data.chat.id in DISCUSSION_CHAT_DATA.values(),
 					 content_types=SUPPORTED_CONTENT_TYPES)
 def handle_discussion_message(msg_data: telebot.types.Message):
+	utils.store_message_content(msg_data)
 	discussion_message_id = msg_data.message_id
 	discussion_chat_id = msg_data.chat.id
 
@@ -100,6 +128,8 @@ def handle_discussion_message(msg_data: telebot.types.Message):
 
 @bot.edited_channel_post_handler(func=main_channel_filter, content_types=SUPPORTED_CONTENT_TYPES)
 def handle_edited_post(post_data: telebot.types.Message):
+	utils.store_message_content(post_data)
+	utils.invalidate_rendered_message(post_data)
 	if post_data.media_group_id:
 		return
 
@@ -111,8 +141,9 @@ def handle_edited_post(post_data: telebot.types.Message):
 	if (post_data.edit_date - post_data.date) > 5:
 		utils.add_comment_to_ticket(bot, post_data, "A user edited the ticket.")
 
-	post_link_utils.update_post_link(bot, post_data)
-	forwarding_utils.forward_and_add_inline_keyboard(bot, post_data)
+	with utils.coalesced_edits():
+		post_link_utils.update_post_link(bot, post_data)
+		forwarding_utils.forward_and_add_inline_keyboard(bot, post_data)
 
 
 @bot.my_chat_member_handler()
@@ -129,6 +160,7 @@ def handle_bot_changed_permissions(member_update: telebot.types.ChatMemberUpdate
 
 
 @bot.callback_query_handler(func=lambda call: main_channel_filter(call.message))
+@threading_utils.with_request_priority(threading_utils.REQUEST_PRIORITIES.INTERACTIVE)
 def handle_main_channel_keyboard_callback(call: telebot.types.CallbackQuery):
 	if not utils.check_content_type(bot, call.message):
 		return
@@ -142,6 +174,7 @@ def handle_main_channel_keyboard_callback(call: telebot.types.CallbackQuery):
 
 
 @bot.callback_query_handler(func=lambda call: subchannel_filter(call.message))
+@threading_utils.with_request_priority(threading_utils.REQUEST_PRIORITIES.INTERACTIVE)
 def handle_subchannel_keyboard_callback(call: telebot.types.CallbackQuery):
 	if call.data.startswith(channel_manager.CALLBACK_PREFIX):
 		channel_manager.handle_callback(bot, call)
@@ -177,6 +210,7 @@ def handle_subchannel_keyboard_callback(call: telebot.types.CallbackQuery):
 
 
 @bot.callback_query_handler(func=lambda call: True)
+@threading_utils.with_request_priority(threading_utils.REQUEST_PRIORITIES.INTERACTIVE)
 def handle_individual_channel_keyboard_callback(call: telebot.types.CallbackQuery):
 	if call.data.startswith(channel_manager.CALLBACK_PREFIX):
 		channel_manager.handle_callback(bot, call)
@@ -210,7 +244,7 @@ def handle_changed_permissions(member_update: telebot.types.ChatMemberUpdated):
 		db_utils.update_individual_channel_user(chat_id, owner_id)
 
 
-bot.infinity_polling(allowed_updates=[
+ALLOWED_UPDATES = [
 	"message",
 	"edited_message",
 	"channel_post",
@@ -220,4 +254,11 @@ bot.infinity_polling(allowed_updates=[
 	"callback_query",
 	"my_chat_member",
 	"chat_member"
-])
+]
+
+if config_utils.UPDATE_MODE == "webhook":
+	webhook_utils.run_webhook(bot, ALLOWED_UPDATES)
+else:
+	# updates can't be received with getUpdates while webhook is set
+	bot.remove_webhook()
+	bot.infinity_polling(allowed_updates=ALLOWED_UPDATES)
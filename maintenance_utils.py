@@ -0,0 +1,94 @@
+import datetime
+import logging
+import threading
+import time
+
+import pytz
+
+import config_utils
+import db_utils
+
+_MAINTENANCE_CHECK_INTERVAL = 60 * 60 * 24
+
+# every step holds the database lock only for a few milliseconds, other threads can write between steps
+_VACUUM_STEP_PAGES = 64
+_DELAY_BETWEEN_STEPS = 0.05
+
+
+def is_low_traffic_time():
+	timezone = pytz.timezone(config_utils.TIMEZONE_NAME)
+	return datetime.datetime.now(timezone).hour == config_utils.MAINTENANCE_HOUR
+
+
+def analyze_tables():
+	longest_step = 0
+	for table_name in db_utils.get_table_names() or []:
+		step_start = time.perf_counter()
+		db_utils.analyze_table(table_name)
+		longest_step = max(longest_step, time.perf_counter() - step_start)
+		time.sleep(_DELAY_BETWEEN_STEPS)
+	return longest_step
+
+
+def vacuum_free_pages():
+	longest_step = 0
+	reclaimed_pages = 0
+	free_pages = db_utils.get_freelist_count()
+	while free_pages:
+		step_start = time.perf_counter()
+		db_utils.incremental_vacuum(_VACUUM_STEP_PAGES)
+		db_utils.flush()
+		longest_step = max(longest_step, time.perf_counter() - step_start)
+
+		remaining_pages = db_utils.get_freelist_count()
+		if remaining_pages is None or remaining_pages >= free_pages:
+			break
+		reclaimed_pages += free_pages - remaining_pages
+		free_pages = remaining_pages
+		time.sleep(_DELAY_BETWEEN_STEPS)
+	return reclaimed_pages, longest_step
+
+
+def run_maintenance():
+	conversion_time = 0
+	if not db_utils.is_incremental_vacuum_enabled():
+		conversion_time = db_utils.convert_to_incremental_vacuum()
+		logging.info(f"Database was rebuilt by VACUUM to enable incremental vacuum in {conversion_time:.3f}s")
+
+	start_time = time.perf_counter()
+	db_utils.optimize_database()
+	optimize_time = time.perf_counter() - start_time
+	logging.info(f"PRAGMA optimize finished in {optimize_time:.3f}s")
+
+	analyze_start_time = time.perf_counter()
+	longest_analyze_step = analyze_tables()
+	analyze_time = time.perf_counter() - analyze_start_time
+	logging.info(f"ANALYZE finished in {analyze_time:.3f}s, longest step {longest_analyze_step * 1000:.1f}ms")
+
+	vacuum_start_time = time.perf_counter()
+	reclaimed_pages, longest_vacuum_step = vacuum_free_pages()
+	vacuum_time = time.perf_counter() - vacuum_start_time
+	logging.info(f"Incremental vacuum reclaimed {reclaimed_pages} pages in {vacuum_time:.3f}s, "
+				 f"longest step {longest_vacuum_step * 1000:.1f}ms")
+
+	return {
+		"conversion_time": conversion_time,
+		"optimize_time": optimize_time,
+		"analyze_time": analyze_time,
+		"vacuum_time": vacuum_time,
+		"reclaimed_pages": reclaimed_pages,
+		"longest_step": max(conversion_time, optimize_time, longest_analyze_step, longest_vacuum_step),
+	}
+
+
+def start_maintenance_thread():
+	threading.Thread(target=maintenance_thread).start()
+
+
+def maintenance_thread():
+	while 1:
+		if time.time() - config_utils.LAST_MAINTENANCE_TIME > _MAINTENANCE_CHECK_INTERVAL and is_low_traffic_time():
+			run_maintenance()
+			config_utils.LAST_MAINTENANCE_TIME = int(time.time())
+			config_utils.update_config({"LAST_MAINTENANCE_TIME": config_utils.LAST_MAINTENANCE_TIME})
+		time.sleep(1)
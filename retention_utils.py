@@ -0,0 +1,88 @@
+import logging
+import threading
+import time
+
+import config_utils
+import db_utils
+
+_RETENTION_CHECK_INTERVAL = 60 * 60 * 24
+_SECONDS_IN_DAY = 60 * 60 * 24
+
+# amount of tickets moved in one transaction, the database lock is released between batches
+_RETENTION_BATCH_SIZE = 100
+_DELAY_BETWEEN_BATCHES = 0.1
+
+
+class ClosedTicketsPolicy:
+	"""
+	Archives rows of the tickets that are closed and weren't updated for retention_days.
+	"""
+	def __init__(self, retention_days: int):
+		self.retention_days = retention_days
+
+	def __str__(self):
+		return f"closed tickets untouched for {self.retention_days} days"
+
+	def find_tickets(self, main_channel_id: int, discussion_chat_id: int, after_message_id: int, limit: int):
+		closed_before = int(time.time()) - self.retention_days * _SECONDS_IN_DAY
+		return db_utils.get_archivable_tickets(main_channel_id, discussion_chat_id, closed_before, after_message_id, limit)
+
+
+def get_retention_policies():
+	policies = []
+	if config_utils.CLOSED_TICKETS_RETENTION_DAYS > 0:
+		policies.append(ClosedTicketsPolicy(config_utils.CLOSED_TICKETS_RETENTION_DAYS))
+	return policies
+
+
+def apply_retention_policy(policy, main_channel_id: int, moved_rows: dict):
+	discussion_chat_id = config_utils.DISCUSSION_CHAT_DATA.get(str(main_channel_id))
+	last_message_id = 0
+	while True:
+		main_message_ids = policy.find_tickets(main_channel_id, discussion_chat_id, last_message_id, _RETENTION_BATCH_SIZE)
+		if not main_message_ids:
+			return
+
+		batch_moved_rows = db_utils.archive_tickets(main_channel_id, main_message_ids, discussion_chat_id)
+		for table_name, rows_count in batch_moved_rows.items():
+			moved_rows[table_name] = moved_rows.get(table_name, 0) + rows_count
+		last_message_id = main_message_ids[-1]
+		time.sleep(_DELAY_BETWEEN_BATCHES)
+
+
+def run_retention():
+	if not db_utils.is_archive_attached():
+		logging.info("Archive database isn't configured, retention skipped")
+		return
+
+	size_before = db_utils.get_database_size()
+	moved_rows = {}
+	for policy in get_retention_policies():
+		for main_channel_id in db_utils.get_main_channel_ids():
+			apply_retention_policy(policy, main_channel_id, moved_rows)
+			logging.info(f"Applied retention policy '{policy}' to {main_channel_id}")
+	size_after = db_utils.get_database_size()
+
+	report = {
+		"moved_rows": moved_rows,
+		"total_moved_rows": sum(moved_rows.values()),
+		"size_before": size_before,
+		"size_after": size_after,
+		"size_reduction": size_before - size_after,
+	}
+	logging.info(f"Retention finished, moved {report['total_moved_rows']} rows to archive {moved_rows}, "
+				 f"main database data size reduced by {report['size_reduction']} bytes")
+	return report
+
+
+def start_retention_thread():
+	threading.Thread(target=retention_thread).start()
+
+
+def retention_thread():
+	while 1:
+		if time.time() - config_utils.LAST_RETENTION_TIME > _RETENTION_CHECK_INTERVAL:
+			run_retention()
+			config_utils.LAST_RETENTION_TIME = int(time.time())
+			config_utils.update_config({"LAST_RETENTION_TIME": config_utils.LAST_RETENTION_TIME})
+		time.sleep(1)
@@ -0,0 +1,71 @@
+import os
+import tempfile
+from unittest import main
+from unittest.mock import patch
+
+import backup_utils
+import db_utils
+from test_helper import TemporaryDbTestCase
+
+
+@patch("backup_utils._DELAY_BETWEEN_STEPS", 0)
+@patch("config_utils.DB_FILENAME", "taskhelper_data.db")
+@patch("config_utils.ARCHIVE_DB_FILENAME", "taskhelper_archive.db")
+@patch("config_utils.BACKUP_COUNT", 2)
+class CreateBackupTest(TemporaryDbTestCase):
+	archive_filename = "archive.db"
+
+	def setUp(self):
+		super().setUp()
+		db_utils.initialize_db()
+		db_utils.insert_main_channel_message(-100123, 1, 10)
+
+		backup_directory = tempfile.TemporaryDirectory()
+		self.addCleanup(backup_directory.cleanup)
+		self.backup_directory = os.path.join(backup_directory.name, "backups")
+		directory_patcher = patch("config_utils.BACKUP_DIRECTORY", self.backup_directory)
+		directory_patcher.start()
+		self.addCleanup(directory_patcher.stop)
+
+	@patch("time.strftime", side_effect=["20240101_000000", "20240102_000000", "20240103_000000"])
+	def test_backups_are_rotated(self, *args):
+		for _ in range(3):
+			backup_utils.create_backup()
+
+		self.assertEqual(sorted(os.listdir(self.backup_directory)), [
+			"taskhelper_archive_20240102_000000.db", "taskhelper_archive_20240103_000000.db",
+			"taskhelper_data_20240102_000000.db", "taskhelper_data_20240103_000000.db",
+		])
+
+	@patch("time.strftime", return_value="20240101_000000")
+	def test_backup_contains_data(self, *args):
+		backup_files = backup_utils.create_backup()
+
+		self.assertEqual(backup_files, [
+			os.path.join(self.backup_directory, "taskhelper_data_20240101_000000.db"),
+			os.path.join(self.backup_directory, "taskhelper_archive_20240101_000000.db"),
+		])
+		connection = db_utils.sqlite3.connect(backup_files[0])
+		self.addCleanup(connection.close)
+		self.assertEqual(connection.execute("SELECT sender_id FROM main_messages").fetchall(), [(10,)])
+
+	@patch("db_utils.check_database_integrity", return_value=["*** in database main ***", "Page 5 is never used"])
+	def test_corrupted_backup_is_removed(self, *args):
+		with self.assertLogs(level="ERROR"):
+			self.assertEqual(backup_utils.create_backup(), [])
+		self.assertEqual(os.listdir(self.backup_directory), [])
+
+	@patch("db_utils.check_database_integrity", side_effect=db_utils.sqlite3.OperationalError("disk I/O error"))
+	def test_failed_backup_is_removed(self, *args):
+		with self.assertLogs(level="ERROR"):
+			self.assertEqual(backup_utils.create_backup(), [])
+		self.assertEqual(os.listdir(self.backup_directory), [])
+
+	def test_backup_in_progress(self):
+		with backup_utils._BACKUP_LOCK:
+			self.assertIsNone(backup_utils.create_backup())
+		self.assertFalse(os.path.exists(self.backup_directory))
+
+
+if __name__ == "__main__":
+	main()
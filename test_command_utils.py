@@ -0,0 +1,95 @@
+from unittest import TestCase, main
+from unittest.mock import Mock, patch
+
+from telebot import TeleBot
+
+import command_utils
+
+FUNCTION_STATS = {
+	"calls": 4, "total_time": 0.02, "max_time": 0.011, "lock_wait_time": 0.003,
+	"time_histogram": [2, 0, 1, 1, 0, 0, 0, 0], "lock_wait_histogram": [3, 1, 0, 0, 0, 0, 0, 0],
+}
+
+CONNECTION_STATS = {
+	"connects": 2, "requests": 40, "reused_requests": 38,
+	"connections": [{"requests": 30, "connects": 1, "age": 300}, {"requests": 10, "connects": 1, "age": 60}],
+}
+
+
+class HandleDbStatsTest(TestCase):
+	@patch("db_utils.get_query_stats", return_value=[("get_ticket_data", FUNCTION_STATS)])
+	def test_stats_message(self, mock_get_query_stats):
+		mock_bot = Mock(spec=TeleBot)
+		command_utils.handle_db_stats(mock_bot, Mock(), "3")
+
+		mock_get_query_stats.assert_called_once_with(3)
+		text = mock_bot.send_message.call_args[1]["text"]
+		self.assertIn("get_ticket_data: 4 calls, total 20.0ms, avg 5.00ms, max 11.0ms, lock wait 3.0ms", text)
+		self.assertIn("time: ≤1ms: 2, ≤10ms: 1, ≤50ms: 1", text)
+		self.assertIn("lock wait: ≤1ms: 3, ≤5ms: 1", text)
+
+	@patch("db_utils.get_query_stats", return_value=[])
+	def test_default_count(self, mock_get_query_stats):
+		mock_bot = Mock(spec=TeleBot)
+		command_utils.handle_db_stats(mock_bot, Mock(), "/db_stats")
+
+		mock_get_query_stats.assert_called_once_with(command_utils.DEFAULT_DB_STATS_COUNT)
+		self.assertEqual(mock_bot.send_message.call_args[1]["text"], "No database calls were recorded.")
+
+
+class HandleBackupTest(TestCase):
+	@patch("threading.Thread")
+	@patch("backup_utils.create_backup", return_value=["backups/taskhelper_data_20240101_000000.db"])
+	def test_backup_is_created_in_thread(self, mock_create_backup, mock_thread):
+		mock_bot = Mock(spec=TeleBot)
+		command_utils.handle_backup(mock_bot, Mock(), "")
+		mock_create_backup.assert_not_called()
+		self.assertEqual(mock_bot.send_message.call_args[1]["text"], "Backup started.")
+
+		mock_thread.call_args[1]["target"]()
+		mock_create_backup.assert_called_once_with()
+		text = mock_bot.send_message.call_args[1]["text"]
+		self.assertEqual(text, "Backup successfully created: backups/taskhelper_data_20240101_000000.db")
+
+
+class HandleApiStatsTest(TestCase):
+	def test_stats_message(self):
+		stats = {
+			"interactive": {"queue_depth": 0, "requests": 4, "total_wait_time": 0.01, "max_wait_time": 0.005},
+			"background": {"queue_depth": 12, "requests": 0, "total_wait_time": 0, "max_wait_time": 0},
+		}
+		mock_bot = Mock(spec=TeleBot)
+		with patch.object(command_utils.threading_utils.RATE_LIMITER.scheduler, "get_stats", return_value=stats), \
+				patch("utils.get_edit_counters", return_value={"sent": 7, "suppressed": 3}), \
+				patch("transport_utils.get_connection_stats", return_value=CONNECTION_STATS):
+			command_utils.handle_api_stats(mock_bot, Mock(), "")
+
+		text = mock_bot.send_message.call_args[1]["text"]
+		self.assertIn("interactive: 0 queued, 4 sent, avg wait 2.5ms, max wait 5.0ms", text)
+		self.assertIn("background: 12 queued, 0 sent, avg wait 0.0ms, max wait 0.0ms", text)
+		self.assertIn("edits: 7 sent, 3 suppressed without changes", text)
+		self.assertIn("connections: 2 connects, 40 requests, 38 sent through reused connections", text)
+		self.assertIn("connection: 30 requests, 1 connects, age 5min", text)
+
+
+class HandleUpdateStatsTest(TestCase):
+	def test_stats_message(self):
+		mock_bot = Mock(spec=TeleBot)
+		mock_bot.worker_pool = Mock(spec=command_utils.threading_utils.ShardedThreadPool)
+		mock_bot.worker_pool.get_stats.return_value = {
+			"queued_updates": 3, "max_queued_updates": 10, "active_shards": 2,
+			"shards": {
+				-100123: {"updates": 4, "total_wait_time": 0.02, "max_wait_time": 0.01, "total_handling_time": 2, "max_handling_time": 1},
+				-100456: {"updates": 1, "total_wait_time": 0.5, "max_wait_time": 0.5, "total_handling_time": 0.1, "max_handling_time": 0.1},
+			},
+		}
+		command_utils.handle_update_stats(mock_bot, Mock(), "")
+
+		text = mock_bot.send_message.call_args[1]["text"]
+		self.assertIn("Queued updates: 3, max: 10, tickets in progress: 2", text)
+		self.assertIn("-100123: 4 updates, avg wait 5.0ms, max wait 10.0ms, avg handling 500.0ms, max handling 1000.0ms", text)
+		self.assertLess(text.index("-100456"), text.index("-100123"))
+
+
+if __name__ == "__main__":
+	main()
@@ -76,6 +76,12 @@ class UpdateNextActionTest(TestCase):
 
 @patch("comment_utils.DISCUSSION_CHAT_DATA", {3333: 1111})
 class SaveCommentTest(TestCase):
+	def setUp(self):
+		test_helper.open_memory_database()
+
+	def tearDown(self):
+		test_helper.close_memory_database()
+
 	@patch("utils.get_main_message_content_by_id")
 	@patch("db_utils.insert_comment_message")
 	@patch("db_utils.get_comment_top_parent")
@@ -97,6 +103,12 @@ class SaveCommentTest(TestCase):
 
 
 class AddNextActionCommentTest(TestCase):
+	def setUp(self):
+		test_helper.open_memory_database()
+
+	def tearDown(self):
+		test_helper.close_memory_database()
+
 	@patch("db_utils.get_next_action_text", return_value="test action")
 	@patch("db_utils.insert_or_update_current_next_action")
 	@patch("utils.get_post_content", return_value=("test::test action", []))
@@ -147,6 +159,12 @@ class AddNextActionCommentTest(TestCase):
 @patch("db_utils.get_channel_user_tags", return_value=["aa", "bb", "cc"])
 @patch("comment_utils.HASHTAGS", {"OPENED": "o", "CLOSED": "x", "SCHEDULED": "s"})
 class ApplyHashtagsTest(TestCase):
+	def setUp(self):
+		test_helper.open_memory_database()
+
+	def tearDown(self):
+		test_helper.close_memory_database()
+
 	@patch("forwarding_utils.update_message_and_forward_to_subchannels")
 	@patch("hashtag_data.HashtagData.set_status_tag")
 	@patch("utils.get_post_content")
@@ -216,6 +234,22 @@ class ApplyHashtagsTest(TestCase):
 
 		mock_update_message_and_forward_to_subchannels.assert_not_called()
 
+	@patch("forwarding_utils.update_message_and_forward_to_subchannels")
+	@patch("utils.get_message_content_by_id", return_value=None)
+	@patch("utils.get_post_content")
+	def test_deleted_main_message(self, mock_get_post_content, mock_get_message_content_by_id,
+								  mock_update_message_and_forward_to_subchannels, *args):
+		text = "close the ticket #x"
+		entities = test_helper.create_hashtag_entity_list(text)
+		mock_get_post_content.return_value = (text, entities)
+
+		mock_bot = Mock(spec=TeleBot)
+		msg_data = test_helper.create_mock_message(text, [])
+		comment_dispatcher.apply_hashtags(mock_bot, msg_data, 123, 987654321)
+
+		mock_get_message_content_by_id.assert_called_once_with(mock_bot, 987654321, 123, use_cache=False)
+		mock_update_message_and_forward_to_subchannels.assert_not_called()
+
 	@patch("forwarding_utils.update_message_and_forward_to_subchannels")
 	@patch("hashtag_data.HashtagData.set_scheduled_tag")
 	@patch("utils.get_post_content")
@@ -3,12 +3,15 @@ from unittest.mock import Mock, patch
 
 from telebot import TeleBot
 
-from daily_reminder import send_daily_reminders
+import db_utils
+from daily_reminder import send_daily_reminders, update_ticket_data
+from test_helper import TemporaryDbTestCase
 
 
 @patch("config_utils.REMINDER_TIME_WITHOUT_INTERACTION", 24 * 60)
+@patch("db_utils.get_reminder_candidates", return_value={})
 class SendDailyRemindersTest(TestCase):
-	@patch("db_utils.find_copied_message_in_channel", side_effect=[None, 222])
+	@patch("db_utils.find_copied_message_in_channel", side_effect=[33, None, 11, 222])
 	@patch("db_utils.is_user_reminder_data_exists", return_value=True)
 	@patch("db_utils.get_last_interaction_time", return_value=None)
 	@patch("time.time", return_value=1700000000)
@@ -33,6 +36,28 @@ class SendDailyRemindersTest(TestCase):
 		self.assertEqual(mock_get_message_for_reminding.call_count, 2)
 		mock_insert_or_update_remind_time.assert_called_once_with(198, main_channel_id, user_tag, 1700000000)
 
+	@patch("db_utils.find_copied_message_in_channel", side_effect=[15, 222])
+	@patch("db_utils.is_user_reminder_data_exists", return_value=True)
+	@patch("db_utils.get_last_interaction_time", return_value=None)
+	@patch("time.time", return_value=1700000000)
+	@patch("forwarding_utils.delete_forwarded_message")
+	@patch("interval_updating_utils.update_older_message")
+	@patch("db_utils.insert_or_update_remind_time")
+	@patch("db_utils.get_all_users")
+	@patch("daily_reminder.get_message_for_reminding")
+	def test_copied_message_was_reassigned(self, mock_get_message_for_reminding, mock_get_all_users, mock_insert_or_update_remind_time,
+										   mock_update_older_message, mock_delete_forwarded_message, *args):
+		main_channel_id = -100123456789
+		copied_channel_id = -100111122222
+		mock_get_all_users.return_value = [(main_channel_id, 12345678, "aa")]
+		# copy 11 from the candidates was replaced by copy 15 while reminders of previous users were sent
+		mock_get_message_for_reminding.return_value = [198, copied_channel_id, 11]
+
+		mock_bot = Mock(spec=TeleBot)
+		send_daily_reminders(mock_bot)
+		mock_delete_forwarded_message.assert_called_once_with(mock_bot, copied_channel_id, 15)
+		mock_update_older_message.assert_called_once_with(mock_bot, main_channel_id, 198)
+
 	@patch("db_utils.is_user_reminder_data_exists", return_value=True)
 	@patch("db_utils.get_last_interaction_time", return_value=None)
 	@patch("time.time", return_value=1700000000)
@@ -54,5 +79,24 @@ class SendDailyRemindersTest(TestCase):
 		mock_insert_or_update_remind_time.assert_not_called()
 
 
+class UpdateTicketDataTest(TemporaryDbTestCase):
+	def setUp(self):
+		super().setUp()
+		db_utils.initialize_db()
+
+	def test_ticket_users_are_updated(self):
+		hashtag_data = Mock()
+		hashtag_data.get_all_users.return_value = ["user1", "user2"]
+		hashtag_data.get_priority_number_or_default.return_value = "1"
+		hashtag_data.is_opened.return_value = True
+		update_ticket_data(1, -100123, hashtag_data)
+		self.assertEqual(db_utils.get_ticket_users(1, -100123), ["user1", "user2"])
+
+		hashtag_data.get_all_users.return_value = None
+		update_ticket_data(1, -100123, hashtag_data)
+		self.assertEqual(db_utils.get_ticket_users(1, -100123), [])
+		self.assertEqual(db_utils.get_ticket_data(1, -100123), (None, "1", None))
+
+
 if __name__ == "__main__":
 	main()
@@ -0,0 +1,804 @@
+import os
+import sqlite3
+import threading
+import time
+from unittest import TestCase, main
+from unittest.mock import patch
+
+import db_utils
+from test_helper import TemporaryDbTestCase
+
+
+def run_in_thread(func, *args):
+	result = []
+	thread = threading.Thread(target=lambda: result.append(func(*args)))
+	thread.start()
+	thread.join(timeout=5)
+	return result
+
+
+class ApplyMigrationsTest(TemporaryDbTestCase):
+	def test_new_database(self):
+		db_utils.initialize_db()
+		self.assertEqual(db_utils.get_schema_version(), len(db_utils.MIGRATIONS))
+
+	def test_migrations_are_applied_once(self):
+		db_utils.initialize_db()
+		with patch("db_utils.MIGRATIONS", [lambda: self.fail("migration applied twice")] * len(db_utils.MIGRATIONS)):
+			db_utils.apply_migrations()
+
+	def test_failed_migration_is_rolled_back(self):
+		db_utils.create_tables()
+
+		def broken_migration():
+			db_utils.get_cursor().execute('CREATE INDEX "idx_test" ON "copied_messages" ("main_message_id")')
+			db_utils.get_cursor().execute("SELECT * FROM missing_table")
+
+		with patch("db_utils.MIGRATIONS", [broken_migration]):
+			with self.assertRaises(sqlite3.Error):
+				db_utils.apply_migrations()
+
+		self.assertEqual(db_utils.get_schema_version(), 0)
+		cursor = db_utils.get_cursor()
+		cursor.execute("SELECT name FROM sqlite_master WHERE type='index' AND name='idx_test'")
+		self.assertIsNone(cursor.fetchone())
+
+	def test_lookups_use_indexes(self):
+		db_utils.initialize_db()
+		queries = [
+			"SELECT copied_message_id, copied_channel_id FROM copied_messages WHERE main_message_id=1 and main_channel_id=1",
+			"SELECT main_message_id, main_channel_id FROM copied_messages WHERE copied_message_id=1 and copied_channel_id=1",
+			"SELECT discussion_message_id FROM discussion_messages WHERE main_message_id=1 and main_channel_id=1",
+			"SELECT id FROM comment_messages WHERE message_id=1 and discussion_chat_id=1",
+		]
+		for sql in queries:
+			cursor = db_utils.get_cursor()
+			cursor.execute("EXPLAIN QUERY PLAN " + sql)
+			plan = " ".join(row[-1] for row in cursor.fetchall())
+			self.assertRegex(plan, "USING (COVERING )?INDEX", sql)
+
+
+class ConnectionPoolTest(TemporaryDbTestCase):
+	def setUp(self):
+		super().setUp()
+		db_utils.initialize_db()
+
+	def test_wal_mode(self):
+		cursor = db_utils.get_cursor()
+		cursor.execute("PRAGMA journal_mode")
+		self.assertEqual(cursor.fetchone()[0], "wal")
+
+	def test_connection_per_thread(self):
+		thread_connection = run_in_thread(db_utils.get_connection)
+		self.assertEqual(len(thread_connection), 1)
+		self.assertIsNot(thread_connection[0], db_utils.get_connection())
+		self.assertIs(db_utils.get_connection(), db_utils.get_connection())
+
+	def test_write_is_visible_in_other_threads(self):
+		db_utils.insert_main_channel(-100123)
+		self.assertEqual(run_in_thread(db_utils.is_main_channel_exists, -100123), [True])
+
+	def test_reader_is_not_blocked_by_writer(self):
+		db_utils.insert_main_channel(-100123)
+		db_utils.flush()
+		with db_utils._DB_LOCK:
+			self.assertEqual(run_in_thread(db_utils.get_main_channel_ids), [[-100123]])
+
+	def test_failed_write_is_rolled_back(self):
+		@db_utils.db_thread_lock
+		def broken_write():
+			db_utils.insert_main_channel(-100123)
+			db_utils.get_cursor().execute("INSERT INTO missing_table VALUES (1)")
+
+		broken_write()
+		self.assertFalse(db_utils.is_main_channel_exists(-100123))
+
+
+class GroupCommitTest(TemporaryDbTestCase):
+	def setUp(self):
+		super().setUp()
+		db_utils.initialize_db()
+
+	def is_committed(self, channel_id: int):
+		connection = sqlite3.connect(self.db_filename)
+		self.addCleanup(connection.close)
+		cursor = connection.execute("SELECT 1 FROM main_channels WHERE channel_id=?", (channel_id,))
+		return cursor.fetchone() is not None
+
+	@patch("db_utils.GROUP_COMMIT_INTERVAL", 60)
+	def test_writes_are_committed_on_flush(self):
+		db_utils.insert_main_channel(-100123)
+		db_utils.insert_main_channel(-100124)
+		self.assertFalse(self.is_committed(-100123))
+
+		db_utils.flush()
+		self.assertTrue(self.is_committed(-100123))
+		self.assertTrue(self.is_committed(-100124))
+		self.assertEqual(db_utils._GROUP_COMMIT.commits_count, 1)
+		self.assertEqual(db_utils._GROUP_COMMIT.committed_statements, 2)
+
+	@patch("db_utils.GROUP_COMMIT_INTERVAL", 60)
+	def test_pending_writes_are_visible_in_other_threads(self):
+		db_utils.insert_main_channel(-100123)
+		self.assertEqual(run_in_thread(db_utils.is_main_channel_exists, -100123), [True])
+
+	@patch("db_utils.GROUP_COMMIT_INTERVAL", 60)
+	@patch("db_utils.GROUP_COMMIT_MAX_STATEMENTS", 3)
+	def test_commit_after_max_statements(self):
+		for channel_id in range(-100103, -100100):
+			db_utils.insert_main_channel(channel_id)
+		self.assertTrue(self.is_committed(-100101))
+		self.assertFalse(db_utils._GROUP_COMMIT.has_pending_changes())
+
+	def test_commit_after_interval(self):
+		db_utils.insert_main_channel(-100123)
+		for _ in range(100):
+			if not db_utils._GROUP_COMMIT.has_pending_changes():
+				break
+			threading.Event().wait(db_utils.GROUP_COMMIT_INTERVAL)
+		self.assertTrue(self.is_committed(-100123))
+
+	@patch("db_utils.GROUP_COMMIT_INTERVAL", 60)
+	def test_failed_transaction_keeps_other_pending_writes(self):
+		db_utils.insert_main_channel(-100123)
+		with self.assertRaises(ValueError):
+			with db_utils.transaction():
+				db_utils.insert_main_channel(-100124)
+				raise ValueError
+
+		db_utils.flush()
+		self.assertTrue(self.is_committed(-100123))
+		self.assertFalse(self.is_committed(-100124))
+
+
+class UniqueConstraintsTest(TemporaryDbTestCase):
+	def test_duplicates_are_removed_by_migration(self):
+		db_utils.create_tables()
+		cursor = db_utils.get_cursor()
+		cursor.executemany("INSERT INTO tickets_data (main_channel_id, main_message_id, priority) VALUES (?, ?, ?)",
+		                   [(-100123, 1, "1"), (-100123, 1, "2"), (-100123, 2, "3")])
+		cursor.executemany("INSERT INTO main_channels (channel_id) VALUES (?)", [(-100123,), (-100123,)])
+		db_utils.get_connection().commit()
+
+		db_utils.apply_migrations()
+		cursor.execute("SELECT main_message_id, priority FROM tickets_data ORDER BY main_message_id")
+		self.assertEqual(cursor.fetchall(), [(1, "2"), (2, "3")])
+		self.assertEqual(db_utils.get_main_channel_ids(), [-100123])
+
+		with self.assertRaises(sqlite3.IntegrityError):
+			cursor.execute("INSERT INTO tickets_data (main_channel_id, main_message_id) VALUES (-100123, 1)")
+		db_utils.get_connection().rollback()
+
+	def test_insert_or_update(self):
+		db_utils.initialize_db()
+		db_utils.insert_or_update_ticket_data(1, -100123, True, "user1", "1")
+		db_utils.set_ticket_update_time(1, -100123, 1700000000)
+		db_utils.insert_or_update_ticket_data(1, -100123, False, "user2", "2")
+		self.assertEqual(db_utils.get_ticket_data(1, -100123), ("user2", "2", 1700000000))
+
+		db_utils.insert_or_update_remind_time(1, -100123, "user1", 0)
+		db_utils.insert_or_update_remind_time(1, -100123, "user1", 1700000000)
+		self.assertEqual(db_utils.get_ticket_remind_time(1, -100123, "user1"), 1700000000)
+
+		db_utils.insert_or_update_current_next_action(1, -100123, "first")
+		db_utils.update_previous_next_action(1, -100123, "previous")
+		db_utils.insert_or_update_current_next_action(1, -100123, "second")
+		self.assertEqual(db_utils.get_next_action_text(1, -100123), "second")
+
+		db_utils.insert_or_update_last_msg_id(20, -100123)
+		db_utils.insert_or_update_last_msg_id(10, -100123)
+		self.assertEqual(db_utils.get_last_message_id(-100123), 20)
+
+		db_utils.flush()
+		cursor = db_utils.get_cursor()
+		cursor.execute("SELECT count(*) FROM reminded_tickets")
+		self.assertEqual(cursor.fetchone()[0], 1)
+		cursor.execute("SELECT previous_comment_text FROM next_action_comments")
+		self.assertEqual(cursor.fetchall(), [("previous",)])
+
+	def test_insert_if_not_exists(self):
+		db_utils.initialize_db()
+		db_utils.insert_main_channel_message(-100123, 1, 10)
+		db_utils.insert_main_channel_message(-100123, 1, 20)
+		db_utils.insert_comment_message(1, 2, -100124, 10)
+		db_utils.insert_comment_message(3, 2, -100124, 20)
+		self.assertEqual(db_utils.get_main_message_sender(-100123, 1), 10)
+		self.assertEqual(db_utils.get_comments_count(1, -100124), 1)
+
+
+class JoinTablesTest(TemporaryDbTestCase):
+	def test_migration_backfills_join_tables(self):
+		db_utils.create_tables()
+		cursor = db_utils.get_cursor()
+		cursor.execute("INSERT INTO tickets_data (main_channel_id, main_message_id, user_tags, priority) VALUES (-100123, 1, 'aa,a', '1')")
+		cursor.execute("INSERT INTO individual_channel_settings (main_channel_id, channel_id, priorities) VALUES (-100123, -100200, '1,3')")
+		db_utils.get_connection().commit()
+
+		db_utils.apply_migrations()
+		self.assertEqual(db_utils.get_ticket_users(1, -100123), ["aa", "a"])
+		self.assertEqual(db_utils.get_channel_priorities(-100200), ["1", "3"])
+
+	def test_user_tag_is_not_matched_by_substring(self):
+		db_utils.initialize_db()
+		db_utils.insert_or_update_ticket_data(1, -100123, True, "aa", "1")
+		db_utils.update_ticket_users(1, -100123, ["aa"])
+		db_utils.insert_or_update_ticket_data(2, -100123, True, "a,b", "2")
+		db_utils.update_ticket_users(2, -100123, ["a", "b"])
+
+		self.assertEqual(db_utils.get_user_highest_priority(-100123, "a"), "2")
+		self.assertEqual(db_utils.get_user_highest_priority(-100123, "aa"), "1")
+		self.assertIsNone(db_utils.get_user_highest_priority(-100123, "c"))
+
+		db_utils.delete_ticket_data(2, -100123)
+		self.assertEqual(db_utils.get_ticket_users(2, -100123), [])
+
+	def test_channels_by_priority(self):
+		db_utils.initialize_db()
+		db_utils.insert_individual_channel(-100123, -100200, "{}", 10)
+		db_utils.insert_individual_channel(-100123, -100201, "{}", 10)
+		db_utils.update_channel_priorities(-100200, ["1", "2"])
+		db_utils.update_channel_priorities(-100201, ["12"])
+		db_utils.insert_copied_message(1, -100123, 5, -100200)
+
+		self.assertEqual(db_utils.get_individual_channels_by_priority(-100123, "1"), [(-100200, "{}")])
+		self.assertEqual(db_utils.get_individual_channels_by_priority(-100123, "12"), [(-100201, "{}")])
+		self.assertEqual(db_utils.find_copied_message_from_main(1, -100123, 10, "2"), (5, -100200))
+		self.assertIsNone(db_utils.find_copied_message_from_main(1, -100123, 10, "3"))
+
+		db_utils.delete_individual_channel(-100200)
+		self.assertEqual(db_utils.get_channel_priorities(-100200), [])
+
+	def test_joins_use_indexes(self):
+		db_utils.initialize_db()
+		queries = [
+			"SELECT user_tag FROM ticket_users WHERE user_tag='a' AND main_channel_id=1",
+			"SELECT channel_id FROM channel_priorities WHERE priority='1'",
+		]
+		for sql in queries:
+			cursor = db_utils.get_cursor()
+			cursor.execute("EXPLAIN QUERY PLAN " + sql)
+			plan = " ".join(row[-1] for row in cursor.fetchall())
+			self.assertRegex(plan, "USING (COVERING )?INDEX", sql)
+
+
+class OpenTicketAssignmentsTest(TemporaryDbTestCase):
+	def setUp(self):
+		super().setUp()
+		db_utils.initialize_db()
+		db_utils.insert_or_update_user(-100123, "aa", 10)
+		db_utils.insert_or_update_user(-100123, "bb", 20)
+		db_utils.insert_individual_channel(-100123, -100200, "{}", 10)
+		db_utils.insert_individual_channel(-100123, -100300, "{}", 20)
+		for main_message_id in range(1, 5):
+			db_utils.insert_or_update_ticket_data(main_message_id, -100123, True, "aa,bb", "1")
+			db_utils.insert_copied_message(main_message_id, -100123, main_message_id + 10, -100200)
+			db_utils.insert_copied_message(main_message_id, -100123, main_message_id + 20, -100300)
+
+	def get_open_tickets(self):
+		db_utils.flush()
+		cursor = db_utils.get_cursor()
+		cursor.execute("SELECT main_message_id, user_tags, priority, update_time FROM open_ticket_assignments ORDER BY main_message_id")
+		return cursor.fetchall()
+
+	def test_assignments_are_updated_with_ticket_data(self):
+		db_utils.insert_or_update_ticket_data(2, -100123, False, "aa", "1")
+		db_utils.insert_or_update_ticket_data(3, -100123, True, "bb", "2")
+		db_utils.set_ticket_update_time(3, -100123, 1000)
+		db_utils.delete_ticket_data(4, -100123)
+		self.assertEqual(self.get_open_tickets(), [(1, "aa,bb", "1", None), (3, "bb", "2", 1000)])
+
+		db_utils.insert_or_update_ticket_data(2, -100123, True, "aa", "1")
+		self.assertEqual(self.get_open_tickets()[1], (2, "aa", "1", None))
+
+	def test_migration_backfills_assignments(self):
+		cursor = db_utils.get_cursor()
+		cursor.execute("DELETE FROM open_ticket_assignments")
+		cursor.execute("UPDATE tickets_data SET is_opened=0 WHERE main_message_id=1")
+		db_utils.get_connection().commit()
+
+		db_utils.migration_add_open_ticket_assignments()
+		self.assertEqual([ticket[0] for ticket in self.get_open_tickets()], [2, 3, 4])
+
+	def test_candidates_match_tickets_for_reminding(self):
+		db_utils.insert_or_update_ticket_data(2, -100123, False, "aa", "1")
+		db_utils.insert_scheduled_message(3, -100123, 50, -100400, 2000000000)
+		db_utils.insert_or_update_remind_time(4, -100123, "bb", 1000)
+
+		candidates = db_utils.get_reminder_candidates(-100123)
+		self.assertEqual(sorted(candidates), ["aa", "bb"])
+		for user_id, user_tag in [(10, "aa"), (20, "bb")]:
+			tickets = db_utils.get_tickets_for_reminding(-100123, user_id, user_tag)
+			self.assertEqual(sorted(candidates[user_tag]), sorted(tickets))
+		self.assertEqual(sorted(candidates["bb"]), [
+			(-100300, 21, -100123, 1, "aa,bb", "1", None, None),
+			(-100300, 24, -100123, 4, "aa,bb", "1", None, 1000),
+		])
+		self.assertEqual(db_utils.get_reminder_candidates(-100999), {})
+
+	def test_candidates_query_uses_indexes(self):
+		cursor = db_utils.get_cursor()
+		cursor.execute("EXPLAIN QUERY PLAN SELECT 1 FROM open_ticket_assignments WHERE main_channel_id=1 AND main_message_id=1")
+		plan = " ".join(row[-1] for row in cursor.fetchall())
+		self.assertRegex(plan, "USING (COVERING )?INDEX")
+
+
+class CommentThreadsTest(TemporaryDbTestCase):
+	def test_thread_stats(self):
+		db_utils.initialize_db()
+		db_utils.insert_comment_message(100, 101, -100124, 10)
+		db_utils.insert_comment_message(101, 102, -100124, 20)
+		db_utils.insert_comment_message(101, 103, -100124, 10)
+		db_utils.insert_comment_message(100, 103, -100124, 10)
+
+		self.assertEqual(db_utils.get_comment_top_parent(103, -100124), 100)
+		self.assertEqual(db_utils.get_comment_top_parent(100, -100124), 100)
+		self.assertEqual(db_utils.get_comments_count(100, -100124), 3)
+		self.assertEqual(db_utils.get_comments_count(100, -100124, ignored_sender_id=10), 1)
+		self.assertEqual(db_utils.get_last_comment(100, -100124), 103)
+		self.assertEqual(db_utils.get_last_comment(100, -100124, ignored_sender_id=10), 102)
+		self.assertEqual(db_utils.get_last_comment(200, -100124), 200)
+
+	def test_reply_saved_before_parent(self):
+		db_utils.initialize_db()
+		db_utils.insert_comment_message(102, 103, -100124, 10)
+		db_utils.insert_comment_message(101, 102, -100124, 20)
+		db_utils.insert_comment_message(100, 101, -100124, 10)
+
+		self.assertEqual(db_utils.get_comment_top_parent(103, -100124), 100)
+		self.assertEqual(db_utils.get_comments_count(100, -100124), 3)
+		self.assertEqual(db_utils.get_comments_count(102, -100124), 0)
+		self.assertEqual(db_utils.get_last_comment(100, -100124, ignored_sender_id=10), 102)
+
+	def test_migration_backfills_thread_roots(self):
+		db_utils.create_tables()
+		migration_index = db_utils.MIGRATIONS.index(db_utils.migration_add_comment_thread_roots)
+		with patch("db_utils.MIGRATIONS", db_utils.MIGRATIONS[:migration_index]):
+			db_utils.apply_migrations()
+		cursor = db_utils.get_cursor()
+		cursor.executemany(
+			"INSERT INTO comment_messages (discussion_chat_id, message_id, reply_to_message_id, sender_id) VALUES (?, ?, ?, ?)",
+			[(-100124, 103, 102, 10), (-100124, 101, 100, 10), (-100124, 102, 101, 20), (-100124, 201, 200, 10)]
+		)
+		db_utils.get_connection().commit()
+
+		db_utils.apply_migrations()
+		self.assertEqual(db_utils.get_comment_top_parent(103, -100124), 100)
+		self.assertEqual(db_utils.get_comments_count(100, -100124), 3)
+		self.assertEqual(db_utils.get_comments_count(200, -100124), 1)
+
+
+class ChannelRegistryTest(TemporaryDbTestCase):
+	def setUp(self):
+		super().setUp()
+		db_utils.initialize_db()
+
+	def test_registry_is_loaded_on_startup(self):
+		cursor = db_utils.get_cursor()
+		cursor.execute("INSERT INTO main_channels (channel_id) VALUES (-100123)")
+		cursor.execute("INSERT INTO individual_channel_settings (main_channel_id, channel_id) VALUES (-100123, -100200)")
+		db_utils.get_connection().commit()
+		self.assertFalse(db_utils.is_main_channel_exists(-100123))
+
+		db_utils.initialize_db()
+		self.assertTrue(db_utils.is_main_channel_exists(-100123))
+		self.assertTrue(db_utils.is_individual_channel_exists(-100200))
+
+	def test_registry_is_updated_by_writers(self):
+		db_utils.insert_main_channel(-100123)
+		db_utils.insert_individual_channel(-100123, -100200, "{}", 10)
+		with patch("db_utils.get_cursor", side_effect=AssertionError("database is queried")):
+			self.assertTrue(db_utils.is_main_channel_exists(-100123))
+			self.assertTrue(db_utils.is_individual_channel_exists(-100200))
+
+		db_utils.delete_main_channel(-100123)
+		db_utils.delete_individual_channel(-100200)
+		self.assertFalse(db_utils.is_main_channel_exists(-100123))
+		self.assertFalse(db_utils.is_individual_channel_exists(-100200))
+
+	def test_checks_dont_wait_for_writer(self):
+		db_utils.insert_main_channel(-100123)
+		db_utils.insert_individual_channel(-100123, -100200, "{}", 10)
+		self.assertTrue(db_utils._GROUP_COMMIT.has_pending_changes())
+		with db_utils._DB_LOCK:
+			self.assertEqual(run_in_thread(db_utils.is_main_channel_exists, -100123), [True])
+			self.assertEqual(run_in_thread(db_utils.is_individual_channel_exists, -100200), [True])
+
+	def test_registry_is_not_updated_by_failed_transaction(self):
+		with self.assertRaises(ValueError):
+			with db_utils.transaction():
+				db_utils.insert_main_channel(-100123)
+				raise ValueError
+		self.assertFalse(db_utils.is_main_channel_exists(-100123))
+
+		@db_utils.db_thread_lock
+		def broken_write():
+			db_utils.insert_individual_channel(-100123, -100200, "{}", 10)
+			db_utils.get_cursor().execute("INSERT INTO missing_table VALUES (1)")
+
+		broken_write()
+		self.assertFalse(db_utils.is_individual_channel_exists(-100200))
+
+
+class ChannelSettingsCacheTest(TemporaryDbTestCase):
+	def setUp(self):
+		super().setUp()
+		db_utils.initialize_db()
+		db_utils.insert_individual_channel(-100123, -100200, '{"assigned": ["user1"]}', 10)
+
+	def get_settings(self, channel_id: int):
+		settings_version = db_utils.get_settings_cache_version()
+		settings_str, _ = db_utils.get_individual_channel_settings(channel_id)
+		return db_utils.parse_channel_settings(channel_id, settings_str, settings_version)
+
+	def test_settings_are_parsed_once(self):
+		settings = self.get_settings(-100200)
+		settings["assigned"].append("user2")
+		self.assertEqual(self.get_settings(-100200), {"assigned": ["user1"]})
+
+		stats = db_utils.get_settings_cache_stats()
+		self.assertEqual((stats["hits"], stats["parses"]), (1, 1))
+		self.assertEqual(stats["hit_rate"], 0.5)
+
+	def test_cached_settings_dont_query_database(self):
+		db_utils.update_individual_channel(-100200, '{"assigned": ["user1"]}', "1,2")
+		self.assertEqual(db_utils.get_cached_channel_settings(-100200), ({"assigned": ["user1"]}, "1,2"))
+		with patch("db_utils.get_cursor", side_effect=AssertionError("database is queried")):
+			self.assertEqual(db_utils.get_cached_channel_settings(-100200), ({"assigned": ["user1"]}, "1,2"))
+
+		db_utils.update_individual_channel(-100200, '{"assigned": ["user2"]}', "3")
+		self.assertEqual(db_utils.get_cached_channel_settings(-100200), ({"assigned": ["user2"]}, "3"))
+
+	def test_entries_without_priorities_are_completed(self):
+		self.get_settings(-100200)
+		self.assertEqual(db_utils.get_cached_channel_settings(-100200), ({"assigned": ["user1"]}, ""))
+		self.assertEqual(db_utils.get_settings_cache_stats()["parses"], 2)
+
+	def test_writers_invalidate_settings(self):
+		self.get_settings(-100200)
+		db_utils.update_individual_channel_settings(-100200, '{"assigned": ["user2"]}')
+		self.assertEqual(self.get_settings(-100200), {"assigned": ["user2"]})
+		db_utils.update_individual_channel(-100200, '{"assigned": ["user3"]}', "1")
+		self.assertEqual(self.get_settings(-100200), {"assigned": ["user3"]})
+		self.assertEqual(db_utils.get_settings_cache_stats()["parses"], 3)
+
+	def test_settings_read_before_invalidation_are_not_stored(self):
+		settings_version = db_utils.get_settings_cache_version()
+		settings_str, _ = db_utils.get_individual_channel_settings(-100200)
+		db_utils.update_individual_channel_user(-100200, 20)
+		db_utils.parse_channel_settings(-100200, settings_str, settings_version)
+		self.assertEqual(db_utils.get_settings_cache_stats()["entries"], 0)
+
+
+class BulkQueriesTest(TemporaryDbTestCase):
+	def setUp(self):
+		super().setUp()
+		db_utils.initialize_db()
+
+	@patch("db_utils._MAX_QUERY_VARIABLES", 3)
+	def test_bulk_queries_are_chunked(self):
+		main_message_ids = list(range(1, 8))
+		for main_message_id in [1, 3, 4, 7]:
+			db_utils.insert_main_channel_message(-100123, main_message_id, main_message_id * 10)
+		db_utils.insert_main_channel_message(-100124, 2, 20)
+
+		existing_messages = db_utils.main_messages_exist_many(-100123, main_message_ids)
+		self.assertEqual([i for i in main_message_ids if existing_messages[i]], [1, 3, 4, 7])
+		self.assertEqual(db_utils.get_senders_many(-100123, main_message_ids + [1]), {1: 10, 3: 30, 4: 40, 7: 70})
+
+	def test_split_into_chunks(self):
+		chunks = list(db_utils.split_into_chunks(range(2000), reserved_variables=1))
+		self.assertEqual([len(chunk) for chunk in chunks], [998, 998, 4])
+
+
+class ArchiveTest(TemporaryDbTestCase):
+	archive_filename = "archive.db"
+
+	def setUp(self):
+		super().setUp()
+		db_utils.initialize_db()
+		for main_message_id in [1, 2]:
+			db_utils.insert_main_channel_message(-100123, main_message_id, main_message_id * 10)
+			with patch("time.time", return_value=100):
+				db_utils.insert_or_update_ticket_data(main_message_id, -100123, False, "user1", "1")
+			db_utils.insert_or_update_current_next_action(main_message_id, -100123, "next action")
+			db_utils.insert_or_update_remind_time(main_message_id, -100123, "user1", 100)
+			db_utils.insert_or_update_sent_scheduled_message(main_message_id, -100123, 200)
+			db_utils.insert_or_update_discussion_message(main_message_id, -100123, main_message_id + 10)
+			db_utils.insert_comment_message(main_message_id + 10, main_message_id + 20, -100300, 5)
+		db_utils.set_ticket_update_time(2, -100123, 1000)
+
+	def count_rows(self, table_name, database="main"):
+		db_utils.flush()
+		return db_utils.get_cursor().execute(f"SELECT count(*) FROM {database}.{table_name}").fetchone()[0]
+
+	def test_archivable_tickets(self):
+		self.assertEqual(db_utils.get_archivable_tickets(-100123, -100300, 500, 0, 10), [1])
+		self.assertEqual(db_utils.get_archivable_tickets(-100123, -100300, 2000, 0, 10), [1, 2])
+		self.assertEqual(db_utils.get_archivable_tickets(-100123, -100300, 2000, 1, 10), [2])
+
+		db_utils.insert_or_update_ticket_data(1, -100123, True, "user1", "1")
+		self.assertEqual(db_utils.get_archivable_tickets(-100123, -100300, 2000, 0, 10), [2])
+
+	def test_close_time_is_kept(self):
+		with patch("time.time", return_value=3000):
+			db_utils.insert_or_update_ticket_data(3, -100123, False, "user1", "1")
+			db_utils.insert_main_channel_message(-100123, 3, 30)
+			# ticket closed again is archived by its first close time
+			db_utils.insert_or_update_ticket_data(1, -100123, False, "user2", "1")
+		self.assertEqual(db_utils.get_archivable_tickets(-100123, -100300, 2000, 0, 10), [1, 2])
+		self.assertEqual(db_utils.get_archivable_tickets(-100123, -100300, 4000, 0, 10), [1, 2, 3])
+
+		with patch("time.time", return_value=3000):
+			db_utils.insert_or_update_ticket_data(1, -100123, True, "user1", "1")
+			db_utils.insert_or_update_ticket_data(1, -100123, False, "user1", "1")
+		self.assertEqual(db_utils.get_archivable_tickets(-100123, -100300, 2000, 0, 10), [2])
+
+	def test_archived_rows_are_found_in_archive(self):
+		moved_rows = db_utils.archive_tickets(-100123, [1], -100300)
+		self.assertEqual(moved_rows, {table_name: 1 for table_name in db_utils.ARCHIVED_TABLES})
+		self.assertEqual(db_utils.get_archivable_tickets(-100123, -100300, 500, 0, 10), [])
+		for table_name in db_utils.ARCHIVED_TABLES:
+			self.assertEqual(self.count_rows(table_name), 1)
+			self.assertEqual(self.count_rows(table_name, db_utils.ARCHIVE_DATABASE), 1)
+
+		self.assertEqual(db_utils.get_main_message_sender(-100123, 1), 10)
+		self.assertTrue(db_utils.is_main_message_exists(-100123, 1))
+		self.assertEqual(db_utils.get_senders_many(-100123, [1, 2, 3]), {1: 10, 2: 20})
+		self.assertEqual(db_utils.main_messages_exist_many(-100123, [1, 2, 3]), {1: True, 2: True, 3: False})
+		self.assertEqual(db_utils.get_next_action_text(1, -100123), "next action")
+		self.assertEqual(db_utils.get_ticket_remind_time(1, -100123, "user1"), 100)
+		self.assertEqual(db_utils.get_sent_scheduled_message_time(1, -100123), 200)
+		self.assertTrue(db_utils.is_comment_exist(21, -100300))
+		self.assertEqual(db_utils.get_comment_top_parent(21, -100300), 11)
+
+		# a reply to an archived comment belongs to the same thread
+		db_utils.insert_comment_message(21, 30, -100300, 6)
+		self.assertEqual(db_utils.get_comment_thread_root(30, -100300), 11)
+		self.assertEqual(db_utils.get_comments_count(11, -100300), 2)
+
+	def test_archived_rows_are_replaced(self):
+		db_utils.archive_tickets(-100123, [1], -100300)
+		db_utils.insert_or_update_current_next_action(1, -100123, "new action")
+		self.assertEqual(db_utils.get_next_action_text(1, -100123), "new action")
+
+		db_utils.archive_tickets(-100123, [1], -100300)
+		self.assertEqual(self.count_rows("next_action_comments", db_utils.ARCHIVE_DATABASE), 1)
+		self.assertEqual(db_utils.get_next_action_text(1, -100123), "new action")
+
+	def test_archived_rows_are_restored_on_write(self):
+		db_utils.archive_tickets(-100123, [1], -100300)
+		db_utils.update_previous_next_action(1, -100123, "previous action")
+		db_utils.flush()
+		sql = "SELECT previous_comment_text FROM next_action_comments WHERE main_message_id=1"
+		self.assertEqual(db_utils.get_cursor().execute(sql).fetchone()[0], "previous action")
+		for table_name in db_utils.ARCHIVED_TABLES:
+			expected_rows = 1 if table_name == "comment_messages" else 0
+			self.assertEqual(self.count_rows(table_name, db_utils.ARCHIVE_DATABASE), expected_rows)
+		self.assertEqual(self.count_rows("next_action_comments"), 2)
+
+		db_utils.insert_or_update_remind_time(1, -100123, "user1", 300)
+		self.assertEqual(db_utils.get_ticket_remind_time(1, -100123, "user1"), 300)
+		self.assertEqual(self.count_rows("reminded_tickets"), 2)
+
+		# a new comment brings back the rest of its thread
+		db_utils.insert_comment_message(21, 30, -100300, 6)
+		self.assertEqual(self.count_rows("comment_messages", db_utils.ARCHIVE_DATABASE), 0)
+		self.assertEqual(self.count_rows("comment_messages"), 3)
+
+	def test_reopened_ticket_is_restored(self):
+		db_utils.archive_tickets(-100123, [1], -100300)
+		db_utils.insert_or_update_ticket_data(1, -100123, True, "user1", "1")
+		self.assertEqual(self.count_rows("main_messages", db_utils.ARCHIVE_DATABASE), 0)
+		self.assertEqual(self.count_rows("main_messages"), 2)
+		self.assertEqual(db_utils.get_next_action_text(1, -100123), "next action")
+
+	def test_database_size(self):
+		size_before = db_utils.get_database_size()
+		self.assertGreater(size_before, 0)
+		self.assertEqual(db_utils.get_database_size(), size_before)
+		self.assertGreater(db_utils.get_database_size(db_utils.ARCHIVE_DATABASE), 0)
+
+	def test_archive_is_optional(self):
+		connection_pool = db_utils.ConnectionPool(self.db_filename)
+		self.addCleanup(connection_pool.close_all)
+		with patch("db_utils._CONNECTION_POOL", connection_pool):
+			self.assertFalse(db_utils.is_archive_attached())
+			self.assertEqual(db_utils.get_databases(), ["main"])
+			self.assertFalse(db_utils.is_main_message_exists(-100123, 3))
+
+
+class MaintenanceTest(TemporaryDbTestCase):
+	def test_incremental_vacuum_is_enabled_in_new_database(self):
+		db_utils.initialize_db()
+		self.assertTrue(db_utils.is_incremental_vacuum_enabled())
+
+	def test_existing_database_is_converted_explicitly(self):
+		connection = sqlite3.connect(self.db_filename)
+		connection.execute("CREATE TABLE old_table (value TEXT)")
+		connection.commit()
+		connection.close()
+
+		with patch("db_utils.convert_to_incremental_vacuum") as mock_convert, self.assertLogs(level="WARNING"):
+			db_utils.initialize_db()
+		mock_convert.assert_not_called()
+		self.assertFalse(db_utils.is_incremental_vacuum_enabled())
+
+		db_utils.insert_main_channel_message(-100123, 1, 10)
+		db_utils.convert_to_incremental_vacuum()
+		self.assertTrue(db_utils.is_incremental_vacuum_enabled())
+		self.assertTrue(db_utils.is_table_exists("old_table"))
+		self.assertEqual(db_utils.get_main_message_sender(-100123, 1), 10)
+
+	def test_free_pages_are_vacuumed(self):
+		db_utils.initialize_db()
+		for main_message_id in range(2000):
+			db_utils.insert_or_update_current_next_action(main_message_id, -100123, "next action " * 20)
+		db_utils.flush()
+		db_utils.get_connection().execute("DELETE FROM next_action_comments")
+		db_utils.get_connection().commit()
+
+		free_pages = db_utils.get_freelist_count()
+		self.assertGreater(free_pages, 10)
+		db_utils.incremental_vacuum(10)
+		self.assertEqual(db_utils.get_freelist_count(), free_pages - 10)
+
+	def test_analyze_table(self):
+		db_utils.initialize_db()
+		db_utils.insert_main_channel_message(-100123, 1, 1)
+		db_utils.analyze_table("main_messages")
+		db_utils.optimize_database()
+		db_utils.flush()
+		stats = db_utils.get_cursor().execute("SELECT idx FROM sqlite_stat1 WHERE tbl='main_messages'").fetchall()
+		self.assertIn(("uq_main_messages",), stats)
+		self.assertIn("main_messages", db_utils.get_table_names())
+		self.assertNotIn("sqlite_stat1", db_utils.get_table_names())
+
+
+class QueryStatsTest(TemporaryDbTestCase):
+	def setUp(self):
+		super().setUp()
+		query_stats_patcher = patch("db_utils._QUERY_STATS", db_utils.QueryStats())
+		query_stats_patcher.start()
+		self.addCleanup(query_stats_patcher.stop)
+		db_utils.initialize_db()
+
+	def test_calls_are_recorded(self):
+		for main_message_id in range(3):
+			db_utils.insert_main_channel_message(-100123, main_message_id, 1)
+		run_in_thread(db_utils.get_main_message_sender, -100123, 1)
+		db_utils.get_main_message_sender(-100123, 2)
+
+		top_functions = dict(db_utils.get_query_stats(10))
+		self.assertEqual(top_functions["insert_main_channel_message"]["calls"], 3)
+		self.assertEqual(sum(top_functions["insert_main_channel_message"]["time_histogram"]), 3)
+		self.assertEqual(sum(top_functions["insert_main_channel_message"]["lock_wait_histogram"]), 3)
+		self.assertEqual(top_functions["get_main_message_sender"]["calls"], 2)
+		self.assertEqual(len(db_utils.get_query_stats(1)), 1)
+
+		db_utils.clear_query_stats()
+		self.assertEqual(db_utils.get_query_stats(10), [])
+
+	def test_top_functions_are_sorted_by_total_time(self):
+		query_stats = db_utils.QueryStats()
+		query_stats.add("fast", 0.0005, 0)
+		query_stats.add("slow", 0.2, 0)
+		query_stats.add("waiting", 0.001, 0.5)
+		run_in_thread(query_stats.add, "fast", 2, 0)
+
+		top_functions = query_stats.get_top_functions(3)
+		self.assertEqual([function_name for function_name, _ in top_functions], ["fast", "waiting", "slow"])
+		fast_stats = top_functions[0][1]
+		self.assertEqual(fast_stats["calls"], 2)
+		self.assertEqual(fast_stats["max_time"], 2)
+		self.assertEqual(fast_stats["time_histogram"], [1, 0, 0, 0, 0, 0, 0, 1])
+		self.assertEqual(top_functions[1][1]["lock_wait_histogram"], [0, 0, 0, 0, 0, 1, 0, 0])
+
+	def test_lock_wait_is_recorded(self):
+		lock_acquired = threading.Event()
+		release_lock = threading.Event()
+
+		def hold_lock():
+			with db_utils._DB_LOCK:
+				lock_acquired.set()
+				release_lock.wait(5)
+
+		thread = threading.Thread(target=hold_lock)
+		thread.start()
+		lock_acquired.wait(5)
+		threading.Timer(0.05, release_lock.set).start()
+		db_utils.insert_main_channel_message(-100123, 1, 1)
+		thread.join()
+
+		stats = dict(db_utils.get_query_stats(10))["insert_main_channel_message"]
+		self.assertGreaterEqual(stats["lock_wait_time"], 0.04)
+		self.assertLess(stats["total_time"], stats["lock_wait_time"])
+
+	@patch("db_utils.SLOW_QUERY_THRESHOLD", 0)
+	def test_slow_query_is_logged_without_data(self):
+		with self.assertLogs(level="WARNING") as logs:
+			db_utils.insert_or_update_current_next_action(1, -100123, "secret text")
+		self.assertEqual(len(logs.output), 1)
+		self.assertIn("insert_or_update_current_next_action(int, int, str)", logs.output[0])
+		self.assertIn("INSERT INTO next_action_comments", logs.output[0])
+		self.assertNotIn("secret", logs.output[0])
+		self.assertNotIn("-100123", logs.output[0])
+
+	def test_fast_query_is_not_logged(self):
+		with patch("logging.warning") as mock_warning:
+			db_utils.insert_or_update_current_next_action(1, -100123, "text")
+		mock_warning.assert_not_called()
+
+	def test_redact_sql(self):
+		sql = "SELECT id FROM  table_1 WHERE text='it''s' AND value=-15 AND x=2.5 AND data=X'AB'"
+		self.assertEqual(db_utils.redact_sql(sql), "SELECT id FROM table_1 WHERE text=? AND value=? AND x=? AND data=?")
+
+
+class BackupDatabaseTest(TemporaryDbTestCase):
+	def setUp(self):
+		super().setUp()
+		db_utils.initialize_db()
+		for main_message_id in range(2000):
+			db_utils.insert_copied_message(main_message_id, -100123, main_message_id, -100200)
+		self.backup_filename = os.path.join(os.path.dirname(self.db_filename), "backup.db")
+
+	def count_copied_messages(self, db_filename):
+		connection = sqlite3.connect(db_filename)
+		self.addCleanup(connection.close)
+		return connection.execute("SELECT count(*) FROM copied_messages").fetchone()[0]
+
+	def test_changes_between_steps_are_copied(self):
+		written_messages = []
+		backup_thread = threading.current_thread()
+		sleep = time.sleep
+
+		def write_between_steps(delay):
+			if threading.current_thread() != backup_thread:
+				return sleep(delay)
+			# other threads can write while the backup sleeps between steps
+			run_in_thread(db_utils.insert_copied_message, 5000 + len(written_messages), -100123, 1, -100201)
+			written_messages.append(delay)
+
+		with patch("time.sleep", side_effect=write_between_steps):
+			db_utils.backup_database(self.backup_filename, pages_per_step=5, step_delay=0.01)
+
+		self.assertGreater(len(written_messages), 5)
+		self.assertEqual(self.count_copied_messages(self.backup_filename), 2000 + len(written_messages))
+		self.assertEqual(db_utils.check_database_integrity(self.backup_filename), ["ok"])
+
+	def test_corrupted_database(self):
+		with open(self.backup_filename, "wb") as backup_file:
+			backup_file.write(b"SQLite format 3\0" + b"\xff" * 4096)
+		with self.assertRaises(sqlite3.DatabaseError):
+			db_utils.check_database_integrity(self.backup_filename)
+
+
+class MemoryStorageTest(TestCase):
+	def setUp(self):
+		connection_pool = db_utils.ConnectionPool("test", db_utils.MEMORY_BACKEND)
+		for name, value in [("_CONNECTION_POOL", connection_pool), ("_GROUP_COMMIT", db_utils.GroupCommit()),
+		                    ("_CHANNEL_REGISTRY", db_utils.ChannelRegistry())]:
+			patcher = patch(f"db_utils.{name}", value)
+			patcher.start()
+			self.addCleanup(patcher.stop)
+		self.addCleanup(connection_pool.close_all)
+		self.addCleanup(db_utils.flush)
+
+	def test_database_is_not_stored_in_file(self):
+		with patch("sqlite3.connect", wraps=sqlite3.connect) as mock_connect:
+			db_utils.initialize_db()
+			db_utils.insert_or_update_ticket_data(1, -100123, True, "user1", "1")
+		mock_connect.assert_called_once_with(":memory:", check_same_thread=False)
+		self.assertFalse(os.path.exists("test"))
+
+		self.assertEqual(db_utils.get_schema_version(), len(db_utils.MIGRATIONS))
+		self.assertEqual(run_in_thread(db_utils.get_ticket_data, 1, -100123), [("user1", "1", None)])
+		db_utils.flush()
+		self.assertIs(run_in_thread(db_utils.get_connection)[0], db_utils.get_connection())
+
+	def test_unknown_backend(self):
+		with self.assertRaises(ValueError):
+			db_utils.ConnectionPool("test", "unknown")
+
+
+if __name__ == "__main__":
+	main()
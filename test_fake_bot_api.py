@@ -0,0 +1,117 @@
+from unittest import TestCase, main
+from unittest.mock import patch
+
+import telebot
+from telebot import apihelper
+
+import fake_bot_api
+import threading_utils
+import utils
+
+MAIN_CHANNEL_ID = -100123
+SUBCHANNEL_ID = -100456
+DISCUSSION_CHAT_ID = -100789
+
+
+class FakeBotApiTest(TestCase):
+	def setUp(self):
+		self.fake_server = fake_bot_api.FakeBotApiServer().start()
+		self.fake_server.add_chat(MAIN_CHANNEL_ID, title="main", linked_chat_id=DISCUSSION_CHAT_ID, owner_id=7)
+		self.fake_server.add_chat(SUBCHANNEL_ID, title="subchannel")
+		self.fake_server.add_chat(DISCUSSION_CHAT_ID, chat_type="supergroup")
+
+		api_url_patch = patch.object(apihelper, "API_URL", self.fake_server.api_url)
+		api_url_patch.start()
+		self.addCleanup(api_url_patch.stop)
+		self.bot = telebot.TeleBot("123:abc", threaded=False)
+
+	def tearDown(self):
+		self.fake_server.stop()
+
+	def test_message_lifecycle(self):
+		keyboard = telebot.types.InlineKeyboardMarkup([[telebot.types.InlineKeyboardButton("open", callback_data="open")]])
+		main_message = self.bot.send_message(MAIN_CHANNEL_ID, "#open ticket")
+		self.assertEqual(main_message.sender_chat.id, MAIN_CHANNEL_ID)
+
+		copied_message_id = self.bot.copy_message(SUBCHANNEL_ID, MAIN_CHANNEL_ID, main_message.message_id, reply_markup=keyboard).message_id
+		copied_message = self.fake_server.get_message(SUBCHANNEL_ID, copied_message_id)
+		self.assertEqual(copied_message["text"], "#open ticket")
+		self.assertEqual(copied_message["reply_markup"], keyboard.to_dict())
+
+		forwarded_message = self.bot.forward_message(DISCUSSION_CHAT_ID, MAIN_CHANNEL_ID, main_message.message_id)
+		self.assertEqual(forwarded_message.forward_from_chat.id, MAIN_CHANNEL_ID)
+		self.assertEqual(forwarded_message.forward_from_message_id, main_message.message_id)
+
+		edited_message = self.bot.edit_message_text("#closed ticket", SUBCHANNEL_ID, copied_message_id, reply_markup=keyboard)
+		self.assertEqual(edited_message.text, "#closed ticket")
+		self.assertIsNotNone(edited_message.edit_date)
+		with self.assertRaises(apihelper.ApiTelegramException) as context:
+			self.bot.edit_message_text("#closed ticket", SUBCHANNEL_ID, copied_message_id, reply_markup=keyboard)
+		self.assertEqual(context.exception.description, utils.SAME_MSG_CONTENT_ERROR)
+
+		edited_message = self.bot.edit_message_reply_markup(SUBCHANNEL_ID, copied_message_id)
+		self.assertIsNone(edited_message.reply_markup)
+
+		self.assertTrue(self.bot.delete_message(SUBCHANNEL_ID, copied_message_id))
+		self.assertIsNone(self.fake_server.get_message(SUBCHANNEL_ID, copied_message_id))
+		with self.assertRaises(apihelper.ApiTelegramException) as context:
+			self.bot.delete_message(SUBCHANNEL_ID, copied_message_id)
+		self.assertEqual(context.exception.error_code, 400)
+		self.assertEqual(self.fake_server.method_calls["deleteMessage"], 2)
+
+		with self.assertRaises(apihelper.ApiTelegramException) as context:
+			self.bot.forward_message(DISCUSSION_CHAT_ID, MAIN_CHANNEL_ID, None)
+		self.assertEqual(context.exception.error_code, 400)
+
+	def test_chats(self):
+		chat = self.bot.get_chat(MAIN_CHANNEL_ID)
+		self.assertEqual(chat.title, "main")
+		self.assertEqual(chat.linked_chat_id, DISCUSSION_CHAT_ID)
+
+		administrators = self.bot.get_chat_administrators(MAIN_CHANNEL_ID)
+		self.assertEqual([(member.status, member.user.id) for member in administrators], [("creator", 7), ("administrator", 123)])
+
+		with self.assertRaises(apihelper.ApiTelegramException) as context:
+			self.bot.get_chat(-100999)
+		self.assertEqual(context.exception.description, "Bad Request: chat not found")
+
+	def test_get_updates(self):
+		first_update = self.fake_server.post_channel_message(MAIN_CHANNEL_ID, "#open first")
+		self.fake_server.post_channel_message(MAIN_CHANNEL_ID, "#open second")
+
+		updates = self.bot.get_updates(timeout=5)
+		self.assertEqual([update.channel_post.text for update in updates], ["#open first", "#open second"])
+		updates = self.bot.get_updates(offset=first_update["update_id"] + 1, timeout=5)
+		self.assertEqual([update.channel_post.text for update in updates], ["#open second"])
+		self.assertEqual(self.bot.get_updates(offset=updates[-1].update_id + 1, long_polling_timeout=1), [])
+
+	def test_too_many_requests(self):
+		self.fake_server.add_error("sendMessage", retry_after=3)
+		with self.assertRaises(apihelper.ApiTelegramException) as context:
+			self.bot.send_message(MAIN_CHANNEL_ID, "text")
+		self.assertEqual(context.exception.error_code, 429)
+		self.assertEqual(context.exception.result_json["parameters"]["retry_after"], 3)
+		self.assertEqual(threading_utils.get_timeout_retry(context.exception), 3)
+
+		self.fake_server.add_error("sendMessage", retry_after=0)
+		send_message = threading_utils.timeout_error_lock(self.bot.send_message)
+		with patch("threading_utils.logging"):
+			self.assertEqual(send_message(MAIN_CHANNEL_ID, "text").text, "text")
+		self.assertEqual(self.fake_server.method_calls["sendMessage"], 3)
+
+	def test_random_too_many_requests(self):
+		self.fake_server.too_many_requests_rate = 0.5
+		self.fake_server.random.seed(1)
+		errors = 0
+		for _ in range(20):
+			try:
+				self.bot.get_chat(MAIN_CHANNEL_ID)
+			except apihelper.ApiTelegramException as E:
+				self.assertEqual(E.error_code, 429)
+				errors += 1
+		self.assertEqual(errors, self.fake_server.too_many_requests_errors["getChat"])
+		self.assertTrue(0 < errors < 20)
+
+
+if __name__ == "__main__":
+	main()
@@ -1,8 +1,18 @@
 from unittest import TestCase, main
 from unittest.mock import patch, Mock, ANY
 from telebot import TeleBot
+from telebot.apihelper import ApiTelegramException
 
 import forwarding_utils
+import test_helper
+
+
+def setUpModule():
+	test_helper.open_memory_database()
+
+
+def tearDownModule():
+	test_helper.close_memory_database()
 
 
 class DeleteMainMessageTest(TestCase):
@@ -56,6 +66,28 @@ class DeleteMainMessageTest(TestCase):
 		mock_bot.send_message.assert_called_once()
 
 
+class DeleteForwardedMessageTest(TestCase):
+	@patch("utils.edit_message_content")
+	@patch("db_utils.get_main_message_from_copied", return_value=None)
+	@patch("utils.check_content_type", return_value=True)
+	@patch("utils.get_message_content_by_id")
+	@patch("db_utils.delete_copied_message")
+	@patch("db_utils.get_oldest_copied_message", side_effect=[5, None])
+	@patch("db_utils.get_newest_copied_message", return_value=20)
+	@patch("utils.delete_message")
+	def test_oldest_message_deleted_by_user(self, mock_delete_message, mock_get_newest_copied_message, mock_get_oldest_copied_message,
+											mock_delete_copied_message, mock_get_message_content_by_id, *args):
+		mock_delete_message.side_effect = ApiTelegramException("deleteMessage", None, {"error_code": 400, "description": "Bad Request: message can't be deleted"})
+		mock_get_message_content_by_id.side_effect = [None, test_helper.create_mock_message("ticket", [])]
+
+		mock_bot = Mock(spec=TeleBot)
+		forwarding_utils.delete_forwarded_message(mock_bot, -100300, 10)
+
+		# stored content of the copy is left after it was deleted by user, so the existence is checked in Telegram
+		mock_get_message_content_by_id.assert_any_call(mock_bot, -100300, 5, use_cache=False)
+		mock_delete_copied_message.assert_called_once_with(5, -100300)
+
+
 if __name__ == "__main__":
 	main()
 
@@ -8,6 +8,14 @@ from hashtag_data import HashtagData
 import test_helper
 
 
+def setUpModule():
+	test_helper.open_memory_database()
+
+
+def tearDownModule():
+	test_helper.close_memory_database()
+
+
 @patch("hashtag_data.PRIORITY_TAG", "p")
 @patch("hashtag_data.OPENED_TAG", "o")
 class FindCopyUsersFromText(TestCase):
@@ -1,9 +1,14 @@
+import os
+import tempfile
 from typing import List
 
 from telebot.types import MessageEntity, Message
-from unittest.mock import Mock
+from unittest import TestCase
+from unittest.mock import Mock, patch
 import re
 
+import db_utils
+
 
 def create_hashtag_entity_list(text: str):
 	entities = []
@@ -21,3 +26,47 @@ def create_mock_message(text: str, entities: List[MessageEntity]):
 	message.caption = None
 	message.entities = entities
 	return message
+
+
+_previous_database = []
+
+
+def open_memory_database():
+	connection_pool = db_utils._CONNECTION_POOL
+	_previous_database.append((connection_pool.db_filename, connection_pool.backend, connection_pool.archive_filename))
+	db_utils.open_database("test", db_utils.MEMORY_BACKEND)
+	db_utils.initialize_db()
+
+
+def close_memory_database():
+	db_filename, backend, archive_filename = _previous_database.pop()
+	db_utils.open_database(db_filename, backend, archive_filename)
+
+
+class TemporaryDbTestCase(TestCase):
+	archive_filename = None
+
+	def setUp(self):
+		temp_dir = tempfile.TemporaryDirectory()
+		self.addCleanup(temp_dir.cleanup)
+
+		archive_filename = os.path.join(temp_dir.name, self.archive_filename) if self.archive_filename else None
+		connection_pool = db_utils.ConnectionPool(os.path.join(temp_dir.name, "test.db"), archive_filename=archive_filename)
+		pool_patcher = patch("db_utils._CONNECTION_POOL", connection_pool)
+		pool_patcher.start()
+		self.addCleanup(pool_patcher.stop)
+		self.addCleanup(connection_pool.close_all)
+
+		group_commit_patcher = patch("db_utils._GROUP_COMMIT", db_utils.GroupCommit())
+		group_commit_patcher.start()
+		self.addCleanup(group_commit_patcher.stop)
+		self.addCleanup(db_utils.flush)
+
+		registry_patcher = patch("db_utils._CHANNEL_REGISTRY", db_utils.ChannelRegistry())
+		registry_patcher.start()
+		self.addCleanup(registry_patcher.stop)
+
+		settings_cache_patcher = patch("db_utils._SETTINGS_CACHE", db_utils.ChannelSettingsCache())
+		settings_cache_patcher.start()
+		self.addCleanup(settings_cache_patcher.stop)
+		self.db_filename = connection_pool.db_filename
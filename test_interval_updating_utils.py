@@ -1,10 +1,124 @@
+import datetime
 from unittest import TestCase, main
 from unittest.mock import Mock, patch
 
+import pyrogram
 from telebot import TeleBot
-from telebot.types import Chat
+from telebot.types import Chat, Message
+
+import core_api
+import db_utils
+import interval_updating_utils
+import utils
+from test_helper import TemporaryDbTestCase
+
+
+@patch("interval_updating_utils.read_main_messages", return_value={})
+@patch("interval_updating_utils._UPDATE_STATUS", True)
+@patch("interval_updating_utils._SCAN_BATCH_SIZE", 3)
+@patch("time.sleep")
+@patch("db_utils.insert_or_update_channel_update_progress")
+@patch("interval_updating_utils.update_older_message")
+class CheckMainMessagesTest(TestCase):
+	@patch("db_utils.main_messages_exist_many")
+	def test_missing_messages_are_skipped(self, mock_main_messages_exist_many, mock_update_older_message, mock_update_progress, *args):
+		main_channel_id = -100123
+		existing_message_ids = {5, 2}
+		mock_main_messages_exist_many.side_effect = lambda channel_id, ids: {i: i in existing_message_ids for i in ids}
+
+		bot = Mock(spec=TeleBot)
+		interval_updating_utils.check_main_messages(bot, main_channel_id, 6)
+
+		self.assertEqual(mock_main_messages_exist_many.call_count, 2)
+		updated_message_ids = [call[0][2] for call in mock_update_older_message.call_args_list]
+		self.assertEqual(updated_message_ids, [5, 2])
+		mock_update_progress.assert_called_with(main_channel_id, 0)
+
+	@patch("utils.get_stored_message_content", return_value=None)
+	@patch("forwarding_utils.delete_main_message")
+	@patch("db_utils.main_messages_exist_many")
+	def test_messages_are_read_in_batches(self, mock_main_messages_exist_many, mock_delete_main_message, mock_get_stored_message_content,
+										  mock_update_older_message, mock_update_progress, mock_sleep, mock_read_main_messages):
+		main_channel_id = -100123
+		existing_message_ids = {6, 5, 2}
+		mock_main_messages_exist_many.side_effect = lambda channel_id, ids: {i: i in existing_message_ids for i in ids}
+		main_message = Mock(spec=Message)
+		read_messages = {5: main_message, 2: None}
+		mock_read_main_messages.side_effect = lambda channel_id, ids: {i: read_messages[i] for i in ids if i in read_messages}
+
+		bot = Mock(spec=TeleBot)
+		interval_updating_utils.check_main_messages(bot, main_channel_id, 6)
+
+		self.assertEqual([call[0][1] for call in mock_read_main_messages.call_args_list], [[6, 5], [2]])
+		updated_messages = [(call[0][2], call[0][3]) for call in mock_update_older_message.call_args_list]
+		self.assertEqual(updated_messages, [(6, None), (5, main_message)])
+		mock_delete_main_message.assert_called_once_with(bot, main_channel_id, 2)
+		# messages from the batch are not delayed one by one, only message 6 is read from the dump chat
+		# time.sleep is patched globally, so sleeps of the group commit thread are skipped
+		scan_delays = [call for call in mock_sleep.call_args_list if call[0] == (interval_updating_utils.DELAY_AFTER_ONE_SCAN,)]
+		self.assertEqual(len(scan_delays), 3)
+
+	@patch("utils.get_stored_message_content")
+	@patch("db_utils.main_messages_exist_many")
+	def test_message_edited_after_reading_batch(self, mock_main_messages_exist_many, mock_get_stored_message_content,
+												mock_update_older_message, mock_update_progress, mock_sleep, mock_read_main_messages):
+		main_channel_id = -100123
+		mock_main_messages_exist_many.side_effect = lambda channel_id, ids: {i: i in {3, 2} for i in ids}
+		read_messages = {3: Mock(spec=Message, edit_date=100), 2: Mock(spec=Message, edit_date=100)}
+		mock_read_main_messages.side_effect = lambda channel_id, ids: {i: read_messages[i] for i in ids}
+		# message 3 was edited by user while the batch was processed, message 2 wasn't edited
+		stored_messages = {3: Mock(spec=Message, edit_date=200), 2: Mock(spec=Message, edit_date=100)}
+		mock_get_stored_message_content.side_effect = lambda channel_id, message_id: stored_messages[message_id]
+
+		bot = Mock(spec=TeleBot)
+		interval_updating_utils.check_main_messages(bot, main_channel_id, 3)
+
+		updated_messages = [(call[0][2], call[0][3]) for call in mock_update_older_message.call_args_list]
+		self.assertEqual(updated_messages, [(3, stored_messages[3]), (2, read_messages[2])])
+
+
+class ReadMainMessagesTest(TemporaryDbTestCase):
+	def setUp(self):
+		super().setUp()
+		db_utils.initialize_db()
+
+	@staticmethod
+	def create_pyrogram_message(message_id: int, text: str = None, empty: bool = False):
+		chat = pyrogram.types.Chat(id=-100123, type=pyrogram.enums.ChatType.CHANNEL, title="main")
+		if empty:
+			return pyrogram.types.Message(id=message_id, empty=True)
+		entities = [pyrogram.types.MessageEntity(type=pyrogram.enums.MessageEntityType.HASHTAG, offset=0, length=5)]
+		return pyrogram.types.Message(id=message_id, chat=chat, date=datetime.datetime.fromtimestamp(1700000000),
+									  text=text, entities=entities)
+
+	def test_message_is_converted_to_bot_api_format(self):
+		message = Message.de_json(core_api.get_message_json(self.create_pyrogram_message(5, "#open ticket")))
+		self.assertEqual(message.message_id, 5)
+		self.assertEqual(message.chat.id, -100123)
+		self.assertEqual(message.content_type, "text")
+		self.assertEqual(message.text, "#open ticket")
+		self.assertEqual(message.entities[0].type, "hashtag")
+		self.assertEqual(message.date, 1700000000)
+		self.assertIsNone(core_api.get_message_json(self.create_pyrogram_message(6, empty=True)))
+
+	def test_messages_are_read_in_chunks(self):
+		message_ids = list(range(450, 0, -1))
+		with patch.object(core_api.app, "get_messages") as mock_get_messages, patch.object(core_api.app, "is_initialized", True):
+			mock_get_messages.side_effect = lambda chat_id, ids: [
+				self.create_pyrogram_message(i, "#open ticket", empty=i % 2 == 0) for i in ids
+			]
+			main_messages = interval_updating_utils.read_main_messages(-100123, message_ids)
+
+		self.assertEqual([len(call[0][1]) for call in mock_get_messages.call_args_list], [200, 200, 50])
+		self.assertIsNone(main_messages[450])
+		self.assertEqual(utils.get_forwarded_from_id(main_messages[449]), -100123)
+		self.assertEqual(main_messages[449].forward_from_message_id, 449)
+		self.assertEqual(utils.get_stored_message_content(-100123, 449).text, "#open ticket")
+
+	def test_core_api_error(self):
+		with patch("core_api.get_messages_json", side_effect=ConnectionError):
+			self.assertEqual(interval_updating_utils.read_main_messages(-100123, [5]), {})
 
-# TODO: tests
 
 if __name__ == "__main__":
 	main()
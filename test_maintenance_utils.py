@@ -0,0 +1,66 @@
+import os
+from unittest import main
+from unittest.mock import patch
+
+import db_utils
+import maintenance_utils
+from test_helper import TemporaryDbTestCase
+
+
+@patch("maintenance_utils._DELAY_BETWEEN_STEPS", 0)
+class RunMaintenanceTest(TemporaryDbTestCase):
+	def setUp(self):
+		super().setUp()
+		db_utils.initialize_db()
+		for main_message_id in range(3000):
+			db_utils.insert_copied_message(main_message_id, -100123, main_message_id, -100200)
+		db_utils.flush()
+
+	def test_deleted_pages_are_reclaimed(self):
+		for main_message_id in range(3000):
+			db_utils.delete_copied_message(main_message_id, -100200)
+		db_utils.flush()
+		free_pages = db_utils.get_freelist_count()
+		db_utils.get_connection().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+		file_size = os.path.getsize(self.db_filename)
+
+		with patch("maintenance_utils._VACUUM_STEP_PAGES", 4), \
+				patch("db_utils.incremental_vacuum", wraps=db_utils.incremental_vacuum) as mock_incremental_vacuum:
+			report = maintenance_utils.run_maintenance()
+		self.assertEqual(report["reclaimed_pages"], free_pages)
+		self.assertEqual(mock_incremental_vacuum.call_count, (free_pages + 3) // 4)
+		self.assertEqual(db_utils.get_freelist_count(), 0)
+
+		db_utils.get_connection().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+		self.assertLess(os.path.getsize(self.db_filename), file_size)
+
+	def test_nothing_to_reclaim(self):
+		with patch("db_utils.incremental_vacuum") as mock_incremental_vacuum:
+			report = maintenance_utils.run_maintenance()
+		self.assertEqual(report["reclaimed_pages"], 0)
+		mock_incremental_vacuum.assert_not_called()
+		self.assertTrue(db_utils.get_cursor().execute("SELECT count(*) FROM sqlite_stat1").fetchone()[0])
+
+	def test_existing_database_is_converted(self):
+		writer_connection = db_utils._CONNECTION_POOL.get_writer_connection()
+		writer_connection.execute("PRAGMA auto_vacuum=NONE")
+		writer_connection.execute("VACUUM")
+		self.assertFalse(db_utils.is_incremental_vacuum_enabled())
+
+		report = maintenance_utils.run_maintenance()
+		self.assertTrue(db_utils.is_incremental_vacuum_enabled())
+		self.assertGreater(report["conversion_time"], 0)
+		self.assertEqual(report["reclaimed_pages"], 0)
+
+	@patch("config_utils.MAINTENANCE_HOUR", 4)
+	@patch("config_utils.TIMEZONE_NAME", "UTC")
+	def test_low_traffic_time(self):
+		with patch("maintenance_utils.datetime") as mock_datetime:
+			mock_datetime.datetime.now.return_value.hour = 4
+			self.assertTrue(maintenance_utils.is_low_traffic_time())
+			mock_datetime.datetime.now.return_value.hour = 5
+			self.assertFalse(maintenance_utils.is_low_traffic_time())
+
+
+if __name__ == "__main__":
+	main()
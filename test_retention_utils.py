@@ -0,0 +1,59 @@
+from unittest import main
+from unittest.mock import patch
+
+import db_utils
+import retention_utils
+from test_helper import TemporaryDbTestCase
+
+
+@patch("retention_utils._DELAY_BETWEEN_BATCHES", 0)
+@patch("config_utils.DISCUSSION_CHAT_DATA", {"-100123": -100300})
+@patch("config_utils.CLOSED_TICKETS_RETENTION_DAYS", 90)
+class RunRetentionTest(TemporaryDbTestCase):
+	archive_filename = "archive.db"
+
+	def setUp(self):
+		super().setUp()
+		db_utils.initialize_db()
+		db_utils.insert_main_channel(-100123)
+		for main_message_id in range(1, 8):
+			db_utils.insert_main_channel_message(-100123, main_message_id, 10)
+			db_utils.insert_or_update_discussion_message(main_message_id, -100123, main_message_id + 100)
+			db_utils.insert_comment_message(main_message_id + 100, main_message_id + 200, -100300, 5)
+			with patch("time.time", return_value=100 * 24 * 60 * 60):
+				db_utils.insert_or_update_ticket_data(main_message_id, -100123, main_message_id > 5, "user1", "1")
+
+	@patch("retention_utils._RETENTION_BATCH_SIZE", 2)
+	@patch("time.time", return_value=200 * 24 * 60 * 60)
+	def test_closed_tickets_are_moved_in_batches(self, *args):
+		db_utils.set_ticket_update_time(5, -100123, 150 * 24 * 60 * 60)
+
+		with patch("db_utils.archive_tickets", wraps=db_utils.archive_tickets) as mock_archive_tickets:
+			report = retention_utils.run_retention()
+		self.assertEqual([call[0][1] for call in mock_archive_tickets.call_args_list], [[1, 2], [3, 4]])
+		self.assertEqual(report["moved_rows"], {"main_messages": 4, "next_action_comments": 0,
+												"sent_scheduled_messages": 0, "reminded_tickets": 0, "comment_messages": 4})
+		self.assertEqual(report["total_moved_rows"], 8)
+		self.assertEqual(report["size_reduction"], report["size_before"] - report["size_after"])
+
+		self.assertEqual(db_utils.main_messages_exist_many(-100123, [4, 5, 8]), {4: True, 5: True, 8: False})
+		self.assertEqual(retention_utils.run_retention()["total_moved_rows"], 0)
+
+	@patch("time.time", return_value=200 * 24 * 60 * 60)
+	def test_recently_closed_tickets_are_kept(self, *args):
+		# ticket without comments is kept for the retention period after it was closed
+		db_utils.insert_main_channel_message(-100123, 8, 10)
+		with patch("time.time", return_value=199 * 24 * 60 * 60):
+			db_utils.insert_or_update_ticket_data(8, -100123, False, "user1", "1")
+
+		self.assertEqual(retention_utils.run_retention()["moved_rows"]["main_messages"], 5)
+		self.assertEqual(db_utils.get_archivable_tickets(-100123, -100300, 200 * 24 * 60 * 60, 0, 10), [8])
+
+	def test_disabled_policy(self):
+		with patch("config_utils.CLOSED_TICKETS_RETENTION_DAYS", 0):
+			self.assertEqual(retention_utils.get_retention_policies(), [])
+			self.assertEqual(retention_utils.run_retention()["total_moved_rows"], 0)
+
+
+if __name__ == "__main__":
+	main()
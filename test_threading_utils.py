@@ -0,0 +1,186 @@
+import threading
+import time
+from unittest import TestCase, main
+from unittest.mock import Mock, patch
+
+import threading_utils
+from threading_utils import RateLimiter, RequestScheduler, REQUEST_PRIORITIES, ShardedThreadPool
+
+
+class RateLimiterTest(TestCase):
+	def setUp(self):
+		self.rate_limiter = RateLimiter(requests_per_second=30, chat_requests_per_second=1, chat_requests_burst=3,
+										group_messages_per_minute=20)
+
+	def test_chat_burst(self):
+		wait_times = [self.rate_limiter.reserve("sendMessage", -100123, now=0) for _ in range(5)]
+		self.assertEqual(wait_times, [0, 0, 0, 1, 2])
+		self.assertEqual(self.rate_limiter.reserve("editMessageText", -100123, now=10), 0)
+
+	def test_chats_are_limited_separately(self):
+		for _ in range(3):
+			self.rate_limiter.reserve("sendMessage", -100123, now=0)
+		self.assertEqual(self.rate_limiter.reserve("sendMessage", -100456, now=0), 0)
+		self.assertEqual(self.rate_limiter.reserve("answerCallbackQuery", now=0), 0)
+		self.assertEqual(self.rate_limiter.reserve("getChat", -100123, now=0), 0)
+
+	def test_unlimited_methods(self):
+		self.assertEqual(self.rate_limiter.reserve("getUpdates", -100123, now=0), 0)
+		self.assertEqual(self.rate_limiter.chat_buckets, {})
+
+	def test_group_messages_per_minute(self):
+		rate_limiter = RateLimiter(chat_requests_burst=100, group_messages_per_minute=20)
+		rate_limiter.add_group_chat(-100123, now=0)
+		wait_times = [rate_limiter.reserve("sendMessage", -100123, now=0) for _ in range(21)]
+		self.assertEqual(wait_times[:20], [0] * 20)
+		self.assertAlmostEqual(wait_times[20], 3)
+		self.assertEqual(rate_limiter.reserve("editMessageText", -100123, now=0), 0)
+
+	def test_retry_after_delays_only_one_chat(self):
+		self.rate_limiter.set_retry_after(-100123, 15, now=0)
+		self.assertEqual(self.rate_limiter.reserve("sendMessage", -100123, now=5), 10)
+		self.assertEqual(self.rate_limiter.reserve("sendMessage", -100456, now=5), 0)
+
+	@patch("time.sleep")
+	@patch("telebot.apihelper._get_req_session")
+	def test_send_request(self, mock_get_req_session, *args):
+		response = Mock(status_code=429)
+		response.json.return_value = {"ok": False, "error_code": 429, "parameters": {"retry_after": 7}}
+		mock_get_req_session.return_value.request.return_value = response
+
+		url = "https://api.telegram.org/bot123:abc/sendMessage"
+		self.assertIs(self.rate_limiter.send_request("post", url, params={"chat_id": -100123}), response)
+		self.assertGreater(self.rate_limiter.reserve("sendMessage", -100123), 6)
+
+		response = Mock(status_code=200)
+		response.json.return_value = {"ok": True, "result": {"message_id": 1, "chat": {"id": -100456, "type": "supergroup"}}}
+		mock_get_req_session.return_value.request.return_value = response
+		self.rate_limiter.send_request("post", url, params={"chat_id": -100456})
+		self.assertIn("-100456", self.rate_limiter.group_buckets)
+
+
+class RequestSchedulerTest(TestCase):
+	def test_global_limit(self):
+		scheduler = RequestScheduler(requests_per_second=100)
+		start_time = time.monotonic()
+		for _ in range(110):
+			scheduler.acquire(REQUEST_PRIORITIES.NORMAL)
+		self.assertGreater(time.monotonic() - start_time, 0.08)
+		self.assertEqual(scheduler.get_stats()[REQUEST_PRIORITIES.NORMAL]["requests"], 110)
+
+	def test_interactive_request_is_not_queued_behind_background(self):
+		scheduler = RequestScheduler(requests_per_second=50)
+		scheduler.bucket.tokens = 0
+		sent_requests = []
+
+		def send_request(priority):
+			scheduler.acquire(priority)
+			sent_requests.append(priority)
+
+		threads = [threading.Thread(target=send_request, args=(REQUEST_PRIORITIES.BACKGROUND,)) for _ in range(8)]
+		for thread in threads:
+			thread.start()
+		while scheduler.get_stats()[REQUEST_PRIORITIES.BACKGROUND]["queue_depth"] < 7:
+			time.sleep(0.001)
+
+		threads.append(threading.Thread(target=send_request, args=(REQUEST_PRIORITIES.INTERACTIVE,)))
+		threads[-1].start()
+		for thread in threads:
+			thread.join()
+
+		self.assertLessEqual(sent_requests.index(REQUEST_PRIORITIES.INTERACTIVE), 3)
+		stats = scheduler.get_stats()
+		self.assertEqual(stats[REQUEST_PRIORITIES.BACKGROUND]["requests"], 8)
+		self.assertEqual(stats[REQUEST_PRIORITIES.BACKGROUND]["queue_depth"], 0)
+		self.assertGreater(stats[REQUEST_PRIORITIES.BACKGROUND]["max_wait_time"], stats[REQUEST_PRIORITIES.INTERACTIVE]["max_wait_time"])
+
+	def test_request_priority_of_thread(self):
+		self.assertEqual(threading_utils.get_request_priority(), REQUEST_PRIORITIES.NORMAL)
+		with threading_utils.request_priority(REQUEST_PRIORITIES.INTERACTIVE):
+			self.assertEqual(threading_utils.get_request_priority(), REQUEST_PRIORITIES.INTERACTIVE)
+		self.assertEqual(threading_utils.get_request_priority(), REQUEST_PRIORITIES.NORMAL)
+
+
+class ShardedThreadPoolTest(TestCase):
+	def setUp(self):
+		self.telebot = Mock(exception_handler=None)
+		self.pool = ShardedThreadPool(self.telebot, lambda update: update, num_threads=4)
+
+	def tearDown(self):
+		self.pool.close()
+
+	def wait_for_tasks(self):
+		while self.pool.get_stats()["active_shards"]:
+			time.sleep(0.001)
+
+	def test_tasks_of_one_shard_are_handled_in_order(self):
+		handled_tasks = []
+
+		def handle_task(key, index):
+			time.sleep(0.001 * (index % 3))
+			handled_tasks.append((key, index))
+
+		for index in range(20):
+			for key in [(-100123, 1), (-100123, 2), (-100456, 1)]:
+				self.pool.put(handle_task, key, index)
+		self.wait_for_tasks()
+
+		for key in [(-100123, 1), (-100123, 2), (-100456, 1)]:
+			self.assertEqual([index for task_key, index in handled_tasks if task_key == key], list(range(20)))
+		stats = self.pool.get_stats()
+		self.assertEqual(stats["queued_updates"], 0)
+		self.assertEqual(stats["shards"][-100123]["updates"], 40)
+		self.assertEqual(stats["shards"][-100456]["updates"], 20)
+
+	def test_slow_shard_does_not_block_other_shards(self):
+		release_event = threading.Event()
+		handled_keys = []
+
+		def handle_task(key):
+			if key == (-100123, 1):
+				release_event.wait(5)
+			handled_keys.append(key)
+
+		self.pool.put(handle_task, (-100123, 1))
+		self.pool.put(handle_task, (-100123, 1))
+		self.pool.put(handle_task, (-100456, 1))
+		while (-100456, 1) not in handled_keys:
+			time.sleep(0.001)
+
+		self.assertEqual(handled_keys, [(-100456, 1)])
+		self.assertEqual(self.pool.get_stats()["queued_updates"], 1)
+		release_event.set()
+		self.wait_for_tasks()
+		self.assertEqual(handled_keys, [(-100456, 1), (-100123, 1), (-100123, 1)])
+
+	def test_exception_is_raised_in_polling(self):
+		def handle_task(key):
+			raise ValueError("error in handler")
+
+		self.pool.put(handle_task, (-100123, 1))
+		self.assertTrue(self.pool.exception_event.wait(5))
+		self.assertRaises(ValueError, self.pool.raise_exceptions)
+		self.pool.clear_exceptions()
+		self.pool.raise_exceptions()
+
+
+class TimeoutErrorLockTest(TestCase):
+	@patch("time.sleep")
+	def test_calls_are_not_serialized(self, *args):
+		calls = []
+
+		@threading_utils.timeout_error_lock
+		def outer_call():
+			calls.append("outer")
+			inner_call()
+
+		@threading_utils.timeout_error_lock
+		def inner_call():
+			calls.append("inner")
+
+		outer_call()
+		self.assertEqual(calls, ["outer", "inner"])
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,68 @@
+import http.server
+import threading
+from unittest import TestCase, main
+from unittest.mock import patch
+
+from telebot import apihelper
+
+import transport_utils
+
+
+class JsonRequestHandler(http.server.BaseHTTPRequestHandler):
+	protocol_version = "HTTP/1.1"
+
+	def do_POST(self):
+		self.rfile.read(int(self.headers.get("Content-Length", 0)))
+		body = b'{"ok": true, "result": true}'
+		self.send_response(200)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+		pass
+
+
+class TransportTest(TestCase):
+	def setUp(self):
+		self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), JsonRequestHandler)
+		self.server.daemon_threads = True
+		threading.Thread(target=self.server.serve_forever, daemon=True).start()
+		self.url = f"http://127.0.0.1:{self.server.server_address[1]}/bot123:abc/"
+		transport_utils.install_session(2, {"message": [3, 7]})
+
+	def tearDown(self):
+		transport_utils._SESSION.close()
+		transport_utils._SESSION = None
+		transport_utils._TIMEOUTS = dict(transport_utils.DEFAULT_TIMEOUTS)
+		apihelper.session = None
+		self.server.shutdown()
+		self.server.server_close()
+
+	def test_connection_is_reused(self):
+		stats_before = transport_utils.get_connection_stats()
+		for _ in range(5):
+			response = transport_utils.send_request("post", self.url + "sendMessage", params={"chat_id": 1})
+			self.assertEqual(response.json(), {"ok": True, "result": True})
+
+		stats = transport_utils.get_connection_stats()
+		self.assertEqual(stats["connects"] - stats_before["connects"], 1)
+		self.assertEqual(stats["requests"] - stats_before["requests"], 5)
+		self.assertIn(5, [connection["requests"] for connection in stats["connections"]])
+		self.assertIs(apihelper._get_req_session(), transport_utils._SESSION)
+
+	def test_timeouts_of_call_classes(self):
+		with patch.object(transport_utils._SESSION, "request") as mock_request:
+			transport_utils.send_request("post", self.url + "editMessageText", timeout=(15, 30))
+			self.assertEqual(mock_request.call_args[1]["timeout"], (3, 7))
+			transport_utils.send_request("post", self.url + "sendDocument", files={"document": b"data"})
+			self.assertEqual(mock_request.call_args[1]["timeout"], transport_utils.DEFAULT_TIMEOUTS["file"])
+			transport_utils.send_request("post", self.url + "getChat", timeout=(15, 30))
+			self.assertEqual(mock_request.call_args[1]["timeout"], transport_utils.DEFAULT_TIMEOUTS["default"])
+			transport_utils.send_request("post", self.url + "getUpdates", timeout=(15, 35))
+			self.assertEqual(mock_request.call_args[1]["timeout"], (15, 35))
+
+
+if __name__ == "__main__":
+	main()
@@ -1,12 +1,19 @@
+import collections
+import threading
+import time
 from unittest import TestCase, main
 from unittest.mock import Mock, patch
 
 from telebot import TeleBot
-from telebot.types import MessageEntity, Message
+from telebot.apihelper import ApiTelegramException
+from telebot.types import CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup, MessageEntity, Message
 
+import db_utils
 import forwarding_utils
 import test_helper
+import threading_utils
 import utils
+from test_helper import TemporaryDbTestCase
 
 
 class GetPostContentTest(TestCase):
@@ -123,5 +130,251 @@ class ReplaceWhitespacesTest(TestCase):
 		self.assertEqual(result, text)
 
 
+class MessageContentCacheTest(TemporaryDbTestCase):
+	def setUp(self):
+		super().setUp()
+		db_utils.initialize_db()
+		self.bot = Mock(spec=TeleBot)
+
+	@staticmethod
+	def create_channel_post(text: str, edit_date: int = None):
+		message_json = {
+			"message_id": 5,
+			"date": 1700000000,
+			"chat": {"id": -100123, "type": "channel", "title": "main"},
+			"text": text,
+			"entities": [{"type": "hashtag", "offset": 0, "length": 5}],
+		}
+		if edit_date:
+			message_json["edit_date"] = edit_date
+		return Message.de_json(message_json)
+
+	def test_stored_message_is_read_without_forwarding(self):
+		utils.store_message_content(self.create_channel_post("#open ticket"))
+
+		message = utils.get_main_message_content_by_id(self.bot, -100123, 5)
+		self.bot.forward_message.assert_not_called()
+		self.assertEqual(message.text, "#open ticket")
+		self.assertEqual(message.entities[0].type, "hashtag")
+		self.assertEqual(message.content_type, "text")
+		self.assertEqual(utils.get_forwarded_from_id(message), -100123)
+		self.assertEqual(message.forward_from_message_id, 5)
+
+	def test_older_content_does_not_replace_newer(self):
+		utils.store_message_content(self.create_channel_post("#open edited", edit_date=1700000100))
+		utils.store_message_content(self.create_channel_post("#open ticket"))
+		self.assertEqual(utils.get_message_content_by_id(self.bot, -100123, 5).text, "#open edited")
+
+		utils.store_message_content(self.create_channel_post("#close edited", edit_date=1700000200))
+		self.assertEqual(utils.get_message_content_by_id(self.bot, -100123, 5).text, "#close edited")
+
+	@patch("config_utils.DUMP_CHAT_ID", -100999)
+	def test_dump_chat_is_used_on_miss(self):
+		forwarded_message = Mock(spec=Message)
+		forwarded_message.message_id = 77
+		self.bot.forward_message.return_value = forwarded_message
+		self.assertIs(utils.get_message_content_by_id(self.bot, -100123, 5), forwarded_message)
+		self.bot.forward_message.assert_called_once_with(chat_id=-100999, from_chat_id=-100123, message_id=5)
+
+		utils.store_message_content(self.create_channel_post("#open ticket"))
+		utils.get_main_message_content_by_id(self.bot, -100123, 5, use_cache=False)
+		self.assertEqual(self.bot.forward_message.call_count, 2)
+
+	def test_deleted_message_is_removed(self):
+		utils.store_message_content(self.create_channel_post("#open ticket"))
+		utils.delete_message(self.bot, -100123, 5)
+		self.assertIsNone(utils.get_stored_message_content(-100123, 5))
+
+	def test_edit_result_is_stored(self):
+		self.bot.edit_message_text.return_value = self.create_channel_post("#open updated", edit_date=1700000100)
+		post_data = self.create_channel_post("#open ticket")
+		utils.edit_message_content(self.bot, post_data, text="#open updated")
+		self.assertEqual(utils.get_stored_message_content(-100123, 5).text, "#open updated")
+
+
+class EditCoalescingTest(TemporaryDbTestCase):
+	def setUp(self):
+		super().setUp()
+		db_utils.initialize_db()
+		self.bot = Mock(spec=TeleBot)
+		self.bot.edit_message_text.return_value = None
+		self.bot.edit_message_reply_markup.return_value = None
+		self.post_data = MessageContentCacheTest.create_channel_post("#open ticket")
+
+	def test_text_and_keyboard_are_sent_in_one_edit(self):
+		keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("CC", callback_data="cc")]])
+		with utils.coalesced_edits():
+			utils.edit_message_content(self.bot, self.post_data, text="#open first", reply_markup=None)
+			utils.edit_message_content(self.bot, self.post_data, text="#open second", reply_markup=None)
+			utils.edit_message_keyboard(self.bot, self.post_data, keyboard)
+			self.bot.edit_message_text.assert_not_called()
+
+		self.bot.edit_message_text.assert_called_once()
+		self.assertEqual(self.bot.edit_message_text.call_args[1]["text"], "#open second")
+		self.assertIs(self.bot.edit_message_text.call_args[1]["reply_markup"], keyboard)
+		self.bot.edit_message_reply_markup.assert_not_called()
+
+	def test_keyboard_only_edit(self):
+		keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("CC", callback_data="cc")]])
+		with utils.coalesced_edits():
+			with utils.coalesced_edits():
+				utils.edit_message_keyboard(self.bot, self.post_data, keyboard)
+			self.bot.edit_message_reply_markup.assert_not_called()
+
+		self.bot.edit_message_reply_markup.assert_called_once_with(chat_id=-100123, message_id=5, reply_markup=keyboard)
+		self.bot.edit_message_text.assert_not_called()
+
+	def test_pending_edit_is_sent_before_copying(self):
+		with utils.coalesced_edits():
+			utils.edit_message_content(self.bot, self.post_data, text="#open edited")
+			utils.copy_message(self.bot, chat_id=-100456, from_chat_id=-100123, message_id=5)
+			self.bot.edit_message_text.assert_called_once()
+		self.bot.edit_message_text.assert_called_once()
+
+	def test_pending_edit_of_deleted_message_is_discarded(self):
+		with utils.coalesced_edits():
+			utils.edit_message_content(self.bot, self.post_data, text="#open edited")
+			utils.delete_message(self.bot, -100123, 5)
+		self.bot.edit_message_text.assert_not_called()
+
+	def test_reading_unknown_message_id(self):
+		self.bot.forward_message.side_effect = ApiTelegramException("forwardMessage", None, {"error_code": 400, "description": "Bad Request"})
+		with utils.coalesced_edits():
+			utils.edit_message_content(self.bot, self.post_data, text="#open edited")
+			with patch("utils.logging"):
+				self.assertIsNone(utils.get_message_content_by_id(self.bot, -100123, None))
+		self.bot.edit_message_text.assert_called_once()
+
+	def test_pending_edits_are_discarded_on_error(self):
+		with self.assertRaises(ValueError):
+			with utils.coalesced_edits():
+				with utils.coalesced_edits():
+					utils.edit_message_content(self.bot, self.post_data, text="#open edited")
+				raise ValueError
+		self.bot.edit_message_text.assert_not_called()
+
+		with utils.coalesced_edits():
+			pass
+		self.bot.edit_message_text.assert_not_called()
+
+
+class NoOpEditSuppressionTest(TemporaryDbTestCase):
+	def setUp(self):
+		super().setUp()
+		db_utils.initialize_db()
+		self.bot = Mock(spec=TeleBot)
+		self.bot.edit_message_text.return_value = None
+		self.bot.edit_message_reply_markup.return_value = None
+		self.post_data = MessageContentCacheTest.create_channel_post("#open ticket")
+		self.keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("CC", callback_data="cc")]])
+
+	def test_same_edit_is_suppressed(self):
+		counters = utils.get_edit_counters()
+		utils.edit_message_content(self.bot, self.post_data, text="#open edited", reply_markup=self.keyboard)
+		utils.edit_message_content(self.bot, self.post_data, text="#open edited", reply_markup=self.keyboard)
+		utils.edit_message_keyboard(self.bot, self.post_data, self.keyboard)
+		self.assertEqual(self.bot.edit_message_text.call_count, 1)
+		self.bot.edit_message_reply_markup.assert_not_called()
+		self.assertEqual(utils.get_edit_counters()["suppressed"], counters["suppressed"] + 2)
+
+		utils.edit_message_content(self.bot, self.post_data, text="#open edited", reply_markup=None)
+		self.assertEqual(self.bot.edit_message_text.call_count, 2)
+
+	def test_user_edit_invalidates_hash(self):
+		utils.edit_message_content(self.bot, self.post_data, text="#open ticket", reply_markup=self.keyboard)
+
+		self.post_data.reply_markup = self.keyboard
+		utils.invalidate_rendered_message(self.post_data)
+		self.assertIsNotNone(db_utils.get_rendered_message(-100123, 5))
+
+		user_edited_post = MessageContentCacheTest.create_channel_post("#open changed by user", edit_date=1700000100)
+		utils.invalidate_rendered_message(user_edited_post)
+		self.assertIsNone(db_utils.get_rendered_message(-100123, 5))
+
+		utils.edit_message_content(self.bot, self.post_data, text="#open ticket", reply_markup=self.keyboard)
+		self.assertEqual(self.bot.edit_message_text.call_count, 2)
+
+
+class GetUpdateTicketKeyTest(TemporaryDbTestCase):
+	def setUp(self):
+		super().setUp()
+		db_utils.initialize_db()
+		db_utils.insert_main_channel(-100123)
+		db_utils.insert_individual_channel(-100123, -100456, "{}", 1)
+		db_utils.insert_copied_message(5, -100123, 40, -100456)
+		db_utils.insert_or_update_discussion_message(5, -100123, 70)
+		db_utils.insert_comment_message(70, 71, -100789, 1)
+
+		threads_patcher = patch("utils._DISCUSSION_THREAD_TICKETS", collections.OrderedDict())
+		threads_patcher.start()
+		self.addCleanup(threads_patcher.stop)
+
+	@staticmethod
+	def create_message(chat_id: int, message_id: int, reply_to_message_id: int = None, message_thread_id: int = None):
+		message_json = {"message_id": message_id, "date": 1700000000, "chat": {"id": chat_id, "type": "channel"}, "text": "text"}
+		if reply_to_message_id:
+			message_json["chat"]["type"] = "supergroup"
+			message_json["message_thread_id"] = message_thread_id
+			message_json["reply_to_message"] = {
+				"message_id": reply_to_message_id, "date": 1700000000, "chat": {"id": chat_id, "type": "supergroup"}, "text": "text"
+			}
+		return Message.de_json(message_json)
+
+	@staticmethod
+	def create_automatic_forward(message_id: int, main_channel_id: int, main_message_id: int):
+		return Message.de_json({
+			"message_id": message_id, "date": 1700000000, "chat": {"id": -100789, "type": "supergroup"}, "text": "text",
+			"is_automatic_forward": True, "forward_from_chat": {"id": main_channel_id, "type": "channel"},
+			"forward_from_message_id": main_message_id,
+		})
+
+	@patch("config_utils.DISCUSSION_CHAT_DATA", {"-100123": -100789})
+	def test_updates_of_one_ticket_have_same_key(self):
+		self.assertEqual(utils.get_update_ticket_key(self.create_message(-100123, 5)), (-100123, 5))
+		self.assertEqual(utils.get_update_ticket_key(self.create_message(-100456, 40)), (-100123, 5))
+		reply = self.create_message(-100789, 72, reply_to_message_id=71, message_thread_id=70)
+		self.assertEqual(utils.get_update_ticket_key(reply), (-100123, 5))
+		self.assertEqual(utils.get_update_ticket_key(self.create_message(-100789, 73, reply_to_message_id=70)), (-100123, 5))
+
+		call = CallbackQuery.de_json({
+			"id": "1", "from": {"id": 1, "is_bot": False, "first_name": "user"}, "chat_instance": "1", "data": "data",
+			"message": self.create_message(-100456, 40).json,
+		})
+		self.assertEqual(utils.get_update_ticket_key(call), (-100123, 5))
+
+	@patch("config_utils.DISCUSSION_CHAT_DATA", {"-100123": -100789})
+	def test_updates_without_ticket(self):
+		self.assertEqual(utils.get_update_ticket_key(self.create_message(-100789, 80)), (-100789, None))
+		self.assertEqual(utils.get_update_ticket_key(self.create_message(-100999, 5)), (-100999, None))
+
+		call = CallbackQuery.de_json({
+			"id": "1", "from": {"id": 1, "is_bot": False, "first_name": "user"}, "chat_instance": "1", "data": "data",
+			"inline_message_id": "1",
+		})
+		self.assertEqual(utils.get_update_ticket_key(call), (None, 1))
+
+	@patch("config_utils.DISCUSSION_CHAT_DATA", {"-100123": -100789})
+	def test_reply_is_queued_with_unhandled_forward(self):
+		release_event = threading.Event()
+		handled_updates = []
+
+		def handle_update(update):
+			release_event.wait(5)
+			handled_updates.append(update.message_id)
+
+		pool = threading_utils.ShardedThreadPool(Mock(exception_handler=None), utils.get_update_ticket_key, num_threads=2)
+		self.addCleanup(pool.close)
+		pool.put(handle_update, self.create_automatic_forward(90, -100123, 6))
+		pool.put(handle_update, self.create_message(-100789, 91, reply_to_message_id=90, message_thread_id=90))
+		pool.put(handle_update, self.create_message(-100789, 92, reply_to_message_id=91, message_thread_id=90))
+		with pool.condition:
+			self.assertEqual(list(pool.shards), [(-100123, 6)])
+
+		release_event.set()
+		while pool.get_stats()["active_shards"]:
+			time.sleep(0.001)
+		self.assertEqual(handled_updates, [90, 91, 92])
+
+
 if __name__ == "__main__":
 	main()
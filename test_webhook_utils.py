@@ -0,0 +1,90 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+from unittest import TestCase, main
+
+import telebot
+
+import webhook_utils
+
+SECRET_TOKEN = "test_secret_token"
+
+RECORDED_UPDATES = [
+	{
+		"update_id": 100,
+		"channel_post": {
+			"message_id": 5, "date": 1700000000, "chat": {"id": -100123, "type": "channel", "title": "main"},
+			"sender_chat": {"id": -100123, "type": "channel", "title": "main"},
+			"text": "#open ticket", "entities": [{"type": "hashtag", "offset": 0, "length": 5}],
+		},
+	},
+	{
+		"update_id": 101,
+		"edited_channel_post": {
+			"message_id": 5, "date": 1700000000, "edit_date": 1700000100, "chat": {"id": -100123, "type": "channel", "title": "main"},
+			"text": "#open edited ticket", "entities": [{"type": "hashtag", "offset": 0, "length": 5}],
+		},
+	},
+	{
+		"update_id": 102,
+		"callback_query": {
+			"id": "1", "from": {"id": 1, "is_bot": False, "first_name": "user"}, "chat_instance": "1", "data": "data",
+			"message": {"message_id": 5, "date": 1700000000, "chat": {"id": -100123, "type": "channel"}, "text": "#open ticket"},
+		},
+	},
+]
+
+
+def post_update(port: int, update: dict, secret_token: str = SECRET_TOKEN, path: str = "/webhook"):
+	request = urllib.request.Request(f"http://127.0.0.1:{port}{path}", data=json.dumps(update).encode(), method="POST",
+									 headers={"Content-Type": "application/json", webhook_utils.SECRET_TOKEN_HEADER: secret_token})
+	try:
+		with urllib.request.urlopen(request, timeout=5) as response:
+			return response.status
+	except urllib.error.HTTPError as E:
+		return E.code
+
+
+class WebhookServerTest(TestCase):
+	def setUp(self):
+		self.bot = telebot.TeleBot("123:abc", threaded=False)
+		self.received_updates = []
+		self.all_updates_received = threading.Event()
+
+		@self.bot.channel_post_handler(content_types=["text"])
+		@self.bot.edited_channel_post_handler(content_types=["text"])
+		def handle_post(post_data: telebot.types.Message):
+			self.received_updates.append(post_data.text)
+
+		@self.bot.callback_query_handler(func=lambda call: True)
+		def handle_callback(call: telebot.types.CallbackQuery):
+			self.received_updates.append(call.data)
+			self.all_updates_received.set()
+
+		self.webhook_server = webhook_utils.WebhookServer(self.bot, "127.0.0.1", 0, "/webhook", SECRET_TOKEN)
+		self.webhook_server.start()
+
+	def tearDown(self):
+		self.webhook_server.stop()
+
+	def test_recorded_updates_are_handled_in_order(self):
+		for update in RECORDED_UPDATES:
+			self.assertEqual(post_update(self.webhook_server.port, update), 200)
+
+		self.assertTrue(self.all_updates_received.wait(5))
+		self.assertEqual(self.received_updates, ["#open ticket", "#open edited ticket", "data"])
+
+	def test_invalid_requests_are_rejected(self):
+		port = self.webhook_server.port
+		self.assertEqual(post_update(port, RECORDED_UPDATES[0], secret_token="wrong_token"), 403)
+		self.assertEqual(post_update(port, RECORDED_UPDATES[0], path="/other"), 404)
+		self.assertEqual(post_update(port, "not an update"), 400)
+
+		self.assertEqual(post_update(port, RECORDED_UPDATES[2]), 200)
+		self.assertTrue(self.all_updates_received.wait(5))
+		self.assertEqual(self.received_updates, ["data"])
+
+
+if __name__ == "__main__":
+	main()
@@ -1,10 +1,402 @@
+import collections
+import contextlib
 import logging
 import threading
 import time
 
 from telebot.apihelper import ApiTelegramException
 
-_TIMEOUT_LOCK = threading.Lock()
+import transport_utils
+
+# limits of the Bot API, requests above them are answered with 429 error
+GLOBAL_REQUESTS_PER_SECOND = 30
+CHAT_REQUESTS_PER_SECOND = 1
+CHAT_REQUESTS_BURST = 3
+GROUP_MESSAGES_PER_MINUTE = 20
+
+# methods that create or change messages, only they count against per chat limits
+_MESSAGE_METHOD_PREFIXES = ("send", "copyMessage", "forwardMessage", "editMessage")
+_NEW_MESSAGE_METHOD_PREFIXES = ("send", "copyMessage", "forwardMessage")
+# long polling request waits for updates on the server, so it isn't limited
+_UNLIMITED_METHODS = ("getUpdates",)
+
+
+class REQUEST_PRIORITIES:
+  INTERACTIVE = "interactive"
+  NORMAL = "normal"
+  BACKGROUND = "background"
+
+
+# share of the global throughput reserved for every priority, unused share is given to other priorities
+PRIORITY_SHARES = {
+  REQUEST_PRIORITIES.INTERACTIVE: 0.6,
+  REQUEST_PRIORITIES.NORMAL: 0.3,
+  REQUEST_PRIORITIES.BACKGROUND: 0.1,
+}
+
+_THREAD_PRIORITY = threading.local()
+
+
+def get_request_priority():
+  return getattr(_THREAD_PRIORITY, "priority", REQUEST_PRIORITIES.NORMAL)
+
+
+def set_request_priority(priority: str):
+  """
+  Sets priority of all Bot API requests sent by the current thread.
+  """
+  _THREAD_PRIORITY.priority = priority
+
+
+@contextlib.contextmanager
+def request_priority(priority: str):
+  previous_priority = get_request_priority()
+  set_request_priority(priority)
+  try:
+    yield
+  finally:
+    set_request_priority(previous_priority)
+
+
+def with_request_priority(priority: str):
+  def decorator(func):
+    def inner_function(*args, **kwargs):
+      with request_priority(priority):
+        return func(*args, **kwargs)
+    return inner_function
+  return decorator
+
+
+class TokenBucket:
+  """
+  Bucket with capacity tokens that is refilled with rate tokens per second.
+  Tokens can be reserved in advance, in this case amount of tokens is negative
+  and next callers wait until reserved tokens are refilled.
+  """
+  def __init__(self, rate: float, capacity: float, now: float):
+    self.rate = rate
+    self.capacity = capacity
+    self.tokens = capacity
+    self.update_time = now
+
+  def get_wait_time(self, now: float):
+    self.tokens = min(self.capacity, self.tokens + (now - self.update_time) * self.rate)
+    self.update_time = now
+    return max(0, (1 - self.tokens) / self.rate)
+
+  def consume(self):
+    self.tokens -= 1
+
+
+class PriorityStats:
+  __slots__ = ("requests", "total_wait_time", "max_wait_time")
+
+  def __init__(self):
+    self.requests = 0
+    self.total_wait_time = 0
+    self.max_wait_time = 0
+
+
+class RequestScheduler:
+  """
+  Hands out tokens of the global bucket to the queues of request priorities.
+  Queues are served with stride scheduling: every priority gets at least its share of the throughput
+  while it has waiting requests, so background requests can't delay interactive ones for long.
+  """
+  def __init__(self, requests_per_second: float = GLOBAL_REQUESTS_PER_SECOND, shares: dict = None):
+    self.shares = shares or PRIORITY_SHARES
+    self.bucket = TokenBucket(requests_per_second, requests_per_second, time.monotonic())
+    self.condition = threading.Condition()
+    self.queues = {priority: collections.deque() for priority in self.shares}
+    self.passes = {priority: 0 for priority in self.shares}
+    self.virtual_time = 0
+    self.stats = {priority: PriorityStats() for priority in self.shares}
+
+  def get_next_priority(self):
+    waiting_priorities = [priority for priority in self.shares if self.queues[priority]]
+    if waiting_priorities:
+      return min(waiting_priorities, key=lambda priority: self.passes[priority])
+
+  def acquire(self, priority: str):
+    """
+    Blocks until the request of the priority can be sent and returns time it waited in the queue.
+    """
+    start_time = time.monotonic()
+    ticket = object()
+    with self.condition:
+      queue = self.queues[priority]
+      if not queue:
+        # idle priority doesn't accumulate credit for the time it didn't send anything
+        self.passes[priority] = max(self.passes[priority], self.virtual_time)
+      queue.append(ticket)
+
+      while True:
+        next_priority = self.get_next_priority()
+        if next_priority != priority or queue[0] is not ticket:
+          self.condition.wait()
+          continue
+
+        token_wait_time = self.bucket.get_wait_time(time.monotonic())
+        if token_wait_time > 0:
+          self.condition.wait(token_wait_time)
+          continue
+
+        self.bucket.consume()
+        queue.popleft()
+        self.virtual_time = self.passes[priority]
+        self.passes[priority] += 1 / self.shares[priority]
+        wait_time = time.monotonic() - start_time
+        stats = self.stats[priority]
+        stats.requests += 1
+        stats.total_wait_time += wait_time
+        stats.max_wait_time = max(stats.max_wait_time, wait_time)
+        self.condition.notify_all()
+        return wait_time
+
+  def get_stats(self):
+    with self.condition:
+      return {
+        priority: {
+          "queue_depth": len(self.queues[priority]),
+          "requests": stats.requests,
+          "total_wait_time": stats.total_wait_time,
+          "max_wait_time": stats.max_wait_time,
+        }
+        for priority, stats in self.stats.items()
+      }
+
+
+class RateLimiter:
+  """
+  Limits requests to the Bot API with global, per chat and per group chat token buckets.
+  Global tokens are distributed between request priorities by the scheduler, tokens of the chat are reserved
+  and every caller waits only for its own chat, so requests to different chats are sent concurrently.
+  After 429 error requests to the chat wait until retry_after is passed.
+  """
+  def __init__(self, requests_per_second: float = GLOBAL_REQUESTS_PER_SECOND,
+               chat_requests_per_second: float = CHAT_REQUESTS_PER_SECOND, chat_requests_burst: int = CHAT_REQUESTS_BURST,
+               group_messages_per_minute: float = GROUP_MESSAGES_PER_MINUTE):
+    self.chat_requests_per_second = chat_requests_per_second
+    self.chat_requests_burst = chat_requests_burst
+    self.group_messages_per_minute = group_messages_per_minute
+    self.lock = threading.Lock()
+    self.scheduler = RequestScheduler(requests_per_second)
+    self.chat_buckets = {}
+    self.group_buckets = {}
+    self.retry_times = {}
+
+  def add_group_chat(self, chat_id, now: float = None):
+    now = time.monotonic() if now is None else now
+    chat_id = str(chat_id)
+    with self.lock:
+      if chat_id not in self.group_buckets:
+        rate = self.group_messages_per_minute / 60
+        self.group_buckets[chat_id] = TokenBucket(rate, self.group_messages_per_minute, now)
+
+  def set_retry_after(self, chat_id, retry_after: float, now: float = None):
+    now = time.monotonic() if now is None else now
+    chat_id = str(chat_id) if chat_id is not None else None
+    with self.lock:
+      self.retry_times[chat_id] = max(self.retry_times.get(chat_id, 0), now + retry_after)
+
+  def reserve(self, method_name: str, chat_id=None, now: float = None):
+    """
+    Reserves tokens of the chat for the request and returns the time the caller should wait before sending it.
+    """
+    if method_name in _UNLIMITED_METHODS:
+      return 0
+
+    now = time.monotonic() if now is None else now
+    chat_id = str(chat_id) if chat_id is not None else None
+    with self.lock:
+      buckets = []
+      if chat_id is not None and method_name.startswith(_MESSAGE_METHOD_PREFIXES):
+        if chat_id not in self.chat_buckets:
+          self.chat_buckets[chat_id] = TokenBucket(self.chat_requests_per_second, self.chat_requests_burst, now)
+        buckets.append(self.chat_buckets[chat_id])
+        if chat_id in self.group_buckets and method_name.startswith(_NEW_MESSAGE_METHOD_PREFIXES):
+          buckets.append(self.group_buckets[chat_id])
+
+      wait_time = max([bucket.get_wait_time(now) for bucket in buckets] + [0])
+      retry_time = max(self.retry_times.get(chat_id, 0), self.retry_times.get(None, 0))
+      wait_time = max(wait_time, retry_time - now)
+      for bucket in buckets:
+        bucket.consume()
+      return wait_time
+
+  def send_request(self, method, url, **kwargs):
+    """
+    Request sender for apihelper.CUSTOM_REQUEST_SENDER.
+    """
+    method_name = url.rsplit("/", 1)[-1]
+    params = kwargs.get("params") or {}
+    chat_id = params.get("chat_id")
+    if method_name not in _UNLIMITED_METHODS:
+      self.scheduler.acquire(get_request_priority())
+    wait_time = self.reserve(method_name, chat_id)
+    if wait_time > 0:
+      time.sleep(wait_time)
+
+    result = transport_utils.send_request(method, url, **kwargs)
+    if result.status_code == 429:
+      self.handle_too_many_requests(chat_id, result)
+    elif chat_id is not None and method_name.startswith(_NEW_MESSAGE_METHOD_PREFIXES):
+      self.detect_group_chat(chat_id, result)
+    return result
+
+  def handle_too_many_requests(self, chat_id, result):
+    try:
+      retry_after = result.json()["parameters"]["retry_after"]
+    except (ValueError, KeyError, TypeError):
+      return
+    logging.warning(f"Too many requests to {chat_id}, retry in: {retry_after}")
+    self.set_retry_after(chat_id, retry_after)
+
+  def detect_group_chat(self, chat_id, result):
+    if str(chat_id) in self.group_buckets:
+      return
+    try:
+      chat_type = result.json()["result"]["chat"]["type"]
+    except (ValueError, KeyError, TypeError):
+      return
+    if chat_type in ["group", "supergroup"]:
+      self.add_group_chat(chat_id)
+
+
+RATE_LIMITER = RateLimiter()
+
+
+class ShardStats:
+  __slots__ = ("updates", "total_wait_time", "max_wait_time", "total_handling_time", "max_handling_time")
+
+  def __init__(self):
+    self.updates = 0
+    self.total_wait_time = 0
+    self.max_wait_time = 0
+    self.total_handling_time = 0
+    self.max_handling_time = 0
+
+
+class ShardedThreadPool:
+  """
+  Worker pool for telebot handlers. Every task is put into the shard of its key, tasks of one shard
+  are handled one by one in the order they were received, tasks of different shards are handled in parallel.
+  Stats are collected per the first element of the key, so their amount doesn't grow with the amount of shards.
+  Implements interface of telebot.util.ThreadPool that is used by the polling.
+  """
+  def __init__(self, telebot, get_shard_key, num_threads: int = 8):
+    self.telebot = telebot
+    self.get_shard_key = get_shard_key
+    self.condition = threading.Condition()
+    # key is in shards while its tasks are queued or handled, key of the handled shard isn't in ready_keys
+    self.shards = {}
+    self.ready_keys = collections.deque()
+    self.queued_tasks = 0
+    self.max_queued_tasks = 0
+    self.stats = {}
+    self.running = True
+
+    self.exception_event = threading.Event()
+    self.exception_info = None
+
+    self.workers = [threading.Thread(target=self.run_worker, daemon=True) for _ in range(num_threads)]
+    for worker in self.workers:
+      worker.start()
+
+  def put(self, func, *args, **kwargs):
+    # the first argument of telebot handler is the update
+    try:
+      key = self.get_shard_key(args[0])
+    except Exception as E:
+      logging.error(f"Can't get shard key of the update, error: {E}")
+      key = (None, None)
+
+    with self.condition:
+      if key in self.shards:
+        self.shards[key].append((func, args, kwargs, time.monotonic()))
+      else:
+        self.shards[key] = collections.deque([(func, args, kwargs, time.monotonic())])
+        self.ready_keys.append(key)
+      self.queued_tasks += 1
+      self.max_queued_tasks = max(self.max_queued_tasks, self.queued_tasks)
+      self.condition.notify()
+
+  def run_worker(self):
+    while True:
+      with self.condition:
+        while self.running and not self.ready_keys:
+          self.condition.wait()
+        if not self.running:
+          return
+        key = self.ready_keys.popleft()
+        func, args, kwargs, put_time = self.shards[key].popleft()
+        self.queued_tasks -= 1
+
+      start_time = time.monotonic()
+      try:
+        func(*args, **kwargs)
+      except Exception as E:
+        self.on_exception(E)
+      finally:
+        end_time = time.monotonic()
+        with self.condition:
+          self.add_stats(key, start_time - put_time, end_time - start_time)
+          if self.shards[key]:
+            self.ready_keys.append(key)
+            self.condition.notify()
+          else:
+            del self.shards[key]
+
+  def add_stats(self, key, wait_time: float, handling_time: float):
+    stats_key = key[0] if isinstance(key, tuple) else key
+    stats = self.stats.setdefault(stats_key, ShardStats())
+    stats.updates += 1
+    stats.total_wait_time += wait_time
+    stats.max_wait_time = max(stats.max_wait_time, wait_time)
+    stats.total_handling_time += handling_time
+    stats.max_handling_time = max(stats.max_handling_time, handling_time)
+
+  def on_exception(self, exception: Exception):
+    if self.telebot.exception_handler is not None:
+      handled = self.telebot.exception_handler.handle(exception)
+    else:
+      handled = False
+    if not handled:
+      self.exception_info = exception
+      self.exception_event.set()
+
+  def raise_exceptions(self):
+    if self.exception_event.is_set():
+      raise self.exception_info
+
+  def clear_exceptions(self):
+    self.exception_event.clear()
+
+  def close(self):
+    with self.condition:
+      self.running = False
+      self.condition.notify_all()
+    for worker in self.workers:
+      if worker != threading.current_thread():
+        worker.join()
+
+  def get_stats(self):
+    with self.condition:
+      return {
+        "queued_updates": self.queued_tasks,
+        "max_queued_updates": self.max_queued_tasks,
+        "active_shards": len(self.shards),
+        "shards": {
+          stats_key: {
+            "updates": stats.updates,
+            "total_wait_time": stats.total_wait_time,
+            "max_wait_time": stats.max_wait_time,
+            "total_handling_time": stats.total_handling_time,
+            "max_handling_time": stats.max_handling_time,
+          }
+          for stats_key, stats in self.stats.items()
+        },
+      }
 
 
 def get_timeout_retry(e: ApiTelegramException):
@@ -23,17 +415,17 @@ def get_timeout_retry(e: ApiTelegramException):
 
 
 def timeout_error_lock(func):
+  # requests aren't serialized anymore, RATE_LIMITER delays only requests to the chat that received 429 error
   def inner_function(*args, **kwargs):
-    with _TIMEOUT_LOCK:
-      while True:
-        try:
-          return func(*args, **kwargs)
-        except ApiTelegramException as E:
-          if E.error_code == 429:
-            timeout = get_timeout_retry(E)
-            logging.exception(
-                f"Too many requests error in {func.__name__}, retry in: {timeout}")
-            time.sleep(timeout)
-            continue
-          raise E
+    while True:
+      try:
+        return func(*args, **kwargs)
+      except ApiTelegramException as E:
+        if E.error_code == 429:
+          timeout = get_timeout_retry(E)
+          logging.exception(
+              f"Too many requests error in {func.__name__}, retry in: {timeout}")
+          time.sleep(timeout)
+          continue
+        raise E
   return inner_function
@@ -0,0 +1,130 @@
+import threading
+import time
+import weakref
+
+import requests
+from requests.adapters import HTTPAdapter
+from telebot import apihelper
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+# (connect timeout, read timeout) in seconds for every class of Bot API methods
+DEFAULT_TIMEOUTS = {
+	"message": (5, 20),
+	"file": (10, 120),
+	"default": (5, 30),
+}
+
+_MESSAGE_METHOD_PREFIXES = ("send", "copyMessage", "forwardMessage", "editMessage", "deleteMessage")
+_FILE_METHODS = ("getFile",)
+# long polling request has its own timeout that is greater than the polling timeout
+_LONG_POLLING_METHODS = ("getUpdates",)
+
+_SESSION: requests.Session = None
+_TIMEOUTS = dict(DEFAULT_TIMEOUTS)
+
+_STATS_LOCK = threading.Lock()
+# connections are removed from the set when the pool drops them
+_POOLED_CONNECTIONS = weakref.WeakSet()
+_TOTAL_STATS = {"connects": 0, "requests": 0}
+
+
+class ConnectionStatsMixin:
+	"""
+	Counts requests sent through the connection and times it was connected, every connect is a new TCP and TLS handshake.
+	"""
+	def __init__(self, *args, **kwargs):
+		super().__init__(*args, **kwargs)
+		self.requests_count = 0
+		self.connects_count = 0
+		self.created_time = time.monotonic()
+		with _STATS_LOCK:
+			_POOLED_CONNECTIONS.add(self)
+
+	def connect(self):
+		with _STATS_LOCK:
+			self.connects_count += 1
+			_TOTAL_STATS["connects"] += 1
+		return super().connect()
+
+	def request(self, *args, **kwargs):
+		with _STATS_LOCK:
+			self.requests_count += 1
+			_TOTAL_STATS["requests"] += 1
+		return super().request(*args, **kwargs)
+
+
+class StatsHTTPConnection(ConnectionStatsMixin, HTTPConnection):
+	pass
+
+
+class StatsHTTPSConnection(ConnectionStatsMixin, HTTPSConnection):
+	pass
+
+
+class StatsHTTPConnectionPool(HTTPConnectionPool):
+	ConnectionCls = StatsHTTPConnection
+
+
+class StatsHTTPSConnectionPool(HTTPSConnectionPool):
+	ConnectionCls = StatsHTTPSConnection
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+	def init_poolmanager(self, *args, **kwargs):
+		super().init_poolmanager(*args, **kwargs)
+		self.poolmanager.pool_classes_by_scheme = {"http": StatsHTTPConnectionPool, "https": StatsHTTPSConnectionPool}
+
+
+def create_session(pool_size: int):
+	session = requests.Session()
+	# all threads share one pool, so the pool should have a connection for every thread that sends requests
+	adapter = PooledHTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+	session.mount("http://", adapter)
+	session.mount("https://", adapter)
+	return session
+
+
+def install_session(pool_size: int, timeouts: dict = None):
+	"""
+	Replaces sessions that apihelper creates for every thread with one shared session with the pool of pool_size
+	keep-alive connections, so requests from different threads don't open new connections.
+	"""
+	global _SESSION
+	_SESSION = create_session(pool_size)
+	apihelper.session = _SESSION
+	# apihelper caches the session per thread, the calling thread could have cached the previous one
+	apihelper._get_req_session(reset=True)
+	_TIMEOUTS.update({call_class: tuple(timeout) for call_class, timeout in (timeouts or {}).items()})
+
+
+def get_call_class(method_name: str, files=None):
+	if files or method_name in _FILE_METHODS:
+		return "file"
+	if method_name.startswith(_MESSAGE_METHOD_PREFIXES):
+		return "message"
+	return "default"
+
+
+def send_request(method, url, **kwargs):
+	method_name = url.rsplit("/", 1)[-1]
+	if method_name not in _LONG_POLLING_METHODS:
+		kwargs["timeout"] = _TIMEOUTS.get(get_call_class(method_name, kwargs.get("files")), _TIMEOUTS["default"])
+
+	session = _SESSION or apihelper._get_req_session()
+	return session.request(method, url, **kwargs)
+
+
+def get_connection_stats():
+	now = time.monotonic()
+	with _STATS_LOCK:
+		connections = [
+			{"requests": connection.requests_count, "connects": connection.connects_count, "age": now - connection.created_time}
+			for connection in _POOLED_CONNECTIONS if connection.requests_count
+		]
+		return {
+			"connects": _TOTAL_STATS["connects"],
+			"requests": _TOTAL_STATS["requests"],
+			"reused_requests": max(_TOTAL_STATS["requests"] - _TOTAL_STATS["connects"], 0),
+			"connections": sorted(connections, key=lambda connection: connection["requests"], reverse=True),
+		}
@@ -1,4 +1,9 @@
+import collections
+import contextlib
+import hashlib
+import json
 import logging
+import threading
 from typing import List
 import time
 import datetime
@@ -18,6 +23,19 @@ MSG_CANT_BE_DELETED_ERROR = "message can't be deleted"
 MSG_NOT_FOUND_ERROR = "message to delete not found"
 KICKED_FROM_CHANNEL_ERROR = "Forbidden: bot was kicked from the channel chat"
 
+# pending edits of the current update, keyed by (chat_id, message_id)
+_EDIT_COALESCING = threading.local()
+
+# tickets of the discussion threads keyed by (discussion_chat_id, thread_id), filled when the automatic forward
+# is put into the worker queue, so replies to the forward that wasn't handled yet get the key of its ticket
+_DISCUSSION_THREAD_TICKETS = collections.OrderedDict()
+_DISCUSSION_THREAD_TICKETS_LOCK = threading.Lock()
+MAX_DISCUSSION_THREAD_TICKETS = 10000
+
+# sent edits and edits skipped because the message already has the same content and keyboard
+EDIT_COUNTERS = collections.Counter()
+_EDIT_COUNTERS_LOCK = threading.Lock()
+
 
 def align_entities_to_utf8(text: str, entities: List[telebot.types.MessageEntity]):
 	if not entities:
@@ -123,32 +141,166 @@ def set_post_content(post_data: telebot.types.Message, text: str, entities: List
 		post_data.caption_entities = entities
 
 
-@threading_utils.timeout_error_lock
-def edit_message_content(bot: telebot.TeleBot, post_data: telebot.types.Message, **kwargs):
-	if "chat_id" not in kwargs:
-		kwargs["chat_id"] = post_data.chat.id
-	if "message_id" not in kwargs:
-		kwargs["message_id"] = post_data.message_id
-	if "text" not in kwargs:
-		kwargs["text"] = post_data.text if post_data.text else post_data.caption
-	if "entities" not in kwargs:
-		kwargs["entities"] = post_data.entities if post_data.entities else post_data.caption_entities
+def is_coalescing_edits():
+	return getattr(_EDIT_COALESCING, "depth", 0) > 0
+
+
+@contextlib.contextmanager
+def coalesced_edits():
+	"""
+	Edits of the same message made inside this block are merged and sent as one request when the block ends,
+	so new text, entities and keyboard of the message are sent in a single editMessageText/editMessageCaption.
+	If the block raises an exception, pending edits are discarded, because they can be left from an unfinished update.
+	"""
+	if not is_coalescing_edits():
+		_EDIT_COALESCING.pending_edits = {}
+		_EDIT_COALESCING.depth = 0
+	_EDIT_COALESCING.depth += 1
+	try:
+		yield
+	except BaseException:
+		_EDIT_COALESCING.depth -= 1
+		if _EDIT_COALESCING.depth == 0:
+			_EDIT_COALESCING.pending_edits.clear()
+		raise
+	_EDIT_COALESCING.depth -= 1
+	if _EDIT_COALESCING.depth == 0:
+		flush_pending_edits()
+
+
+def add_pending_edit(bot: telebot.TeleBot, chat_id: int, message_id: int, **changes):
+	key = (int(chat_id), int(message_id))
+	pending_edit = _EDIT_COALESCING.pending_edits.setdefault(key, {"bot": bot})
+	pending_edit.update(changes)
+
+
+def flush_pending_edits(chat_id: int = None, message_id: int = None):
+	"""
+	Sends pending edits of the message or all pending edits of the current thread if message isn't specified.
+	Must be called before the message is read, copied or deleted, because the message doesn't contain pending changes yet.
+	"""
+	pending_edits = getattr(_EDIT_COALESCING, "pending_edits", None)
+	if not pending_edits:
+		return
+
+	if chat_id is None:
+		keys = list(pending_edits)
+	elif message_id is None:
+		# e.g. the newest copied message of the empty subchannel, it can't have pending edits
+		return
+	else:
+		keys = [(int(chat_id), int(message_id))]
+
+	for key in keys:
+		pending_edit = pending_edits.pop(key, None)
+		if pending_edit:
+			send_edit(chat_id=key[0], message_id=key[1], **pending_edit)
+
+
+def discard_pending_edits(chat_id: int, message_id: int):
+	pending_edits = getattr(_EDIT_COALESCING, "pending_edits", None)
+	if pending_edits:
+		pending_edits.pop((int(chat_id), int(message_id)), None)
+
+
+def get_content_hash(text: str, entities: List[telebot.types.MessageEntity]):
+	entities_data = [
+		[entity.type, entity.offset, entity.length, entity.url, entity.user.id if entity.user else None, entity.language]
+		for entity in entities or []
+	]
+	return hashlib.sha1(json.dumps([text or "", entities_data]).encode()).hexdigest()
+
+
+def get_keyboard_hash(keyboard: telebot.types.InlineKeyboardMarkup):
+	keyboard_json = keyboard.to_json() if keyboard else ""
+	return hashlib.sha1(keyboard_json.encode()).hexdigest()
+
+
+def increment_edit_counter(name: str):
+	with _EDIT_COUNTERS_LOCK:
+		EDIT_COUNTERS[name] += 1
+
 
-	kwargs["entities"] = align_entities_to_utf16(kwargs["text"], kwargs["entities"])
+def get_edit_counters():
+	with _EDIT_COUNTERS_LOCK:
+		return {"sent": EDIT_COUNTERS["sent"], "suppressed": EDIT_COUNTERS["suppressed"]}
 
+
+def invalidate_rendered_message(post_data: telebot.types.Message, check_keyboard: bool = True):
+	"""
+	Forgets rendered content of the message if it was changed by the user, so the next edit isn't skipped.
+	Keyboard isn't checked for the messages forwarded to the dump chat, because forwarded message has no keyboard.
+	"""
+	chat_id = post_data.chat.id
+	message_id = post_data.message_id
+	rendered_message = db_utils.get_rendered_message(chat_id, message_id)
+	if not rendered_message:
+		return
+
+	text = post_data.text if post_data.text is not None else post_data.caption
+	entities = post_data.entities if post_data.text is not None else post_data.caption_entities
+	content_hash = get_content_hash(text, entities)
+	keyboard_hash = get_keyboard_hash(post_data.reply_markup) if check_keyboard else rendered_message[1]
+	if rendered_message != (content_hash, keyboard_hash):
+		db_utils.delete_rendered_message(chat_id, message_id)
+
+
+@threading_utils.timeout_error_lock
+def send_edit(bot: telebot.TeleBot, chat_id: int, message_id: int, **edit):
+	"""
+	Sends the edit of the message text and keyboard or only the keyboard if edit doesn't contain text.
+	Edit is skipped if the message already has the same content and keyboard.
+	"""
+	content_hash = get_content_hash(edit["text"], edit["entities"]) if "text" in edit else None
+	keyboard_hash = get_keyboard_hash(edit.get("reply_markup"))
+	rendered_message = db_utils.get_rendered_message(chat_id, message_id)
+	if rendered_message and rendered_message[1] == keyboard_hash and content_hash in [None, rendered_message[0]]:
+		increment_edit_counter("suppressed")
+		return
+
+	kwargs = {"chat_id": chat_id, "message_id": message_id, "reply_markup": edit.get("reply_markup")}
 	try:
-		if post_data.text is not None:
-			bot.edit_message_text(**kwargs)
+		increment_edit_counter("sent")
+		if "text" not in edit:
+			edited_message = bot.edit_message_reply_markup(**kwargs)
+		elif edit["is_caption"]:
+			edited_message = bot.edit_message_caption(caption=edit["text"], caption_entities=edit["entities"], **kwargs)
 		else:
-			kwargs["caption"] = kwargs.pop("text")
-			kwargs["caption_entities"] = kwargs.pop("entities")
-			bot.edit_message_caption(**kwargs)
+			edited_message = bot.edit_message_text(text=edit["text"], entities=edit["entities"], **kwargs)
+		store_message_content(edited_message)
 	except ApiTelegramException as E:
 		if E.error_code == 429:
 			raise E
-		if E.description == SAME_MSG_CONTENT_ERROR:
+		if E.description != SAME_MSG_CONTENT_ERROR:
+			logging.info(f"Exception during editing message {[message_id, chat_id]} - {E}")
 			return
 
+	db_utils.insert_or_update_rendered_message(chat_id, message_id, content_hash, keyboard_hash)
+
+
+def edit_message_content(bot: telebot.TeleBot, post_data: telebot.types.Message, **kwargs):
+	chat_id = kwargs.get("chat_id", post_data.chat.id)
+	message_id = kwargs.get("message_id", post_data.message_id)
+	text = kwargs["text"] if "text" in kwargs else post_data.text if post_data.text else post_data.caption
+	if "entities" in kwargs:
+		entities = kwargs["entities"]
+	else:
+		entities = post_data.entities if post_data.entities else post_data.caption_entities
+
+	edit = {
+		"text": text,
+		"entities": align_entities_to_utf16(text, entities),
+		"is_caption": post_data.text is None,
+		# edit without reply_markup removes the keyboard, so keyboard of the previous pending edits must not be kept
+		"reply_markup": kwargs.get("reply_markup"),
+	}
+
+	if is_coalescing_edits():
+		add_pending_edit(bot, chat_id, message_id, **edit)
+		return
+
+	send_edit(bot, chat_id, message_id, **edit)
+
 
 def is_post_data_equal(post_data1: telebot.types.Message, post_data2: telebot.types.Message):
 	text1, entities1 = get_post_content(post_data1)
@@ -222,14 +374,11 @@ def edit_message_keyboard(bot: telebot.TeleBot, post_data: telebot.types.Message
 			keyboard.keyboard.append([telebot.types.InlineKeyboardButton(" ", callback_data="_")])
 			keyboard.keyboard.append([settings_button])
 
-	try:
-		bot.edit_message_reply_markup(chat_id=chat_id, message_id=message_id, reply_markup=keyboard)
-	except ApiTelegramException as E:
-		if E.error_code == 429:
-			raise E
-		if E.description == SAME_MSG_CONTENT_ERROR:
-			return
-		logging.info(f"Exception during adding keyboard - {E}")
+	if is_coalescing_edits():
+		add_pending_edit(bot, chat_id, message_id, reply_markup=keyboard)
+		return
+
+	send_edit(bot, chat_id, message_id, reply_markup=keyboard)
 
 
 def cut_entity_from_post(text: str, entities: List[telebot.types.MessageEntity], entity_index: int):
@@ -263,16 +412,82 @@ def get_key_by_value(d: dict, value: object):
 	return key_list[position]
 
 
+def remember_discussion_thread(discussion_chat_id: int, thread_id: int, ticket_key: tuple):
+	with _DISCUSSION_THREAD_TICKETS_LOCK:
+		_DISCUSSION_THREAD_TICKETS[(discussion_chat_id, thread_id)] = ticket_key
+		_DISCUSSION_THREAD_TICKETS.move_to_end((discussion_chat_id, thread_id))
+		if len(_DISCUSSION_THREAD_TICKETS) > MAX_DISCUSSION_THREAD_TICKETS:
+			_DISCUSSION_THREAD_TICKETS.popitem(last=False)
+
+
+def get_discussion_thread_ticket(discussion_chat_id: int, thread_id: int):
+	with _DISCUSSION_THREAD_TICKETS_LOCK:
+		return _DISCUSSION_THREAD_TICKETS.get((discussion_chat_id, thread_id))
+
+
+def get_update_ticket_key(update):
+	"""
+	Returns (main_channel_id, main_message_id) of the ticket the update belongs to,
+	updates that don't belong to any ticket return (chat_id, None).
+	Callbacks without a message return (None, user_id), so they are handled in parallel but counted in one stats entry.
+	Key is computed when the update is put into the queue, so it doesn't use data saved by handlers of previous updates,
+	they may still be in the queue.
+	"""
+	if isinstance(update, telebot.types.CallbackQuery):
+		if update.message is None:
+			return None, update.from_user.id
+		update = update.message
+	if not isinstance(update, telebot.types.Message):
+		chat = getattr(update, "chat", None)
+		return (chat.id if chat else None), None
+
+	chat_id = update.chat.id
+	if db_utils.is_main_channel_exists(chat_id):
+		return chat_id, update.message_id
+
+	if update.is_automatic_forward and update.forward_from_chat:
+		ticket_key = (update.forward_from_chat.id, update.forward_from_message_id)
+		remember_discussion_thread(chat_id, update.message_id, ticket_key)
+		return ticket_key
+
+	if db_utils.is_individual_channel_exists(chat_id):
+		main_message_data = db_utils.get_main_message_from_copied(update.message_id, chat_id)
+		if main_message_data:
+			main_message_id, main_channel_id = main_message_data
+			return main_channel_id, main_message_id
+
+	main_channel_id = get_key_by_value(config_utils.DISCUSSION_CHAT_DATA, chat_id)
+	thread_id = update.message_thread_id
+	if thread_id is None and update.reply_to_message:
+		thread_id = update.reply_to_message.message_thread_id or update.reply_to_message.message_id
+	if main_channel_id and thread_id:
+		ticket_key = get_discussion_thread_ticket(chat_id, thread_id)
+		if ticket_key:
+			return ticket_key
+		# forwards that weren't put into the queue by this process were handled before it started
+		main_message_id = db_utils.get_main_from_discussion_message(thread_id, int(main_channel_id))
+		if main_message_id:
+			return int(main_channel_id), main_message_id
+
+	return chat_id, None
+
+
 @threading_utils.timeout_error_lock
 def delete_message(bot: telebot.TeleBot, chat_id: int, message_id: int):
+	discard_pending_edits(chat_id, message_id)
+	db_utils.delete_rendered_message(chat_id, message_id)
 	try:
-		return bot.delete_message(chat_id=chat_id, message_id=message_id)
+		result = bot.delete_message(chat_id=chat_id, message_id=message_id)
 	except ApiTelegramException as E:
 		if E.description.endswith(MSG_NOT_FOUND_ERROR):
+			db_utils.delete_message_content(chat_id, message_id)
 			return True
 		else:
 			raise E
 
+	db_utils.delete_message_content(chat_id, message_id)
+	return result
+
 
 def get_last_message(bot: telebot.TeleBot, channel_id: int):
 	last_message_id = db_utils.get_last_message_id(channel_id)
@@ -321,8 +536,58 @@ def add_comment_to_ticket(bot: telebot.TeleBot, post_data: telebot.types.Message
 		db_utils.set_ticket_update_time(main_message_id, main_channel_id, int(time.time()))
 
 
+def store_message_content(message: telebot.types.Message):
+	"""
+	Saves message received in the update or returned by the Bot API, so its content can be read without forwarding.
+	"""
+	message_json = getattr(message, "json", None)
+	if isinstance(message_json, str):
+		message_json = json.loads(message_json)
+	if not isinstance(message_json, dict):
+		return
+
+	db_utils.insert_or_update_message_content(message_json["chat"]["id"], message_json["message_id"], message.content_type,
+											  message_json.get("edit_date"), json.dumps(message_json))
+
+
+def get_stored_message_content(chat_id: int, message_id: int):
+	message_json = db_utils.get_message_content(chat_id, message_id)
+	if not message_json:
+		return
+
+	return get_forwarded_message_from_json(json.loads(message_json))
+
+
+def get_forwarded_message_from_json(message_json: dict):
+	"""
+	Creates message in the same form as the message forwarded to the dump chat, message_json is modified.
+	"""
+	message_json.pop("reply_markup", None)
+	if "forward_date" not in message_json:
+		message_json["forward_date"] = message_json["date"]
+		if message_json["chat"]["type"] == "channel":
+			message_json["forward_from_chat"] = message_json["chat"]
+			message_json["forward_from_message_id"] = message_json["message_id"]
+		elif "sender_chat" in message_json:
+			message_json["forward_from_chat"] = message_json["sender_chat"]
+		elif "from" in message_json:
+			message_json["forward_from"] = message_json["from"]
+
+	return telebot.types.Message.de_json(message_json)
+
+
+def get_message_content_by_id(bot: telebot.TeleBot, chat_id: int, message_id: int, use_cache: bool = True):
+	flush_pending_edits(chat_id, message_id)
+	if use_cache:
+		stored_message = get_stored_message_content(chat_id, message_id)
+		if stored_message:
+			return stored_message
+
+	return forward_message_to_dump_chat(bot, chat_id, message_id)
+
+
 @threading_utils.timeout_error_lock
-def get_message_content_by_id(bot: telebot.TeleBot, chat_id: int, message_id: int):
+def forward_message_to_dump_chat(bot: telebot.TeleBot, chat_id: int, message_id: int):
 	try:
 		forwarded_message = bot.forward_message(chat_id=config_utils.DUMP_CHAT_ID, from_chat_id=chat_id,
 												message_id=message_id)
@@ -338,34 +603,16 @@ def get_message_content_by_id(bot: telebot.TeleBot, chat_id: int, message_id: in
 
 @threading_utils.timeout_error_lock
 def copy_message(bot: telebot.TeleBot, **kwargs):
+	flush_pending_edits(kwargs["from_chat_id"], kwargs["message_id"])
 	return bot.copy_message(**kwargs)
 
 
 @threading_utils.timeout_error_lock
 def remove_keyboard(bot: telebot.TeleBot, chat_id: int, message_id: int):
-	bot.edit_message_reply_markup(chat_id=chat_id, message_id=message_id, reply_markup=None)
-
-
-@threading_utils.timeout_error_lock
-def get_main_message_content_by_id(bot: telebot.TeleBot, chat_id: int, message_id: int):
-	try:
-		forwarded_message = bot.forward_message(chat_id=config_utils.DUMP_CHAT_ID, from_chat_id=chat_id,
-												message_id=message_id)
-		bot.delete_message(chat_id=config_utils.DUMP_CHAT_ID, message_id=forwarded_message.message_id)
-	except ApiTelegramException as E:
-		if E.error_code == 429:
-			raise E
-		elif E.description == "Bad Request: message to forward not found":
-			raise E
-		elif E.description == "Bad Request: MESSAGE_ID_INVALID":
-			# for some reason telegram throws this error if after deleting a message
-			# no other actions were performed in this channel
-			# instead of regular "message to forward not found" error
-			raise E
-		logging.error(f"Error during getting message content - {E}")
-		return
-
-	return forwarded_message
+	flush_pending_edits(chat_id, message_id)
+	db_utils.delete_rendered_message(chat_id, message_id)
+	edited_message = bot.edit_message_reply_markup(chat_id=chat_id, message_id=message_id, reply_markup=None)
+	store_message_content(edited_message)
 
 
 def check_content_type(bot: telebot.TeleBot, message: telebot.types.Message):
@@ -385,8 +632,18 @@ def parse_datetime(datetime_str, template_str):
 		return
 
 
+def get_main_message_content_by_id(bot: telebot.TeleBot, chat_id: int, message_id: int, use_cache: bool = True):
+	flush_pending_edits(chat_id, message_id)
+	if use_cache:
+		stored_message = get_stored_message_content(chat_id, message_id)
+		if stored_message:
+			return stored_message
+
+	return forward_main_message_to_dump_chat(bot, chat_id, message_id)
+
+
 @threading_utils.timeout_error_lock
-def get_main_message_content_by_id(bot: telebot.TeleBot, chat_id: int, message_id: int):
+def forward_main_message_to_dump_chat(bot: telebot.TeleBot, chat_id: int, message_id: int):
 	try:
 		forwarded_message = bot.forward_message(chat_id=config_utils.DUMP_CHAT_ID, from_chat_id=chat_id,
 												message_id=message_id)
@@ -409,8 +666,11 @@ def get_main_message_content_by_id(bot: telebot.TeleBot, chat_id: int, message_i
 
 @threading_utils.timeout_error_lock
 def mark_message_for_deletion(bot: telebot.TeleBot, chat_id: int, message_id: int):
+	discard_pending_edits(chat_id, message_id)
+	db_utils.delete_rendered_message(chat_id, message_id)
 	try:
-		bot.edit_message_text(text=config_utils.TO_DELETE_MSG_TEXT, chat_id=chat_id, message_id=message_id)
+		edited_message = bot.edit_message_text(text=config_utils.TO_DELETE_MSG_TEXT, chat_id=chat_id, message_id=message_id)
+		store_message_content(edited_message)
 	except ApiTelegramException as E:
 		if E.error_code == 429:
 			raise E
@@ -0,0 +1,117 @@
+import hmac
+import http.server
+import json
+import logging
+import queue
+import secrets
+import threading
+import urllib.parse
+
+import telebot
+
+import config_utils
+
+SECRET_TOKEN_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+	"""
+	HTTP server that receives updates from Telegram. Every update is answered as soon as it's parsed,
+	updates are passed to the bot handlers by one dispatcher thread in the order they were received.
+	"""
+	def __init__(self, bot: telebot.TeleBot, host: str, port: int, path: str, secret_token: str):
+		self.bot = bot
+		self.path = path
+		self.secret_token = secret_token
+		self.updates = queue.Queue()
+		self.http_server = http.server.ThreadingHTTPServer((host, port), self.create_request_handler())
+		self.http_server.daemon_threads = True
+		self.dispatcher_thread = threading.Thread(target=self.dispatch_updates, daemon=True)
+		self.server_thread = threading.Thread(target=self.http_server.serve_forever, daemon=True)
+
+	@property
+	def port(self):
+		return self.http_server.server_address[1]
+
+	def create_request_handler(self):
+		webhook_server = self
+
+		class RequestHandler(http.server.BaseHTTPRequestHandler):
+			def do_POST(self):
+				status_code = webhook_server.handle_request(self.path, self.headers, self.read_body())
+				self.send_response(status_code)
+				self.send_header("Content-Length", "0")
+				self.end_headers()
+
+			def read_body(self):
+				try:
+					content_length = int(self.headers.get("Content-Length", 0))
+				except ValueError:
+					return b""
+				return self.rfile.read(content_length)
+
+			def log_message(self, format, *args):
+				logging.debug(f"Webhook request from {self.address_string()}: {format % args}")
+
+		return RequestHandler
+
+	def handle_request(self, path: str, headers, body: bytes):
+		if urllib.parse.urlparse(path).path != self.path:
+			return 404
+
+		received_token = headers.get(SECRET_TOKEN_HEADER) or ""
+		if not hmac.compare_digest(received_token.encode(), self.secret_token.encode()):
+			logging.warning("Webhook request with invalid secret token was rejected")
+			return 403
+
+		try:
+			update = telebot.types.Update.de_json(json.loads(body))
+		except (ValueError, KeyError, TypeError) as E:
+			logging.error(f"Can't parse webhook update - {E}")
+			return 400
+
+		self.updates.put(update)
+		return 200
+
+	def dispatch_updates(self):
+		while True:
+			update = self.updates.get()
+			if update is None:
+				return
+			try:
+				self.bot.process_new_updates([update])
+			except Exception as E:
+				logging.exception(f"Exception during processing of update {update.update_id} - {E}")
+
+			# handlers run in the worker pool, their exceptions are reported here instead of the polling
+			if getattr(self.bot, "worker_pool", None):
+				try:
+					self.bot.worker_pool.raise_exceptions()
+				except Exception as E:
+					logging.error(f"Exception in update handler - {E}")
+					self.bot.worker_pool.clear_exceptions()
+
+	def start(self):
+		self.dispatcher_thread.start()
+		self.server_thread.start()
+		return self
+
+	def stop(self):
+		self.http_server.shutdown()
+		self.http_server.server_close()
+		self.updates.put(None)
+		self.dispatcher_thread.join()
+
+
+def run_webhook(bot: telebot.TeleBot, allowed_updates: list):
+	"""
+	Registers webhook with the Telegram and handles updates until the process is stopped.
+	"""
+	secret_token = config_utils.WEBHOOK_SECRET_TOKEN or secrets.token_urlsafe(32)
+	path = urllib.parse.urlparse(config_utils.WEBHOOK_URL).path or "/"
+	webhook_server = WebhookServer(bot, config_utils.WEBHOOK_HOST, config_utils.WEBHOOK_PORT, path, secret_token).start()
+	logging.info(f"Webhook server is listening on {config_utils.WEBHOOK_HOST}:{webhook_server.port}{path}")
+
+	bot.set_webhook(url=config_utils.WEBHOOK_URL, allowed_updates=allowed_updates, secret_token=secret_token,
+					max_connections=config_utils.WEBHOOK_MAX_CONNECTIONS)
+	webhook_server.server_thread.join()